@@ -1,16 +1,17 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from datetime import datetime
 import traceback
-import requests
+import os
 import json
 import sys
-from urllib.parse import urlparse
-from get_domain import getGood2LD, getFullDomain, getDomainOfLevel
+from crawl_output import load_output, list_outputs, ANALYSIS_SCHEMA
+from url_classifier import UrlClassifier
+from script_store import ScriptStore
+from topics_analysis import CSV_HEADER, read_domains_file, read_allowed_domains_file, read_consent_managers_file, analyze_output, get_csv_row, \
+                            get_outfile_name, content_has_browsing_topics
 
-GOOGLE_TAG_MANAGER_DOMAIN = "googletagmanager.com"
-
-CMP_DOMAIN_EXCEPTIONS = [ "2badvice-cdn.azureedge.net", "fundingchoicesmessages.google.com", "optanon.blob.core.windows.net", "cookie-sl.s3.*.amazonaws.com" ]
-CMP_DOMAIN_EXCEPTIONS_2LD = [ getGood2LD(domain) for domain in CMP_DOMAIN_EXCEPTIONS ]
 
 parser = argparse.ArgumentParser()
 parser.add_argument('infile', type=str)
@@ -21,6 +22,12 @@ parser.add_argument('--consent_managers_file', type=str, default='consent-manage
 parser.add_argument('--outfile', type=str, default='topics_output.json')
 parser.add_argument('--pretty_print', action='store_true')
 parser.add_argument('--check_script_content', action='store_true')
+parser.add_argument('--script_store', type=str, default=None)
+parser.add_argument('--batch', action='store_true')
+parser.add_argument('--outdir', type=str, default='.')
+parser.add_argument('--csv_file', type=str, default=None)
+parser.add_argument('--workers', type=int, default=os.cpu_count())
+parser.add_argument('--resume', action='store_true')
 
 globals().update(vars(parser.parse_args()))
 
@@ -30,133 +37,88 @@ def log(str):
     print(datetime.now().strftime("[%Y-%m-%d %H:%M:%S]"), str)
     log_entries.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), str))
 
-def read_domains_file(file_path):
-    with open(file_path) as file:
-        domains = { line.split(",")[0].strip() for line in file.readlines() if not line.startswith("#") }
-    return domains
-
 def main():
-    input_json = json.load(open(infile))
-    
-    data = {}
-    attested_domains = read_domains_file(attested_domains_file)
-    allowed_domains = read_domains_file(allowed_domains_file)
-    consent_managers = { (getFullDomain(domain) if getGood2LD(domain) in CMP_DOMAIN_EXCEPTIONS_2LD else getGood2LD(domain)) for domain in read_domains_file(consent_managers_file) }
-
-    data["url"] = input_json["first"]["requests"][0]["documentURL"]
-    for stage in [ "first", "second" ]:
-        visit_data = input_json.get(stage)
-        if visit_data is None:
-            continue
-        log(f"Analyzing data for stage {stage}")
-        data[stage] = get_topics_api_data(visit_data, attested_domains, allowed_domains, consent_managers)
-    
-    # Save whether accept button has been clicked
-    clicked_element = input_json.get("banner_data", {}).get("clicked_element")
-    data["banner_clicked"] = clicked_element is not None
+    if batch:
+        analyze_batch()
+        return
 
+    load_reference_lists()
+    data = analyze_file(infile)
     json.dump(data, open(outfile, "w"), indent=4 if pretty_print else None)
 
     data["log_entries"] = log_entries
     log("All Done")
 
-def get_topics_api_data(network_data, attested_domains, allowed_domains, consent_managers):
-    requests = network_data["requests"]
-    responses = network_data["responses"]
-
-    # Map the Origin URL to the API usage object
-    topics_api_usages_map = { obj["context_origin_url"]: obj for obj in network_data["topics_api_usages"] }
-
-    data = { "attested_domains": set(), "allowed_domains": set(), "consent_managers": set(), "has_gtm": False }
-    for request in requests:
-        url = request["request"]["url"]
-        domain = getGood2LD(url)
-        if domain in attested_domains:
-            data["attested_domains"].add(domain)
-        if domain in allowed_domains:
-            data["allowed_domains"].add(domain)
-
-        cmp_domain = next((cmp for cmp in consent_managers if cmp == getDomainOfLevel(url, len(cmp.split(".")))), None)
-        if cmp_domain is not None:
-            data["consent_managers"].add(cmp_domain)
-
-        if domain == GOOGLE_TAG_MANAGER_DOMAIN:
-            data["has_gtm"] = True
-
-        origin = get_origin(url)
-        topics_api_usage = topics_api_usages_map.get(origin)
-        if topics_api_usage is None:
-            continue
-
-        headers = request["request"]["headers"]
-        if topics_api_usage["caller_source"] in ["fetch", "iframe"] and ("sec-browsing-topics" in headers or "Sec-Browsing-Topics" in headers):
-            topics_api_usage["possible_callers"] = topics_api_usage.get("possible_callers", [])
-            topics_api_usage["possible_callers"].append({ "url": url, "reason": "header-request" })
-
-    for response in responses:
-        url = response["response"]["url"]
-        domain = getGood2LD(url)
-        if domain in attested_domains:
-            data["attested_domains"].add(domain)
-        if domain in allowed_domains:
-            data["allowed_domains"].add(domain)
-        
-        cmp_domain = next((cmp for cmp in consent_managers if cmp == getDomainOfLevel(url, len(cmp.split(".")))), None)
-        if cmp_domain is not None:
-            data["consent_managers"].add(cmp_domain)
-
-        if domain == GOOGLE_TAG_MANAGER_DOMAIN:
-            data["has_gtm"] = True
-
-        origin = get_origin(url)
-        topics_api_usage = topics_api_usages_map.get(origin)
-        if topics_api_usage is None:
-            continue
-        
-        headers = response["response"]["headers"]
-        if topics_api_usage["caller_source"] in ["fetch", "iframe"] and ("observe-browsing-topics" in headers or "Observe-Browsing-Topics" in headers):
-            topics_api_usage["possible_callers"] = topics_api_usage.get("possible_callers", [])
-            topics_api_usage["possible_callers"].append({ "url": url, "reason": "header-response" })
-
-        content_type = headers.get("content-type") or headers.get("Content-Type")
-        if topics_api_usage["caller_source"] == "javascript" and content_type is not None:
-            if check_script_content and ('text/javascript' in content_type or "application/javascript" in content_type) and content_has_browsing_topics(url):
-                topics_api_usage["possible_callers"] = topics_api_usage.get("possible_callers", [])
-                topics_api_usage["possible_callers"].append({ "url": url, "reason": "browsingtopics-in-script" })
-
-    data["topics_api_usages"] = [
-        {
-            **usage,
-            "allowed": getGood2LD(usage["context_origin_url"]) in allowed_domains,
-            "attested": getGood2LD(usage["context_origin_url"]) in attested_domains
-        }
-        for usage in topics_api_usages_map.values()
-    ]
-    
-    data["attested_domains"] = list(data["attested_domains"])
-    data["allowed_domains"] = list(data["allowed_domains"])
-    data["consent_managers"] = list(data["consent_managers"])
-
-    return data
-
-def content_has_browsing_topics(url: str) -> bool:
+def load_reference_lists():
+    global attested_domains
+    global allowed_domains
+    global consent_managers
+    global classifier
+    global scripts
+
+    attested_domains = read_domains_file(attested_domains_file)
+    allowed_domains = read_allowed_domains_file(allowed_domains_file)
+    consent_managers = read_consent_managers_file(consent_managers_file)
+    classifier = UrlClassifier(attested_domains, allowed_domains, consent_managers)
+    scripts = ScriptStore(script_store) if script_store is not None else None
+
+def analyze_file(path):
+    log(f"Analyzing {path}")
+    input_json = load_output(path, ANALYSIS_SCHEMA)
+    return analyze_output(input_json, classifier, partial(content_has_browsing_topics, timeout=timeout) if check_script_content else None,
+                          scripts)
+
+def analyze_batch():
+    # Analyze all the outputs in a folder (or listed in a file) with a pool of processes, reading the reference lists once per process
+    if os.path.isdir(infile):
+        paths = list_outputs(infile)
+    else:
+        with open(infile) as file:
+            paths = [ line.strip() for line in file if line.strip() != "" ]
+    log(f"Analyzing {len(paths)} file(s)")
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # Build the index of the attestations list, if needed, once for all the workers
+    read_allowed_domains_file(allowed_domains_file)
+    csv_out = None
+    if csv_file is not None:
+        csv_out = open(csv_file, "w")
+        csv_out.write(",".join(CSV_HEADER) + "\n")
+
+    failed = 0
+    # Every worker reads the reference lists, as they are not inherited with the spawn start method
+    with ProcessPoolExecutor(workers, initializer=load_reference_lists) as executor:
+        for i, (path, row) in enumerate(executor.map(analyze_batch_file, paths, chunksize=16)):
+            if row is None:
+                failed += 1
+            elif csv_out is not None:
+                csv_out.write(row + "\n")
+            if (i + 1) % 1000 == 0:
+                log(f"Analyzed {i + 1}/{len(paths)} file(s)")
+
+    if csv_out is not None:
+        csv_out.close()
+    log(f"All Done, {failed} file(s) failed")
+
+def analyze_batch_file(path):
+    # Runs in a worker process: writes the analysis of a single output and returns its CSV row, None on failure
+    outfile_path = os.path.join(outdir, get_outfile_name(path))
     try:
-        r = requests.get(url, timeout=timeout)
-        return r.status_code == 200 and "browsingtopics" in r.text.lower()
-    except:
-        # Connection error or invalid URL, suppose the script does not contain API calls
-        return False
-
-def get_origin(url):
-    parse_result = urlparse(url)
-    return "{}://{}/".format(parse_result.scheme, parse_result.netloc)
-
-def is_url(url):
-  try:
-    result = urlparse(url)
-    return all([result.scheme, result.netloc])
-  except ValueError:
-    return False
+        if resume and os.path.exists(outfile_path):
+            with open(outfile_path) as file:
+                data = json.load(file)
+        else:
+            data = analyze_file(path)
+            with open(outfile_path, "w") as file:
+                json.dump(data, file, indent=4 if pretty_print else None)
+        return path, get_csv_row(data)
+    except Exception as e:
+        log(f"Exception while analyzing {path}: {e}")
+        return path, None
+    finally:
+        log_entries.clear()
 
 if __name__ == "__main__":
 
@@ -1,40 +1,113 @@
 import argparse
+import asyncio
 import requests
 import json
 from json.decoder import JSONDecodeError
+import socket
 import sys
 import time
+from collections import Counter
+from attestation_cache import AttestationCache, AttestationResult, is_fresh, get_result, get_conditional_headers
 
 DEFAULT_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+ATTESTATION_URL_TEMPLATE = "https://{}/.well-known/privacy-sandbox-attestations.json"
 
 parser = argparse.ArgumentParser()
-parser.add_argument('domain', type=str)
+parser.add_argument('domain', type=str, nargs='?', default=None)
 parser.add_argument('--timeout', type=int, default=60)
 parser.add_argument('--user_agent', type=str, default=DEFAULT_USER_AGENT)
+parser.add_argument('--bulk', type=str, default=None)
+parser.add_argument('--concurrency', type=int, default=200)
+parser.add_argument('--dns_timeout', type=int, default=5)
+parser.add_argument('--url_template', type=str, default=ATTESTATION_URL_TEMPLATE)
+parser.add_argument('--resolve_to', type=str, default=None)
+parser.add_argument('--cache', type=str, default=None)
+parser.add_argument('--hit_ttl', type=int, default=7 * 24 * 3600)
+parser.add_argument('--miss_ttl', type=int, default=24 * 3600)
+parser.add_argument('--error_ttl', type=int, default=3600)
+parser.add_argument('--revalidate', action='store_true')
 
 def main(args):
-    sandbox_attestation = get_privacy_sandbox_attestation_data(args.domain, args.timeout, args.user_agent)
-    if sandbox_attestation is not None:
-        print(f"Found attested domain {args.domain}", file=sys.stderr)
-        sandbox_attestation_csv = json.dumps(sandbox_attestation).replace('"', '""')
-        print(f'{args.domain},"{sandbox_attestation_csv}"')
+    if args.bulk is None and args.domain is None:
+        parser.error("either a domain or --bulk is required")
 
-def get_privacy_sandbox_attestation_data(domain, timeout, user_agent):
+    cache = None
+    if args.cache is not None:
+        cache = AttestationCache(args.cache, args.hit_ttl, args.miss_ttl, args.error_ttl)
+
+    try:
+        if args.bulk is not None:
+            asyncio.run(attest_domains_bulk(args, cache))
+            return
+
+        entry = get_cache_entry(cache, args.domain)
+        if use_cache_entry(entry, args):
+            result = get_result(entry)
+        else:
+            result = fetch_attestation(args.domain, args.timeout, args.user_agent, args.url_template, get_conditional_headers(entry))
+            result = update_cache(cache, args.domain, entry, result)
+        if result.status == "hit":
+            print_attestation(args.domain, result.attestation)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def get_cache_entry(cache, domain):
+    return cache.get(domain) if cache is not None else None
+
+def use_cache_entry(entry, args):
+    # With --revalidate, results that can be revalidated are always checked against the server
+    if entry is None or not is_fresh(entry):
+        return False
+    return not args.revalidate or len(get_conditional_headers(entry)) == 0
+
+def update_cache(cache, domain, entry, result):
+    # Store the result of a fetch, returning the cached result if the attestation file has not been modified
+    if result.status == "not-modified" and entry is None:
+        result = result._replace(status="miss")
+    elif result.status == "not-modified":
+        result = get_result(entry)._replace(etag=result.etag or entry.etag, last_modified=result.last_modified or entry.last_modified)
+        # An unchanged file is not valid forever: its attestations may have expired since it was fetched
+        if result.status == "hit" and check_attestation_json(result.attestation) is None:
+            result = result._replace(status="miss", attestation=None)
+    if cache is not None:
+        cache.put(domain, result)
+    return result
+
+def print_attestation(domain, sandbox_attestation):
+    print(f"Found attested domain {domain}", file=sys.stderr)
+    sandbox_attestation_csv = json.dumps(sandbox_attestation).replace('"', '""')
+    print(f'{domain},"{sandbox_attestation_csv}"', flush=True)
+
+def get_privacy_sandbox_attestation_data(domain, timeout, user_agent, url_template=ATTESTATION_URL_TEMPLATE):
+    return fetch_attestation(domain, timeout, user_agent, url_template).attestation
+
+def fetch_attestation(domain, timeout, user_agent, url_template=ATTESTATION_URL_TEMPLATE, headers=None):
     try:
-        r = requests.get("https://{}/.well-known/privacy-sandbox-attestations.json".format(domain), headers={ "User-Agent": user_agent }, timeout=timeout, verify=False)
-    except Exception as e:
+        r = requests.get(url_template.format(domain), headers={ "User-Agent": user_agent, **(headers or {}) }, timeout=timeout, verify=False)
+    except Exception:
         # Connection error or invalid URL, suppose the domain is not valid
-        return None
+        return AttestationResult("error", None, None, None, None)
 
-    if not r.ok:
-        return None
+    return get_attestation_result(r.status_code, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+def get_attestation_result(http_status, body, etag, last_modified):
+    if http_status == 304:
+        return AttestationResult("not-modified", http_status, None, etag, last_modified)
+    if http_status >= 400:
+        return AttestationResult("miss", http_status, None, etag, last_modified)
 
     # Document is a JSON object, check if it contains valid information
     try:
-        attestation_json = r.json()
-    except JSONDecodeError as e:
-        return None
-    
+        attestation_json = json.loads(body)
+    except (JSONDecodeError, UnicodeDecodeError):
+        return AttestationResult("miss", http_status, None, etag, last_modified)
+
+    attestation_json = check_attestation_json(attestation_json)
+    return AttestationResult("hit" if attestation_json is not None else "miss", http_status, attestation_json, etag, last_modified)
+
+def check_attestation_json(attestation_json):
+    # Return the attestation file if it contains valid attestations for the Topics API, None otherwise
     try:
         valid_sandbox_attestations = get_valid_sandbox_attestations(attestation_json)
     except:
@@ -45,6 +118,85 @@ def get_privacy_sandbox_attestation_data(domain, timeout, user_agent):
 
     return attestation_json
 
+async def attest_domains_bulk(args, cache):
+    # Check many domains with a bounded number of concurrent requests, printing attested domains as they are found.
+    # Domains with a fresh result in the cache are not contacted
+    import aiohttp
+
+    with (sys.stdin if args.bulk == "-" else open(args.bulk)) as file:
+        domains = [ line.strip() for line in file if line.strip() != "" and not line.startswith("#") ]
+    print(f"Checking {len(domains)} domain(s)", file=sys.stderr)
+
+    queue = asyncio.Queue()
+    counts = Counter()
+    for domain in domains:
+        entry = get_cache_entry(cache, domain)
+        if use_cache_entry(entry, args):
+            counts["cached"] += 1
+            if entry.status == "hit":
+                print_attestation(domain, entry.attestation)
+        else:
+            queue.put_nowait((domain, entry))
+    print(f"{counts['cached']} domain(s) found in cache, {queue.qsize()} to fetch", file=sys.stderr)
+
+    resolver = CachingResolver(args.dns_timeout, args.resolve_to)
+    connector = aiohttp.TCPConnector(limit=args.concurrency, ssl=False, resolver=resolver, use_dns_cache=False)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={ "User-Agent": args.user_agent }) as session:
+        workers = [ asyncio.create_task(attest_domains_worker(session, queue, args.url_template, cache, counts)) for _ in range(args.concurrency) ]
+        await asyncio.gather(*workers)
+    print("Results: {}".format(", ".join(f"{status}={count}" for status, count in counts.most_common())), file=sys.stderr)
+
+async def attest_domains_worker(session, queue, url_template, cache, counts):
+    while not queue.empty():
+        domain, entry = queue.get_nowait()
+        result = await fetch_attestation_async(session, domain, url_template, get_conditional_headers(entry))
+        counts[result.status] += 1
+        result = update_cache(cache, domain, entry, result)
+        if result.status == "hit":
+            print_attestation(domain, result.attestation)
+
+async def fetch_attestation_async(session, domain, url_template, headers=None):
+    try:
+        async with session.get(url_template.format(domain), headers=headers) as r:
+            body = await r.read() if r.status < 400 else b""
+            return get_attestation_result(r.status, body, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    except Exception:
+        # Connection error, DNS error, timeout or invalid URL, suppose the domain is not valid
+        return AttestationResult("error", None, None, None, None)
+
+class CachingResolver:
+    # aiohttp resolver caching results, including failures, and giving up on hosts that do not resolve within
+    # a timeout. If resolve_to is set, every host resolves to that address, e.g. a local stand-in server
+
+    def __init__(self, timeout, resolve_to=None):
+        self.timeout = timeout
+        self.resolve_to = resolve_to
+        self.cache = {}
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        key = (host, port, family)
+        if key not in self.cache:
+            self.cache[key] = asyncio.ensure_future(self.getaddrinfo(host, port, family))
+        result = await self.cache[key]
+        if isinstance(result, OSError):
+            raise result
+        return result
+
+    async def getaddrinfo(self, host, port, family):
+        address = host if self.resolve_to is None else self.resolve_to
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(address, port, type=socket.SOCK_STREAM, family=family), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            return OSError(f"Could not resolve {host}: {e}")
+        return [ { "hostname": host, "host": address[0], "port": address[1], "family": family, "proto": proto,
+                   "flags": socket.AI_NUMERICHOST | socket.AI_NUMERICSERV }
+                 for family, _, proto, _, address in infos ]
+
+    async def close(self):
+        pass
+
 def get_valid_sandbox_attestations(json):
     expired = True
     valid_attestations = []
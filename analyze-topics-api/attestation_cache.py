@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+COMMIT_INTERVAL = 100
+
+# Outcome of fetching the attestation file of a domain: "hit" if it attests the Topics API, "miss" if the file is
+# missing or not valid, "error" if it could not be fetched at all (e.g. DNS or connection error, timeout)
+AttestationResult = namedtuple("AttestationResult", ["status", "http_status", "attestation", "etag", "last_modified"])
+
+CacheEntry = namedtuple("CacheEntry", ["domain", "status", "http_status", "attestation", "etag", "last_modified",
+                                       "fetched", "expires"])
+
+
+class AttestationCache:
+    # Persistent cache of attestation results, shared by campaigns and vantage points. Each result expires after a
+    # TTL depending on its status, and hits never outlive the expiry of their attestation file
+
+    def __init__(self, path, hit_ttl, miss_ttl, error_ttl):
+        self.ttls = { "hit": hit_ttl, "miss": miss_ttl, "error": error_ttl }
+        self.pending = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS attestations (\
+                               domain TEXT PRIMARY KEY, status TEXT, http_status INTEGER, attestation TEXT,\
+                               etag TEXT, last_modified TEXT, fetched REAL, expires REAL)")
+        self.conn.commit()
+
+    def get(self, domain):
+        row = self.conn.execute("SELECT domain, status, http_status, attestation, etag, last_modified, fetched, expires\
+                                 FROM attestations WHERE domain = ?", [domain]).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        return entry._replace(attestation=json.loads(entry.attestation) if entry.attestation is not None else None)
+
+    def put(self, domain, result):
+        now = time.time()
+        expires = now + self.ttls[result.status]
+        if result.status == "hit":
+            expires = min(expires, get_attestation_expiry(result.attestation, expires))
+        self.conn.execute("INSERT OR REPLACE INTO attestations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          [domain, result.status, result.http_status,
+                           json.dumps(result.attestation) if result.attestation is not None else None,
+                           result.etag, result.last_modified, now, expires])
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def is_fresh(entry):
+    return entry.expires > time.time()
+
+
+def get_result(entry):
+    return AttestationResult(entry.status, entry.http_status, entry.attestation, entry.etag, entry.last_modified)
+
+
+def get_conditional_headers(entry):
+    # Headers to revalidate a cached result, so that an unchanged attestation file is not downloaded again
+    headers = {}
+    if entry is None or entry.status == "error":
+        return headers
+    if entry.etag is not None:
+        headers["If-None-Match"] = entry.etag
+    if entry.last_modified is not None:
+        headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+def get_attestation_expiry(attestation_json, default):
+    # Time when all the attestations in the file are expired
+    expiries = [ sandbox_attestation.get("expiry_seconds_since_epoch")
+                 for sandbox_attestation in attestation_json.get("privacy_sandbox_api_attestations", []) ]
+    if len(expiries) == 0 or not all(isinstance(expiry, (int, float)) for expiry in expiries):
+        # Attestations without expiry never expire
+        return default
+    return max(expiries)
@@ -0,0 +1 @@
+../privacy-sandbox-attestations/attestations_index.py
\ No newline at end of file
@@ -0,0 +1,94 @@
+import os
+from get_domain import getGood2LD
+
+PARTITION_FILE = "part-0.parquet"
+
+
+def get_schemas():
+    # Tables of the dataset, one row per: visit of a site, Topics API usage, Attested or Allowed domain contacted, and
+    # consent manager found. Every table has the site domain and the visit stage, so that they can be joined together
+    import pyarrow as pa
+
+    return {
+        "visits": pa.schema([
+            ("domain", pa.string()), ("stage", pa.string()), ("banner_clicked", pa.bool_()), ("has_gtm", pa.bool_()),
+            ("topics_api_usages", pa.int32()), ("attested_domains", pa.int32()), ("allowed_domains", pa.int32()),
+            ("consent_managers", pa.int32())
+        ]),
+        "topics_api_usages": pa.schema([
+            ("domain", pa.string()), ("stage", pa.string()), ("context_origin_url", pa.string()),
+            ("context_domain", pa.string()), ("caller_source", pa.string()), ("usage_time", pa.int64()),
+            ("allowed", pa.bool_()), ("attested", pa.bool_()),
+            ("possible_callers", pa.list_(pa.struct([ ("url", pa.string()), ("reason", pa.string()) ])))
+        ]),
+        "domains": pa.schema([
+            ("domain", pa.string()), ("stage", pa.string()), ("third_party", pa.string()),
+            ("attested", pa.bool_()), ("allowed", pa.bool_())
+        ]),
+        "consent_managers": pa.schema([
+            ("domain", pa.string()), ("stage", pa.string()), ("consent_manager", pa.string())
+        ])
+    }
+
+
+class CampaignDatasetWriter:
+    # Normalised, columnar version of the analyses of a crawl, written as Parquet files partitioned by campaign date
+    # and vantage location: <dataset_dir>/<table>/date=<date>/location=<location>/part-0.parquet. Writing a campaign
+    # again replaces its partitions only
+
+    def __init__(self, dataset_dir, date, location):
+        self.dataset_dir = dataset_dir
+        self.date = date
+        self.location = location
+        self.schemas = get_schemas()
+        self.columns = { table: { name: [] for name in schema.names } for table, schema in self.schemas.items() }
+
+    def add(self, data):
+        # Add the analysis of a site, as produced by analyze-topics-api.py
+        domain = data["url"]
+        for stage in [ "first", "second" ]:
+            visit_data = data.get(stage)
+            if visit_data is None:
+                continue
+            self.add_row("visits", domain=domain, stage=stage, banner_clicked=data.get("banner_clicked"),
+                         has_gtm=visit_data["has_gtm"], topics_api_usages=len(visit_data["topics_api_usages"]),
+                         attested_domains=len(visit_data["attested_domains"]),
+                         allowed_domains=len(visit_data["allowed_domains"]),
+                         consent_managers=len(visit_data["consent_managers"]))
+            for usage in visit_data["topics_api_usages"]:
+                self.add_row("topics_api_usages", domain=domain, stage=stage, context_origin_url=usage["context_origin_url"],
+                             context_domain=getGood2LD(usage["context_origin_url"]), caller_source=usage["caller_source"],
+                             usage_time=usage["usage_time"], allowed=usage["allowed"], attested=usage["attested"],
+                             possible_callers=usage.get("possible_callers", []))
+            attested_domains = set(visit_data["attested_domains"])
+            allowed_domains = set(visit_data["allowed_domains"])
+            for third_party in sorted(attested_domains | allowed_domains):
+                self.add_row("domains", domain=domain, stage=stage, third_party=third_party,
+                             attested=third_party in attested_domains, allowed=third_party in allowed_domains)
+            for consent_manager in sorted(visit_data["consent_managers"]):
+                self.add_row("consent_managers", domain=domain, stage=stage, consent_manager=consent_manager)
+
+    def add_row(self, table, **row):
+        for name, values in self.columns[table].items():
+            values.append(row[name])
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for table, schema in self.schemas.items():
+            partition_dir = os.path.join(self.dataset_dir, table, "date={}".format(self.date), "location={}".format(self.location))
+            if not os.path.exists(partition_dir):
+                os.makedirs(partition_dir)
+            pq.write_table(pa.table(self.columns[table], schema=schema), os.path.join(partition_dir, PARTITION_FILE))
+
+
+def read_table(dataset_dir, table, columns=None, filters=None):
+    # Read a table of the dataset, with the date and location of the campaigns as columns. Only the given columns
+    # are read, and only from the partitions matching the filters, e.g. [("location", "=", "it")]
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    partitioning = ds.partitioning(pa.schema([ ("date", pa.string()), ("location", pa.string()) ]), flavor="hive")
+    return pq.read_table(os.path.join(dataset_dir, table), columns=columns, filters=filters, partitioning=partitioning)
@@ -0,0 +1,41 @@
+import re
+
+
+class ConsentManagerIndex:
+    # Index of consent manager domains, answering which consent manager (if any) owns a host with one set lookup
+    # per label depth. Domains can contain "*" wildcards, e.g. cookie-sl.s3.*.amazonaws.com, matching any
+    # characters within a single label.
+
+    def __init__(self, domains):
+        self.domains_by_depth = {}
+        self.patterns_by_depth = {}
+        for domain in domains:
+            domain = domain.strip(".").lower()
+            depth = len(domain.split("."))
+            if "*" in domain:
+                regex = re.compile("(?:^|\\.)" + "[^.]*".join(re.escape(part) for part in domain.split("*")) + "$")
+                self.patterns_by_depth.setdefault(depth, []).append((domain, regex))
+            else:
+                self.domains_by_depth.setdefault(depth, set()).add(domain)
+        # Most specific match first
+        self.depths = sorted(set(self.domains_by_depth) | set(self.patterns_by_depth), reverse=True)
+
+    def lookup(self, host):
+        # Return the consent manager domain which host belongs to, None if none does
+        if host is None:
+            return None
+        labels = host.strip(".").lower().split(".")
+        for depth in self.depths:
+            if depth > len(labels):
+                continue
+            suffix = ".".join(labels[-depth:])
+            if suffix in self.domains_by_depth.get(depth, ()):
+                return suffix
+            for domain, regex in self.patterns_by_depth.get(depth, ()):
+                if regex.search(suffix):
+                    return domain
+        return None
+
+    def __len__(self):
+        return sum(len(domains) for domains in self.domains_by_depth.values()) + \
+               sum(len(patterns) for patterns in self.patterns_by_depth.values())
@@ -0,0 +1,155 @@
+import gzip
+import io
+import json
+import os
+import re
+from json.decoder import JSONDecodeError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Extension of the outputs still being written by the crawler, or left by a killed visit
+PARTIAL_EXTENSION = ".part"
+# Traces and profiles written by the crawler next to its outputs, with --trace and --profile
+NON_OUTPUT_EXTENSIONS = (PARTIAL_EXTENSION, ".trace.json", ".trace.json.gz", ".prof", ".samples.txt")
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Phase and kind at the start of each line written by the crawler in JSON Lines format
+RECORD_PREFIX_REGEX = re.compile(r'^\{"phase": (?:null|"([^"]*)"), "kind": "([^"]*)"')
+
+# Parts of an output read by the analysis tools. True selects a whole value, a dict selects some of its keys and
+# a list holding a single schema selects the same parts of each of its items
+VISIT_SCHEMA = {
+    "requests": [ { "documentURL": True, "request": { "url": True, "headers": True } } ],
+    "responses": [ { "response": { "url": True, "headers": True } } ],
+    "topics_api_usages": True,
+    "scripts": [ { "url": True, "sha256": True } ]
+}
+ANALYSIS_SCHEMA = { "first": VISIT_SCHEMA, "second": VISIT_SCHEMA, "banner_data": { "clicked_element": True } }
+DOMAINS_SCHEMA = {
+    stage: { "requests": [ { "request": { "url": True } } ], "responses": [ { "response": { "url": True } } ] }
+    for stage in [ "first", "second" ]
+}
+
+
+def list_outputs(folder):
+    # Outputs in a folder, without the partial ones and the other files of the crawler
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if not name.endswith(NON_OUTPUT_EXTENSIONS))
+
+
+def open_output(path):
+    # Open a Priv-Accept output as text, decompressing it if needed
+    file = open(path, "rb")
+    magic = file.read(4)
+    file.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(file, "rt")
+    if magic == ZSTD_MAGIC:
+        import zstandard
+        return zstandard.open(file, "rt")
+    return io.TextIOWrapper(file)
+
+
+def loads(text):
+    # orjson if installed, falling back to json for what orjson rejects, e.g. NaN
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def is_record(obj):
+    return isinstance(obj, dict) and "phase" in obj and "kind" in obj and ("value" in obj or "event" in obj)
+
+
+def iter_records(path):
+    # Yield the records of an output in JSON Lines format one at a time, as written by the crawler
+    with open_output(path) as file:
+        for line in file:
+            if line.strip() != "":
+                try:
+                    yield loads(line)
+                except JSONDecodeError:
+                    if not is_cut_short(line):
+                        raise
+
+
+def load_output(path, schema=None):
+    # Load a Priv-Accept output, either a JSON document or JSON Lines, in the structure of the JSON document.
+    # With a schema, only the selected parts are kept: the lines of a JSON Lines output holding other parts are
+    # not even decoded
+    with open_output(path) as file:
+        first_line = file.readline()
+        try:
+            record = loads(first_line)
+        except JSONDecodeError:
+            # Pretty-printed JSON document
+            return select(loads(first_line + file.read()), schema)
+        if not is_record(record):
+            # Minified JSON document
+            return select(record, schema)
+
+        data = {"first": None, "click": None, "second": None, "banner_data": None,
+                "log": None, "stats": None, "internal": None}
+        add_record(data, record, schema)
+        for line in file:
+            if line.strip() == "":
+                continue
+            if schema is not None:
+                match = RECORD_PREFIX_REGEX.match(line)
+                if match is not None and get_record_schema(schema, match.group(1), match.group(2)) is None:
+                    continue
+            try:
+                record = loads(line)
+            except JSONDecodeError:
+                if not is_cut_short(line):
+                    raise
+                continue
+            add_record(data, record, schema)
+        return data
+
+
+def is_cut_short(line):
+    # Only the last line of the output of a visit failed after its checkpoint can be cut short, and it has no newline
+    return not line.endswith("\n")
+
+
+def get_record_schema(schema, phase, kind):
+    # Schema of the value of a record, None if the record is not selected
+    if phase is not None:
+        schema = schema.get(phase)
+        if schema is None or schema is True:
+            return schema
+    return schema.get(kind)
+
+
+def add_record(data, record, schema=None):
+    phase = record["phase"]
+    kind = record["kind"]
+    if schema is not None:
+        schema = get_record_schema(schema, phase, kind)
+        if schema is None:
+            return
+    if phase is None:
+        data[kind] = select(record["value"], schema)
+        return
+    if data.get(phase) is None:
+        data[phase] = {}
+    if "event" in record:
+        data[phase][kind].append(select(record["event"], schema[0] if isinstance(schema, list) else None))
+    else:
+        data[phase][kind] = select(record["value"], schema)
+
+
+def select(value, schema):
+    # The parts of value selected by schema
+    if schema is None or schema is True or value is None:
+        return value
+    if isinstance(schema, list):
+        return [ select(item, schema[0]) for item in value ]
+    return { key: select(value[key], schema[key]) for key in schema if key in value }
@@ -1,15 +1,14 @@
 import argparse
-import json
 import sys
 from get_domain import getGood2LD
+from crawl_output import load_output, DOMAINS_SCHEMA
 
 parser = argparse.ArgumentParser()
 parser.add_argument('input_file', type=str)
 parser.add_argument('--visit', choices=['first', 'second', 'both'], default='both')
 
 def main(args):
-    with open(args.input_file, "r") as input_json_file:
-        input_json = json.load(input_json_file)
+    input_json = load_output(args.input_file, DOMAINS_SCHEMA)
     domains = extract_domains(input_json, args.visit)
     print(f"Found {len(domains)} domain(s) in {args.input_file}", file=sys.stderr)
     for domain in domains:
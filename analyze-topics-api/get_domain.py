@@ -1,54 +1,124 @@
-from urllib.parse import urlparse
+import os
+import pickle
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+# Registrable domains are computed with the Public Suffix List (https://publicsuffix.org/list/), including the
+# private domains section, as Chrome does to determine the site of a URL. To update the list:
+#   wget https://publicsuffix.org/list/public_suffix_list.dat -O public_suffix_list.dat
+PUBLIC_SUFFIX_LIST_FILE = os.environ.get("PUBLIC_SUFFIX_LIST_FILE",
+                                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat"))
+PUBLIC_SUFFIX_CACHE_VERSION = 1
+HOST_CACHE_SIZE = 1 << 17
+
+public_suffix_rules = None
 
-bad_domains=set("co.uk co.jp co.hu co.il com.au co.ve .co.in com.ec com.pk co.th co.nz com.br com.sg com.sa \
-com.do co.za com.hk com.mx com.ly com.ua com.eg com.pe com.tr co.kr com.ng com.pe com.pk co.th \
-com.au com.ph com.my com.tw com.ec com.kw co.in co.id com.com com.vn com.bd com.ar \
-com.co com.vn org.uk net.gr web.app".split())
 
 def getGood2LD(url):
-    fqdn = getFullDomain(url)
-    if len(fqdn) == 0:
+    return getGood2LDOfDomain(getFullDomain(url))
+
+def getGood2LDOfDomain(fqdn):
+    # Same as getGood2LD, for a domain already extracted from its URL
+    if fqdn is None or len(fqdn) == 0:
         return None
-    if fqdn[-1] == ".":
-        fqdn = fqdn[:-1]    
-    names = fqdn.split(".")
-    if ".".join(names[-2:]) in bad_domains:
-        return get3LD(fqdn)
-    tln_array = names[-2:]
-    tln = ""
-    for s in tln_array:
-        tln = tln + "." + s
-    return tln[1:]
+    return getRegistrableDomain(fqdn.strip(".").lower())
 
 def get3LD(url):
-    fqdn = getFullDomain(url)
-    if len(fqdn) == 0:
-        return None
-    if fqdn[-1] == ".":
-        fqdn = fqdn[:-1]
-    names = fqdn.split(".")
-    tln_array = names[-3:]
-    tln = ""
-    for s in tln_array:
-        tln = tln + "." + s
-    return tln[1:]
+    return getDomainOfLevel(url, 3)
 
 def getFullDomain(url) -> str:
-    parse_result = urlparse(url)
-    domain = parse_result.netloc if len(parse_result.scheme) > 0 else parse_result.path
-    domain_levels = domain.strip(".").split(".")
-    level = len(domain_levels)
-    return '.'.join(domain_levels[-level:])
+    parse_result = urlsplit(url)
+    netloc = parse_result.netloc if len(parse_result.scheme) > 0 else parse_result.path
+    return getHostOfNetloc(netloc)
+
+def getHostOfNetloc(netloc) -> str:
+    # Remove credentials and port, if any
+    host = netloc.rpartition("@")[2]
+    if host.startswith("["):
+        host = host[:host.find("]") + 1]
+    elif ":" in host:
+        host = host.partition(":")[0]
+    return host.strip(".").lower()
 
 def getDomainOfLevel(url: str, level: int):
     fqdn = getFullDomain(url)
     if len(fqdn) == 0:
         return None
-    if fqdn[-1] == ".":
-        fqdn = fqdn[:-1]
-    names = fqdn.split(".")
-    tln_array = names[-level:]
-    tln = ""
-    for s in tln_array:
-        tln = tln + "." + s
-    return tln[1:]
\ No newline at end of file
+    return ".".join(fqdn.split(".")[-level:])
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def getRegistrableDomain(host):
+    # Public suffix of the host plus one label. Hosts that are IP addresses or public suffixes are returned as they are
+    labels = host.split(".")
+    if host.startswith("[") or all(label.isdigit() for label in labels):
+        return host
+
+    rules, wildcards, exceptions = get_public_suffix_rules()
+    suffix_length = 1  # Default rule "*": the public suffix is the last label
+    for i in range(len(labels)):
+        candidate = ".".join(labels[i:])
+        if candidate in exceptions:
+            suffix_length = len(labels) - i - 1
+            break
+        if candidate in rules:
+            suffix_length = len(labels) - i
+            break
+        if i + 1 < len(labels) and ".".join(labels[i + 1:]) in wildcards:
+            suffix_length = len(labels) - i
+            break
+
+    if suffix_length >= len(labels):
+        return host
+    return ".".join(labels[-suffix_length - 1:])
+
+def get_public_suffix_rules():
+    # Rules of the list as three sets: normal rules, wildcard rules ("*.ck" stored as "ck") and exceptions ("!www.ck"
+    # stored as "www.ck"). The compiled sets are cached on disk next to the list, and rebuilt when the list changes
+    global public_suffix_rules
+    if public_suffix_rules is not None:
+        return public_suffix_rules
+
+    stat = os.stat(PUBLIC_SUFFIX_LIST_FILE)
+    key = (PUBLIC_SUFFIX_CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+    cache_file = PUBLIC_SUFFIX_LIST_FILE + ".cache"
+    try:
+        with open(cache_file, "rb") as file:
+            cache_key, rules = pickle.load(file)
+        if cache_key == key:
+            public_suffix_rules = rules
+            return public_suffix_rules
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+
+    public_suffix_rules = read_public_suffix_list(PUBLIC_SUFFIX_LIST_FILE)
+    try:
+        with open(cache_file, "wb") as file:
+            pickle.dump((key, public_suffix_rules), file)
+    except OSError:
+        # Read-only location, the list is parsed again at next start
+        pass
+    return public_suffix_rules
+
+def read_public_suffix_list(file_path):
+    rules, wildcards, exceptions = set(), set(), set()
+    with open(file_path, encoding="utf-8") as file:
+        for line in file:
+            rule = line.split()[0] if line.strip() != "" else ""
+            if rule == "" or rule.startswith("//"):
+                continue
+            if rule.startswith("!"):
+                exceptions.add(to_ascii(rule[1:]))
+            elif rule.startswith("*."):
+                wildcards.add(to_ascii(rule[2:]))
+            else:
+                rules.add(to_ascii(rule))
+    return rules, wildcards, exceptions
+
+def to_ascii(domain):
+    # Hosts in URLs are punycode-encoded, so must be the rules
+    if domain.isascii():
+        return domain
+    try:
+        return ".".join(label.encode("idna").decode("ascii") for label in domain.split("."))
+    except UnicodeError:
+        return domain
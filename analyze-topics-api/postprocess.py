@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from json.decoder import JSONDecodeError
+from get_domain import getGood2LD
+from crawl_output import load_output, list_outputs, ANALYSIS_SCHEMA
+from url_classifier import UrlClassifier
+from campaign_dataset import CampaignDatasetWriter
+from script_store import ScriptStore
+from topics_analysis import CSV_HEADER, read_domains_file, read_allowed_domains_file, read_consent_managers_file, analyze_output, get_csv_row, \
+                            get_outfile_name, get_contacted_domains, content_has_browsing_topics
+
+PARTIAL_FILE = "partial.jsonl"
+CONNECTED_DOMAINS_FILE = "connected_domains.txt"
+
+parser = argparse.ArgumentParser(description="Single-pass post-processing of a crawl: every crawler output is parsed once.")
+subparsers = parser.add_subparsers(dest='command', required=True)
+
+collect_parser = subparsers.add_parser('collect', help="Parse the crawler outputs, extracting contacted domains and Topics API data")
+collect_parser.add_argument('crawl_dir', type=str)
+collect_parser.add_argument('--workdir', type=str, default='postprocess')
+collect_parser.add_argument('--allowed_domains_file', type=str, default='allowed_domains.txt')
+collect_parser.add_argument('--consent_managers_file', type=str, default='consent-managers.txt')
+collect_parser.add_argument('--connected_domains_file', type=str, default=None)
+collect_parser.add_argument('--check_script_content', action='store_true')
+collect_parser.add_argument('--script_store', type=str, default=None)
+collect_parser.add_argument('--timeout', type=int, default=5)
+collect_parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+finalize_parser = subparsers.add_parser('finalize', help="Apply the attestations of the contacted domains and write the analysis outputs")
+finalize_parser.add_argument('--workdir', type=str, default='postprocess')
+finalize_parser.add_argument('--attested_domains_file', type=str, default='attested_domains.csv')
+finalize_parser.add_argument('--outdir', type=str, default=None)
+finalize_parser.add_argument('--csv_file', type=str, default=None)
+finalize_parser.add_argument('--pretty_print', action='store_true')
+finalize_parser.add_argument('--dataset_dir', type=str, default=None)
+finalize_parser.add_argument('--campaign_date', type=str, default=datetime.now().strftime("%Y%m%d"))
+finalize_parser.add_argument('--location', type=str, default='local')
+
+def main(args):
+    if args.command == "collect":
+        collect(args)
+    else:
+        finalize(args)
+
+def collect(args):
+    # The partial records are the checkpoint: the outputs already recorded are skipped when collect is run again
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+    partial_path = os.path.join(args.workdir, PARTIAL_FILE)
+
+    contacted_domains = set()
+    done = set()
+    for record in read_partial_records(partial_path):
+        done.add(record["file"])
+        for domains in record["contacted_domains"].values():
+            contacted_domains.update(domains)
+
+    paths = list_outputs(args.crawl_dir)
+    paths = [ path for path in paths if os.path.basename(path) not in done ]
+    log(f"{len(paths)} file(s) to parse, {len(done)} already parsed")
+
+    check_script_content = partial(content_has_browsing_topics, timeout=args.timeout) if args.check_script_content else None
+    # Build the index of the attestations list, if needed, once for all the workers
+    read_allowed_domains_file(args.allowed_domains_file)
+    failed = 0
+    with open_partial_file(partial_path) as partial_file, \
+         ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.allowed_domains_file, args.consent_managers_file, check_script_content,
+                                       args.script_store)) as executor:
+        for i, record in enumerate(executor.map(collect_file, paths, chunksize=16)):
+            if record is None:
+                failed += 1
+            else:
+                partial_file.write(json.dumps(record) + "\n")
+                partial_file.flush()
+                for domains in record["contacted_domains"].values():
+                    contacted_domains.update(domains)
+            if (i + 1) % 1000 == 0:
+                log(f"Parsed {i + 1}/{len(paths)} file(s)")
+
+    connected_domains_file = args.connected_domains_file or os.path.join(args.workdir, CONNECTED_DOMAINS_FILE)
+    with open(connected_domains_file, "w") as file:
+        for domain in sorted(contacted_domains):
+            file.write(domain + "\n")
+    log(f"All Done, {failed} file(s) failed, {len(contacted_domains)} contacted domain(s)")
+
+def read_partial_records(path):
+    if not os.path.exists(path):
+        return
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except JSONDecodeError:
+                # Line truncated by an interruption, the output will be parsed again
+                continue
+
+def open_partial_file(path):
+    partial_file = open(path, "a+")
+    # Start on a new line if the last record has been truncated
+    if partial_file.tell() > 0:
+        partial_file.seek(partial_file.tell() - 1)
+        if partial_file.read(1) != "\n":
+            partial_file.write("\n")
+    return partial_file
+
+def init_worker(allowed_domains_file, consent_managers_file, check_script_content, script_store_dir):
+    global classifier
+    global script_checker
+    global script_store
+
+    # Attestations are applied by finalize, since they are only known once all the contacted domains are
+    classifier = UrlClassifier(set(), read_allowed_domains_file(allowed_domains_file), read_consent_managers_file(consent_managers_file))
+    script_checker = check_script_content
+    script_store = ScriptStore(script_store_dir) if script_store_dir is not None else None
+
+def collect_file(path):
+    # Runs in a worker process: the partial record of a single output, None on failure
+    try:
+        input_json = load_output(path, ANALYSIS_SCHEMA)
+        contacted_domains = {}
+        for stage in [ "first", "second" ]:
+            visit_data = input_json.get(stage)
+            if visit_data is not None:
+                contacted_domains[stage] = sorted(get_contacted_domains(visit_data, classifier))
+        return {
+            "file": os.path.basename(path),
+            "analysis": analyze_output(input_json, classifier, script_checker, script_store),
+            "contacted_domains": contacted_domains
+        }
+    except Exception as e:
+        log(f"Exception while parsing {path}: {e}")
+        return None
+
+def finalize(args):
+    partial_path = os.path.join(args.workdir, PARTIAL_FILE)
+    attested_domains = read_domains_file(args.attested_domains_file)
+
+    records = {}
+    for record in read_partial_records(partial_path):
+        records[record["file"]] = record
+    log(f"Finalizing {len(records)} file(s)")
+
+    if args.outdir is not None and not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+    csv_out = None
+    if args.csv_file is not None:
+        csv_out = open(args.csv_file, "w")
+        csv_out.write(",".join(CSV_HEADER) + "\n")
+    dataset = None
+    if args.dataset_dir is not None:
+        dataset = CampaignDatasetWriter(args.dataset_dir, args.campaign_date, args.location)
+
+    for name in sorted(records):
+        data = apply_attestations(records[name], attested_domains)
+        if args.outdir is not None:
+            with open(os.path.join(args.outdir, get_outfile_name(name)), "w") as file:
+                json.dump(data, file, indent=4 if args.pretty_print else None)
+        if csv_out is not None:
+            csv_out.write(get_csv_row(data) + "\n")
+        if dataset is not None:
+            dataset.add(data)
+
+    if csv_out is not None:
+        csv_out.close()
+    if dataset is not None:
+        dataset.close()
+    log("All Done")
+
+def apply_attestations(record, attested_domains):
+    # Same analysis analyze-topics-api.py produces with the attested domains file
+    data = record["analysis"]
+    for stage, domains in record["contacted_domains"].items():
+        visit_data = data.get(stage)
+        if visit_data is None:
+            continue
+        visit_data["attested_domains"] = [ domain for domain in domains if domain in attested_domains ]
+        for usage in visit_data["topics_api_usages"]:
+            usage["attested"] = getGood2LD(usage["context_origin_url"]) in attested_domains
+    return data
+
+def log(str):
+    print(datetime.now().strftime("[%Y-%m-%d %H:%M:%S]"), str, file=sys.stderr, flush=True)
+
+if __name__ == '__main__':
+    main(parser.parse_args())
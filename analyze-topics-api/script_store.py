@@ -0,0 +1 @@
+../crawler/script_store.py
\ No newline at end of file
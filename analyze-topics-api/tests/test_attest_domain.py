@@ -0,0 +1,166 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ANALYZE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ANALYZE_DIR)
+
+from attestation_cache import AttestationCache, AttestationResult, CacheEntry  # noqa: E402
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ANALYZE_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+attest_domain = load_script("attest-domain")
+
+
+def make_attestation(expiry):
+    return { "privacy_sandbox_api_attestations": [ {
+        "expiry_seconds_since_epoch": expiry,
+        "platform_attestations": [ { "platform": "chrome",
+                                     "attestations": { "topics_api": { "ServiceNotUsedForIdentifyingUserAcrossSites": True } } } ] } ] }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Attestation files of the stand-in server, by Host: (status, body, ETag), or "slow" for a server that never answers in time
+
+    def do_GET(self):
+        site = self.server.sites.get(self.headers["Host"].split(":")[0])
+        self.server.requests.append((self.headers["Host"].split(":")[0], self.headers.get("If-None-Match")))
+        if site == "slow":
+            time.sleep(self.server.slow_delay)
+            site = None
+        if site is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        status, body, etag = site
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    server.sites = {}
+    server.requests = []
+    server.slow_delay = 3
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_bulk(server, tmp_path, domains, cache=None, revalidate=False, timeout=10):
+    domains_file = tmp_path / "domains.txt"
+    domains_file.write_text("".join(domain + "\n" for domain in domains))
+    url_template = "http://{{}}:{}/.well-known/privacy-sandbox-attestations.json".format(server.server_address[1])
+    args = attest_domain.parser.parse_args([ "--bulk", str(domains_file), "--url_template", url_template, "--resolve_to", "127.0.0.1",
+                                             "--timeout", str(timeout), "--concurrency", "4" ] + ([ "--revalidate" ] if revalidate else []))
+    asyncio.run(attest_domain.attest_domains_bulk(args, cache))
+
+
+def get_attested(stdout):
+    return sorted(line.split(",", 1)[0] for line in stdout.splitlines() if line != "")
+
+
+def make_entry(status, attestation):
+    # Stale cache entry, fetched an hour ago
+    return CacheEntry("a.test", status, 200, attestation, '"v1"', None, time.time() - 3600, time.time() - 1)
+
+
+def test_not_modified_expired_attestation(server, tmp_path, capsys):
+    # A 304 reply to an expired cached attestation must not bring the hit back
+    attestation = make_attestation(time.time() - 60)
+    server.sites["a.test"] = (200, attestation, '"v1"')
+    cache = AttestationCache(str(tmp_path / "cache.sqlite"), 3600, 3600, 3600)
+    cache.put("a.test", AttestationResult("hit", 200, attestation, '"v1"', None))
+
+    run_bulk(server, tmp_path, [ "a.test" ], cache)
+
+    out, err = capsys.readouterr()
+    assert server.requests == [ ("a.test", '"v1"') ]
+    assert "not-modified=1" in err
+    assert get_attested(out) == []
+    entry = cache.get("a.test")
+    assert entry.status == "miss"
+    assert entry.expires > time.time()
+    cache.close()
+
+
+def test_update_cache_not_modified():
+    attestation = make_attestation(time.time() + 3600)
+    not_modified = AttestationResult("not-modified", 304, None, None, None)
+    valid = make_entry("hit", attestation)
+    assert attest_domain.update_cache(None, "a.test", valid, not_modified).status == "hit"
+    expired = make_entry("hit", make_attestation(time.time() - 60))
+    result = attest_domain.update_cache(None, "a.test", expired, not_modified)
+    assert result.status == "miss" and result.attestation is None
+    assert attest_domain.update_cache(None, "a.test", None, not_modified).status == "miss"
+
+
+def test_bulk_statuses(server, tmp_path, capsys):
+    # 200 with a valid or an invalid attestation file, 304 for a cached hit, 404 and a server that does not answer in time
+    valid = make_attestation(time.time() + 3600)
+    server.sites["valid.test"] = (200, valid, '"v1"')
+    server.sites["invalid.test"] = (200, { "privacy_sandbox_api_attestations": [] }, None)
+    server.sites["cached.test"] = (200, valid, '"v2"')
+    server.sites["slow.test"] = "slow"
+    cache = AttestationCache(str(tmp_path / "cache.sqlite"), 3600, 3600, 3600)
+    cache.put("cached.test", AttestationResult("hit", 200, valid, '"v2"', None))
+
+    run_bulk(server, tmp_path, [ "valid.test", "invalid.test", "cached.test", "missing.test", "slow.test" ], cache,
+             revalidate=True, timeout=1)
+
+    out, err = capsys.readouterr()
+    assert get_attested(out) == [ "cached.test", "valid.test" ]
+    assert "hit=1" in err and "miss=2" in err and "not-modified=1" in err and "error=1" in err
+    assert ("cached.test", '"v2"') in server.requests
+    statuses = { domain: cache.get(domain).status for domain in [ "valid.test", "invalid.test", "cached.test", "missing.test", "slow.test" ] }
+    assert statuses == { "valid.test": "hit", "invalid.test": "miss", "cached.test": "hit", "missing.test": "miss", "slow.test": "error" }
+    assert cache.get("missing.test").http_status == 404
+    cache.close()
+
+
+def test_bulk_fresh_cache(server, tmp_path, capsys):
+    # Fresh results are not fetched again
+    cache = AttestationCache(str(tmp_path / "cache.sqlite"), 3600, 3600, 3600)
+    cache.put("cached.test", AttestationResult("hit", 200, make_attestation(time.time() + 3600), '"v1"', None))
+    cache.put("missing.test", AttestationResult("miss", 404, None, None, None))
+
+    run_bulk(server, tmp_path, [ "cached.test", "missing.test" ], cache)
+
+    out, err = capsys.readouterr()
+    assert server.requests == []
+    assert get_attested(out) == [ "cached.test" ]
+    assert "2 domain(s) found in cache" in err
+    cache.close()
@@ -0,0 +1,173 @@
+import json
+import os
+import requests
+from get_domain import getGood2LD, getFullDomain
+from consent_managers import ConsentManagerIndex
+from attestations_index import is_index, open_attestations
+
+GOOGLE_TAG_MANAGER_DOMAIN = "googletagmanager.com"
+
+CSV_HEADER = [ "domain", "first_attested_domains", "first_allowed_domains", "first_topics_api_usages", "first_consent_managers",
+               "first_has_gtm", "banner_clicked", "second_attested_domains", "second_allowed_domains", "second_topics_api_usages",
+               "second_consent_managers", "second_has_gtm" ]
+
+# Fields of a usage captured through CDP kept in the analysis, the caller being in its possible callers
+CAPTURED_USAGE_KEYS = [ "context_origin_url", "caller_source", "usage_time" ]
+
+CMP_DOMAIN_EXCEPTIONS = [ "2badvice-cdn.azureedge.net", "fundingchoicesmessages.google.com", "optanon.blob.core.windows.net", "cookie-sl.s3.*.amazonaws.com" ]
+CMP_DOMAIN_EXCEPTIONS_2LD = [ getGood2LD(domain) for domain in CMP_DOMAIN_EXCEPTIONS ]
+
+def read_domains_file(file_path):
+    with open(file_path) as file:
+        domains = { line.split(",")[0].strip() for line in file.readlines() if not line.startswith("#") }
+    return domains
+
+def read_allowed_domains_file(file_path):
+    # Either a list of domains, or Chrome's privacy-sandbox-attestations.dat (or its index), looked up in place
+    if file_path.endswith(".dat") or is_index(file_path):
+        return open_attestations(file_path).get_domains("TOPICS")
+    return read_domains_file(file_path)
+
+def read_consent_managers_file(file_path):
+    return ConsentManagerIndex(
+        (getFullDomain(domain) if getGood2LD(domain) in CMP_DOMAIN_EXCEPTIONS_2LD else getGood2LD(domain)) for domain in read_domains_file(file_path)
+    )
+
+def get_outfile_name(path):
+    # Same name of the input file, with .json extension even if the input is in JSON Lines format or compressed
+    name = os.path.basename(path)
+    for extension in [ ".gz", ".zst", ".jsonl", ".json" ]:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name + ".json"
+
+def content_has_browsing_topics(url: str, timeout=5) -> bool:
+    try:
+        r = requests.get(url, timeout=timeout)
+        return r.status_code == 200 and "browsingtopics" in r.text.lower()
+    except:
+        # Connection error or invalid URL, suppose the script does not contain API calls
+        return False
+
+def analyze_output(input_json, classifier, script_checker=None, script_store=None):
+    # Analysis of a Priv-Accept output. script_checker(url), if given, tells whether a script calls the Topics API.
+    # If script_store is given, the scripts captured during the crawl are checked instead
+    data = {}
+    data["url"] = input_json["first"]["requests"][0]["documentURL"]
+    for stage in [ "first", "second" ]:
+        visit_data = input_json.get(stage)
+        if visit_data is None:
+            continue
+        data[stage] = get_topics_api_data(visit_data, classifier, script_checker, script_store)
+    
+    # Save whether accept button has been clicked
+    clicked_element = (input_json.get("banner_data") or {}).get("clicked_element")
+    data["banner_clicked"] = clicked_element is not None
+
+    return data
+
+def get_csv_row(data):
+    # Same line produced by jq's tostring and @csv: lists as quoted compact JSON strings, missing values as empty cells
+    def to_string(value):
+        return '"{}"'.format(json.dumps(value, separators=(",", ":"), ensure_ascii=False).replace('"', '""'))
+
+    def to_cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return '"{}"'.format(str(value).replace('"', '""'))
+
+    row = [ to_cell(data["url"]) ]
+    for stage in [ "first", "second" ]:
+        visit_data = data.get(stage) or {}
+        row += [ to_string(visit_data.get("attested_domains")), to_string(visit_data.get("allowed_domains")),
+                 to_string(visit_data.get("topics_api_usages")), to_string(visit_data.get("consent_managers")),
+                 to_cell(visit_data.get("has_gtm")) ]
+        if stage == "first":
+            row.append(to_cell(data.get("banner_clicked")))
+    return ",".join(row)
+
+def get_topics_api_data(network_data, classifier, script_checker=None, script_store=None):
+    if script_store is not None:
+        script_checker = script_store.get_checker(network_data.get("scripts", []))
+
+    # Map the Origin URL to the API usage object. Usages captured through CDP (priv-accept.py --topics_source cdp)
+    # already come with the stack of their caller, so the requests and responses are not searched for it
+    topics_api_usages_map = {}
+    captured_origins = set()
+    for obj in network_data["topics_api_usages"]:
+        if "stack" not in obj:
+            topics_api_usages_map[obj["context_origin_url"]] = obj
+            continue
+        possible_callers = topics_api_usages_map.get(obj["context_origin_url"], {}).get("possible_callers", [])
+        caller = { "url": obj["caller_url"], "reason": "stack" }
+        if obj["caller_url"] is not None and caller not in possible_callers:
+            possible_callers.append(caller)
+        topics_api_usages_map[obj["context_origin_url"]] = { **{ key: obj[key] for key in CAPTURED_USAGE_KEYS }, "possible_callers": possible_callers }
+        captured_origins.add(obj["context_origin_url"])
+
+    data = { "attested_domains": set(), "allowed_domains": set(), "consent_managers": set(), "has_gtm": False }
+    events = [ ("request", request["request"]) for request in network_data["requests"] ] + \
+             [ ("response", response["response"]) for response in network_data["responses"] ]
+    for kind, event in events:
+        url = event["url"]
+        url_info = classifier.classify(url)
+        if url_info.attested:
+            data["attested_domains"].add(url_info.domain)
+        if url_info.allowed:
+            data["allowed_domains"].add(url_info.domain)
+        if url_info.consent_manager is not None:
+            data["consent_managers"].add(url_info.consent_manager)
+        if url_info.domain == GOOGLE_TAG_MANAGER_DOMAIN:
+            data["has_gtm"] = True
+
+        topics_api_usage = topics_api_usages_map.get(url_info.origin)
+        if topics_api_usage is None or url_info.origin in captured_origins:
+            continue
+
+        for reason in get_caller_reasons(kind, url, event["headers"], topics_api_usage["caller_source"], script_checker):
+            topics_api_usage["possible_callers"] = topics_api_usage.get("possible_callers", [])
+            topics_api_usage["possible_callers"].append({ "url": url, "reason": reason })
+
+    data["topics_api_usages"] = [
+        {
+            **usage,
+            "allowed": classifier.classify(usage["context_origin_url"]).allowed,
+            "attested": classifier.classify(usage["context_origin_url"]).attested
+        }
+        for usage in topics_api_usages_map.values()
+    ]
+    
+    data["attested_domains"] = list(data["attested_domains"])
+    data["allowed_domains"] = list(data["allowed_domains"])
+    data["consent_managers"] = list(data["consent_managers"])
+
+    return data
+
+def get_caller_reasons(kind, url, headers, caller_source, script_checker=None):
+    # Reasons why the request or response may come from the caller of the API
+    reasons = []
+    if kind == "request":
+        if caller_source in ["fetch", "iframe"] and ("sec-browsing-topics" in headers or "Sec-Browsing-Topics" in headers):
+            reasons.append("header-request")
+        return reasons
+
+    if caller_source in ["fetch", "iframe"] and ("observe-browsing-topics" in headers or "Observe-Browsing-Topics" in headers):
+        reasons.append("header-response")
+
+    content_type = headers.get("content-type") or headers.get("Content-Type")
+    if caller_source == "javascript" and content_type is not None:
+        if script_checker is not None and ('text/javascript' in content_type or "application/javascript" in content_type) and script_checker(url):
+            reasons.append("browsingtopics-in-script")
+    return reasons
+
+def get_contacted_domains(visit_data, classifier):
+    # 2LDs of all the URLs requested or received during a visit, as extracted by extract-domains.py
+    domains = set()
+    for request in visit_data["requests"]:
+        domains.add(classifier.classify(request["request"]["url"]).domain)
+    for response in visit_data["responses"]:
+        domains.add(classifier.classify(response["response"]["url"]).domain)
+    domains.discard(None)
+    return domains
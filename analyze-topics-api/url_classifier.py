@@ -0,0 +1,39 @@
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlsplit
+from get_domain import getGood2LDOfDomain, getHostOfNetloc
+
+URL_CACHE_SIZE = 1 << 16
+ORIGIN_CACHE_SIZE = 1 << 16
+
+UrlInfo = namedtuple("UrlInfo", ["host", "domain", "origin", "attested", "allowed", "consent_manager"])
+
+
+class UrlClassifier:
+    # Classifies the URLs of a crawl against the reference lists. Each distinct URL is parsed once, and the
+    # classification of its origin (host, 2LD, Attested, Allowed, consent manager) is memoized for the whole run
+
+    def __init__(self, attested_domains, allowed_domains, consent_managers):
+        self.attested_domains = attested_domains
+        self.allowed_domains = allowed_domains
+        self.consent_managers = consent_managers
+        self.classify = lru_cache(maxsize=URL_CACHE_SIZE)(self.classify_url)
+        self.classify_origin = lru_cache(maxsize=ORIGIN_CACHE_SIZE)(self.classify_origin_uncached)
+
+    def classify_url(self, url):
+        parse_result = urlsplit(url)
+        # Same domain extracted by getFullDomain: URLs without scheme are bare domains
+        netloc = parse_result.netloc if len(parse_result.scheme) > 0 else parse_result.path
+        return self.classify_origin(parse_result.scheme, netloc)
+
+    def classify_origin_uncached(self, scheme, netloc):
+        host = getHostOfNetloc(netloc)
+        domain = getGood2LDOfDomain(host)
+        return UrlInfo(
+            host=host,
+            domain=domain,
+            origin="{}://{}/".format(scheme, netloc),
+            attested=domain in self.attested_domains,
+            allowed=domain in self.allowed_domains,
+            consent_manager=self.consent_managers.lookup(host)
+        )
@@ -6,6 +6,8 @@ TODAY=$(date +%Y%m%d) # YYYYMMDD
 WORKING_FOLDER="/home/$USER/priv-accept-topics"
 OUTPUTS_FOLDER="$WORKING_FOLDER/outputs"
 FINAL_OUTPUTS_FOLDER="$WORKING_FOLDER/outputs"
+DATASET_FOLDER="$WORKING_FOLDER/dataset"
+ATTESTATION_CACHE="$WORKING_FOLDER/attestation-cache.sqlite"
 CHROME_CONFIG_FOLDER="/home/$USER/.config/google-chrome"
 PRIV_ACCEPT_TIMEOUT="20m"
 EXPRESSVPN_ACTIVATION_CODE="CHANGE_ME"
@@ -103,10 +105,10 @@ if [ ! -f "$OUTPUTS_FOLDER/allowed_domains.txt" ]; then
     folder=$(ls "$CHROME_CONFIG_FOLDER/PrivacySandboxAttestationsPreloaded" -1 | head -n 1)
     cp $CHROME_CONFIG_FOLDER/PrivacySandboxAttestationsPreloaded/$folder/privacy-sandbox-attestations.dat $OUTPUTS_FOLDER
 
-    # Extract allowed domains from sandbox attestations list
-    docker run --rm \
-        -v $OUTPUTS_FOLDER/privacy-sandbox-attestations.dat:/opt/extract-allowed-domains/privacy-sandbox-attestations.dat \
-        salb98/extract-allowed-domains /opt/extract-allowed-domains/privacy-sandbox-attestations.dat \
+    # Extract allowed domains from sandbox attestations list, indexing it by version
+    python3 $WORKING_FOLDER/privacy-sandbox-attestations/attestations-index.py build $OUTPUTS_FOLDER/privacy-sandbox-attestations.dat \
+        --index_dir $OUTPUTS_FOLDER/attestations-index --version $folder &&
+    python3 $WORKING_FOLDER/privacy-sandbox-attestations/attestations-index.py dump $OUTPUTS_FOLDER/attestations-index/$folder.idx \
         > $OUTPUTS_FOLDER/allowed_domains.txt
 fi
 
@@ -148,11 +150,13 @@ parallel --load 80% \
             --network "${network:=bridge}" \
             -v $OUTPUTS_FOLDER/priv-accept:/opt/priv-accept-topics/output \
             -v vpn-shared:/vpn_shared \
+            -v $WORKING_FOLDER/analyze-topics-api/consent-managers.txt:/root/consent-managers.txt:ro \
             salb98/priv-accept-topics:geo \
             --url {} \
             --outfile /opt/priv-accept-topics/output/output_{}.json \
             --timeout $timeout \
             --clear_cache --full_net_log --lang \"$lang\" --xvfb \
+            --consent_managers_file /root/consent-managers.txt \
             --rum_speed_index
     "
 
@@ -169,40 +173,43 @@ while IFS=, read -r seq domain; do
 done
 
 if [ ! -f "$OUTPUTS_FOLDER/connected_domains.txt" ]; then
-    echo "EXTRACTING CONTACTED DOMAINS..."
-
-    # Run extract-domains
-    ls -1 $OUTPUTS_FOLDER/priv-accept |
-    parallel --load 80% \
-        --progress --bar --eta \
-        "python3 $WORKING_FOLDER/analyze-topics-api/extract-domains.py $OUTPUTS_FOLDER/priv-accept/{}" 2> $OUTPUTS_FOLDER/extract-domains.stderr |
-        sort | uniq > $OUTPUTS_FOLDER/connected_domains.txt
+    echo "EXTRACTING CONTACTED DOMAINS AND TOPICS API DATA FROM CRAWLER OUTPUTS..."
+
+    # Parse every crawler output once, resuming from the partial records if interrupted
+    python3 $WORKING_FOLDER/analyze-topics-api/postprocess.py collect $OUTPUTS_FOLDER/priv-accept \
+        --workdir $OUTPUTS_FOLDER/postprocess \
+        --allowed_domains_file $OUTPUTS_FOLDER/allowed_domains.txt \
+        --consent_managers_file $WORKING_FOLDER/analyze-topics-api/consent-managers.txt \
+        --connected_domains_file $OUTPUTS_FOLDER/connected_domains.txt.tmp \
+        2> $OUTPUTS_FOLDER/postprocess.log &&
+    mv $OUTPUTS_FOLDER/connected_domains.txt.tmp $OUTPUTS_FOLDER/connected_domains.txt
 fi
 
 if [ ! -f "$OUTPUTS_FOLDER/allowed_attested.csv" ]; then
     # Attest allowed domains
     echo "EXTRACTING ATTESTED AND ALLOWED DOMAINS..."
     echo "domain,attestation_result" > $OUTPUTS_FOLDER/allowed_attested.csv
-    cat $OUTPUTS_FOLDER/allowed_domains.txt |
-    parallel --load 80% \
-        --progress --bar --eta \
-        "python3 $WORKING_FOLDER/analyze-topics-api/attest-domain.py {}" >> $OUTPUTS_FOLDER/allowed_attested.csv
+    python3 $WORKING_FOLDER/analyze-topics-api/attest-domain.py --bulk $OUTPUTS_FOLDER/allowed_domains.txt --cache $ATTESTATION_CACHE >> $OUTPUTS_FOLDER/allowed_attested.csv
 fi
 
 if [ ! -f "$OUTPUTS_FOLDER/attested_domains.csv" ]; then
     # Attest domains found during the crawling
     echo "EXTRACTING ATTESTED AND CONTACTED DOMAINS..."
     echo "domain,attestation_result" > $OUTPUTS_FOLDER/attested_domains.csv
-    
-    cat $OUTPUTS_FOLDER/connected_domains.txt |
-    parallel --load 80% \
-        --progress --bar --eta \
-        "python3 $WORKING_FOLDER/analyze-topics-api/attest-domain.py {}" >> $OUTPUTS_FOLDER/attested_domains.csv
+    python3 $WORKING_FOLDER/analyze-topics-api/attest-domain.py --bulk $OUTPUTS_FOLDER/connected_domains.txt --cache $ATTESTATION_CACHE >> $OUTPUTS_FOLDER/attested_domains.csv
 fi
 
-# Run analyze-topics
-echo "EXTRACTING TOPICS API DATA FROM CRAWLER OUTPUTS..."
-ls -1 $OUTPUTS_FOLDER/priv-accept | parallel --load 80% --resume --joblog $OUTPUTS_FOLDER/analyze-topics.log --results $OUTPUTS_FOLDER/analyze-topics-logs --progress --bar --eta "python3 $WORKING_FOLDER/analyze-topics-api/analyze-topics-api.py $OUTPUTS_FOLDER/priv-accept/{} --attested_domains_file $OUTPUTS_FOLDER/attested_domains.csv --allowed_domains_file $OUTPUTS_FOLDER/allowed_domains.txt --consent_managers_file $WORKING_FOLDER/analyze-topics-api/consent-managers.txt --outfile $OUTPUTS_FOLDER/analyze-topics/{}"
+# Apply attestations to the Topics API data, condense it into a single CSV file and add it to the campaigns dataset
+echo "CONDENSING TOPICS API DATA..."
+python3 $WORKING_FOLDER/analyze-topics-api/postprocess.py finalize \
+    --workdir $OUTPUTS_FOLDER/postprocess \
+    --attested_domains_file $OUTPUTS_FOLDER/attested_domains.csv \
+    --outdir $OUTPUTS_FOLDER/analyze-topics \
+    --csv_file $OUTPUTS_FOLDER/analyze-topics-output.csv \
+    --dataset_dir $DATASET_FOLDER \
+    --campaign_date $date \
+    --location ${remote_server:-it} \
+    2>> $OUTPUTS_FOLDER/postprocess.log
 
 if [ -n "$remote_server" ]; then
     # Stop VPN container
@@ -210,16 +217,6 @@ if [ -n "$remote_server" ]; then
     final_output_prefix="-$remote_server"
 fi
 
-if [ ! -f "$OUTPUTS_FOLDER/analyze-topics-output.csv" ]; then
-    echo "Condensing outputs into CSV file..."
-    
-    # Condense all JSON output files into a single CSV file
-    cd $OUTPUTS_FOLDER/analyze-topics
-    echo 'domain,first_attested_domains,first_allowed_domains,first_topics_api_usages,first_consent_managers,first_has_gtm,banner_clicked,second_attested_domains,second_allowed_domains,second_topics_api_usages,second_consent_managers,second_has_gtm' > $OUTPUTS_FOLDER/analyze-topics-output.csv
-    jq -r '[.url, (.first.attested_domains | tostring), (.first.allowed_domains | tostring), (.first.topics_api_usages | tostring), (.first.consent_managers | tostring), (.first.has_gtm), .banner_clicked, (.second.attested_domains | tostring), (.second.allowed_domains | tostring), (.second.topics_api_usages | tostring), (.second.consent_managers | tostring), (.second.has_gtm)] | @csv' *.json >> $OUTPUTS_FOLDER/analyze-topics-output.csv
-    cd $cwd
-fi
-
 mkdir -p $FINAL_OUTPUTS_FOLDER
 
 if [ ! -f "$FINAL_OUTPUTS_FOLDER/output-$date$final_output_prefix.zip" ]; then
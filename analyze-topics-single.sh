@@ -25,6 +25,7 @@ python3 "$WORKING_DIR/crawler/priv-accept.py" \
     --chrome_driver "$CHROMIUM_DIR/chromedriver" \
     --chrome_binary "$CHROMIUM_DIR/chrome" \
     --accept_words "$WORKING_DIR/crawler/accept_words.txt" \
+    --consent_managers_file "$WORKING_DIR/analyze-topics-api/consent-managers.txt" \
     --screenshot_dir "$OUTPUT_DIR/screenshots" \
     --lang "en, en-us, en-gb, it, fr, es, de, ru" \
     --docker --clear_cache --full_net_log --xvfb \
@@ -42,7 +43,8 @@ python3 "$WORKING_DIR/analyze-topics-api/extract-domains.py" "$OUTPUT_DIR/priv-a
 python3 "$WORKING_DIR/analyze-topics-api/extract-domains.py" "$OUTPUT_DIR/priv-accept-output.json" --visit second | sort | uniq > "$OUTPUT_DIR/contacted-domains-second.txt"
 cat "$OUTPUT_DIR/contacted-domains-first.txt" "$OUTPUT_DIR/contacted-domains-second.txt" | sort | uniq > "$OUTPUT_DIR/contacted-domains.txt"
 echo "Checking for attested domains"
-cat "$OUTPUT_DIR/contacted-domains.txt" | xargs -I {} timeout -s KILL ${CONNECTION_TIMEOUT:=30} python3 "$WORKING_DIR/analyze-topics-api/attest-domain.py" {} >> "$OUTPUT_DIR/attested-domains.csv"
+python3 "$WORKING_DIR/analyze-topics-api/attest-domain.py" --bulk "$OUTPUT_DIR/contacted-domains.txt" --timeout ${CONNECTION_TIMEOUT:=30} \
+    ${ATTESTATION_CACHE:+--cache "$ATTESTATION_CACHE"} >> "$OUTPUT_DIR/attested-domains.csv"
 
 # EXTRACT TOPICS API DATA FROM OUTPUTS
 python3 "$WORKING_DIR/analyze-topics-api/analyze-topics-api.py" "$OUTPUT_DIR/priv-accept-output.json" \
@@ -0,0 +1,232 @@
+import argparse
+import cProfile
+import csv
+import importlib.util
+import json
+import os
+import platform
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+from crawl_generator import DEFAULT_PROFILE, OPEN_DATA_DIR, ANALYZE_DIR, generate_crawl
+
+sys.path.insert(0, ANALYZE_DIR)
+import get_domain
+from crawl_output import load_output, list_outputs, ANALYSIS_SCHEMA, DOMAINS_SCHEMA
+from url_classifier import UrlClassifier
+from topics_analysis import read_domains_file, read_consent_managers_file, analyze_output
+
+RESULTS_FORMAT = 1
+HOT_SPOTS = 10
+
+# A benchmark runs a function over a prepared input, the number of items (e.g. outputs, hosts) making the throughput
+Benchmark = namedtuple("Benchmark", ["name", "unit", "prepare", "run"])
+
+parser = argparse.ArgumentParser(description="Benchmark the analysis tools on a synthetic crawl, reporting throughput, peak memory and hot spots")
+parser.add_argument('--sites', type=int, default=200)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--requests', type=int, default=DEFAULT_PROFILE.requests)
+parser.add_argument('--third_party_ratio', type=float, default=DEFAULT_PROFILE.third_party_ratio)
+parser.add_argument('--topics_usages', type=float, default=DEFAULT_PROFILE.topics_usages)
+parser.add_argument('--headers', type=int, default=DEFAULT_PROFILE.headers)
+parser.add_argument('--header_size', type=int, default=DEFAULT_PROFILE.header_size)
+parser.add_argument('--output_format', type=str, default='json', choices=['json', 'jsonl'])
+parser.add_argument('--crawl_dir', type=str, default=None)
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--only', type=str, action='append', default=None)
+parser.add_argument('--results', type=str, default=None)
+parser.add_argument('--compare', type=str, default=None)
+parser.add_argument('--tolerance', type=float, default=0.1)
+
+
+def load_script(name):
+    # The command line tools have dashes in their names, and only run main() when executed
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ANALYZE_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_reference_lists():
+    attested_domains = read_domains_file(os.path.join(OPEN_DATA_DIR, "attested_domains.csv"))
+    allowed_domains = read_domains_file(os.path.join(OPEN_DATA_DIR, "allowed_domains.txt"))
+    consent_managers = read_consent_managers_file(os.path.join(ANALYZE_DIR, "consent-managers.txt"))
+    return attested_domains, allowed_domains, consent_managers
+
+
+def get_hosts(paths):
+    # Distinct hosts contacted in the crawl, in order of appearance
+    hosts = {}
+    for path in paths:
+        output = load_output(path, DOMAINS_SCHEMA)
+        for stage in [ "first", "second" ]:
+            for request in (output.get(stage) or {}).get("requests", []):
+                hosts[get_domain.getFullDomain(request["request"]["url"])] = None
+    return list(hosts)
+
+
+def get_attestation_bodies():
+    # Attestation files of the Attested domains of the open-data crawl, and as many files without Topics attestation
+    with open(os.path.join(OPEN_DATA_DIR, "attested_domains.csv")) as file:
+        bodies = [ row["attestation_json"].encode() for row in csv.DictReader(file) ]
+    return bodies + [ json.dumps({ "privacy_sandbox_api_attestations": [] }).encode() ] * len(bodies)
+
+
+def clear_caches():
+    # The lookups of registrable domains are memoized for the whole process: every run starts cold
+    get_domain.getRegistrableDomain.cache_clear()
+
+
+def run_domain_extraction(paths):
+    extract_domains = load_script("extract-domains").extract_domains
+    for path in paths:
+        extract_domains(load_output(path, DOMAINS_SCHEMA), "both")
+    return len(paths)
+
+
+def run_topics_analysis(paths, reference_lists):
+    classifier = UrlClassifier(*reference_lists)
+    for path in paths:
+        analyze_output(load_output(path, ANALYSIS_SCHEMA), classifier)
+    return len(paths)
+
+
+def run_cmp_matching(hosts, consent_managers):
+    for host in hosts:
+        consent_managers.lookup(host)
+    return len(hosts)
+
+
+def run_registrable_domain(hosts):
+    for host in hosts:
+        get_domain.getRegistrableDomain(host)
+    return len(hosts)
+
+
+def run_attestation_check(bodies):
+    get_attestation_result = load_script("attest-domain").get_attestation_result
+    for body in bodies:
+        get_attestation_result(200, body, None, None)
+    return len(bodies)
+
+
+def get_benchmarks(paths):
+    reference_lists = load_reference_lists()
+    return [
+        Benchmark("domain-extraction", "outputs", lambda: paths, run_domain_extraction),
+        Benchmark("topics-analysis", "outputs", lambda: paths, lambda paths: run_topics_analysis(paths, reference_lists)),
+        Benchmark("cmp-matching", "hosts", lambda: get_hosts(paths), lambda hosts: run_cmp_matching(hosts, reference_lists[2])),
+        Benchmark("registrable-domain", "hosts", lambda: get_hosts(paths), run_registrable_domain),
+        Benchmark("attestation-check", "files", get_attestation_bodies, run_attestation_check),
+    ]
+
+
+def measure(benchmark, repeat):
+    data = benchmark.prepare()
+    # Best time of the runs, then one run under tracemalloc and one under cProfile, which both slow it down
+    best_time = None
+    for _ in range(repeat):
+        clear_caches()
+        start_time = time.perf_counter()
+        items = benchmark.run(data)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    clear_caches()
+    tracemalloc.start()
+    benchmark.run(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    clear_caches()
+    profiler = cProfile.Profile()
+    profiler.runcall(benchmark.run, data)
+    return { "unit": benchmark.unit, "items": items, "seconds": best_time, "throughput": items / best_time,
+             "peak_bytes": peak, "hot_spots": get_hot_spots(profiler) }
+
+
+def get_hot_spots(profiler):
+    # Functions with the highest own time, as "file:line(function)" relative to the repository
+    stats = pstats.Stats(profiler).stats
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    hot_spots = []
+    for (file_name, line, function), (_, calls, own_time, cumulative_time, _) in stats.items():
+        if file_name.startswith(root):
+            file_name = os.path.relpath(file_name, root)
+        hot_spots.append({ "function": "{}:{}({})".format(file_name, line, function), "calls": calls,
+                           "own_seconds": own_time, "cumulative_seconds": cumulative_time })
+    hot_spots.sort(key=lambda hot_spot: hot_spot["own_seconds"], reverse=True)
+    return hot_spots[:HOT_SPOTS]
+
+
+def get_commit():
+    try:
+        return subprocess.run([ "git", "rev-parse", "HEAD" ], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    # Throughput of each benchmark relative to a baseline: a drop larger than the tolerance is a regression
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    if baseline.get("params") != results["params"]:
+        print("Warning, the baseline was run with different parameters", file=sys.stderr)
+    regressions = []
+    print("\nCompared to {}:".format(baseline.get("commit") or baseline_path))
+    for name, result in results["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+        ratio = result["throughput"] / baseline_result["throughput"]
+        memory_ratio = result["peak_bytes"] / baseline_result["peak_bytes"] if baseline_result["peak_bytes"] > 0 else 1
+        flag = "REGRESSION" if ratio < 1 - tolerance else ""
+        if flag:
+            regressions.append(name)
+        print("  {:<20} throughput {:6.2f}x  peak memory {:6.2f}x  {}".format(name, ratio, memory_ratio, flag))
+    return regressions
+
+
+def main(args):
+    profile = DEFAULT_PROFILE._replace(requests=args.requests, third_party_ratio=args.third_party_ratio,
+                                       topics_usages=args.topics_usages, headers=args.headers, header_size=args.header_size)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.crawl_dir is not None:
+            paths = list_outputs(args.crawl_dir)
+        else:
+            paths = generate_crawl(tmp_dir, args.sites, profile, args.seed, args.output_format)
+        print("{} outputs, {:.1f} MB".format(len(paths), sum(os.path.getsize(path) for path in paths) / 1e6))
+        # Parse the Public Suffix List once, so that its loading is not charged to the first benchmark
+        get_domain.get_public_suffix_rules()
+
+        results = { "format": RESULTS_FORMAT, "commit": get_commit(), "date": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(), "platform": platform.platform(),
+                    "params": { **(profile._asdict() if args.crawl_dir is None else { "crawl_dir": args.crawl_dir }),
+                                "sites": len(paths), "seed": args.seed, "output_format": args.output_format },
+                    "benchmarks": {} }
+        for benchmark in get_benchmarks(paths):
+            if args.only is not None and benchmark.name not in args.only:
+                continue
+            result = measure(benchmark, args.repeat)
+            results["benchmarks"][benchmark.name] = result
+            print("{:<20} {:10.1f} {}/s  {:7.3f} s  peak {:7.1f} MB".format(benchmark.name, result["throughput"], result["unit"],
+                                                                           result["seconds"], result["peak_bytes"] / 1e6))
+            for hot_spot in result["hot_spots"][:3]:
+                print("    {:6.3f} s  {}".format(hot_spot["own_seconds"], hot_spot["function"]))
+
+    if args.results is not None:
+        with open(args.results, "w") as file:
+            json.dump(results, file, indent=4)
+    if args.compare is not None and len(compare(results, args.compare, args.tolerance)) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
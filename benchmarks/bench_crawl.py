@@ -0,0 +1,254 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from site_farm import CRAWLER_DIR, DEFAULT_PROFILE, FarmProfile, SiteFarm, start_farm, write_site_lists
+
+RESULTS_FORMAT = 1
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+parser = argparse.ArgumentParser(description="Crawl the synthetic websites of site_farm.py with crawl-pool.py and priv-accept.py, "
+                                             "reporting sites/min, time per phase and memory. Unknown arguments are passed to every worker.")
+parser.add_argument('--sites', type=int, default=50)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--worker_command', type=str, default="{} priv-accept.py".format(sys.executable))
+parser.add_argument('--site_timeout', type=int, default=300)
+parser.add_argument('--port', type=int, default=0)
+parser.add_argument('--no_tls', action='store_true')
+parser.add_argument('--subresources', type=int, default=DEFAULT_PROFILE.subresources)
+parser.add_argument('--third_party_ratio', type=float, default=DEFAULT_PROFILE.third_party_ratio)
+parser.add_argument('--topics_callers', type=float, default=DEFAULT_PROFILE.topics_callers)
+parser.add_argument('--banner_ratio', type=float, default=DEFAULT_PROFILE.banner_ratio)
+parser.add_argument('--frame_ratio', type=float, default=DEFAULT_PROFILE.frame_ratio)
+parser.add_argument('--frame_depth', type=int, default=DEFAULT_PROFILE.frame_depth)
+parser.add_argument('--elements', type=int, default=DEFAULT_PROFILE.elements)
+parser.add_argument('--script_size', type=int, default=DEFAULT_PROFILE.script_size)
+parser.add_argument('--internal_links', type=int, default=DEFAULT_PROFILE.internal_links)
+parser.add_argument('--latency', type=float, default=DEFAULT_PROFILE.latency)
+parser.add_argument('--jitter', type=float, default=DEFAULT_PROFILE.jitter)
+parser.add_argument('--outdir', type=str, default=None)
+parser.add_argument('--memory_interval', type=float, default=1.0)
+parser.add_argument('--results', type=str, default=None)
+parser.add_argument('--compare', type=str, default=None)
+parser.add_argument('--tolerance', type=float, default=0.1)
+
+
+def load_crawler_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(CRAWLER_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class MemorySampler:
+    # Resident memory of a process and of all its descendants (workers, chromedriver, Chrome), read from /proc at
+    # regular intervals: the peak of the whole tree, and the peak of each kind of process
+
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.peaks = {}
+        self.samples = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        parents = {}
+        names = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open("/proc/{}/stat".format(entry)) as file:
+                    stat = file.read()
+            except OSError:
+                continue
+            # The name is between parentheses and can hold spaces
+            name, fields = stat[stat.index("(") + 1:stat.rindex(")")], stat[stat.rindex(")") + 2:].split()
+            parents[int(entry)] = int(fields[1])
+            names[int(entry)] = name
+        tree = { self.pid }
+        for pid in sorted(parents):
+            ancestor = parents[pid]
+            while ancestor > 1 and ancestor not in tree:
+                ancestor = parents.get(ancestor, 0)
+            if ancestor in tree:
+                tree.add(pid)
+        total = 0
+        kinds = {}
+        for pid in tree:
+            try:
+                with open("/proc/{}/statm".format(pid)) as file:
+                    rss = int(file.read().split()[1]) * PAGE_SIZE
+            except (OSError, IndexError):
+                continue
+            total += rss
+            kind = get_process_kind(names.get(pid, ""))
+            kinds[kind] = kinds.get(kind, 0) + rss
+        self.peak = max(self.peak, total)
+        for kind, rss in kinds.items():
+            self.peaks[kind] = max(self.peaks.get(kind, 0), rss)
+        self.samples += 1
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def get_commit():
+    try:
+        return subprocess.run([ "git", "rev-parse", "HEAD" ], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_process_kind(name):
+    name = name.lower()
+    if "chromedriver" in name:
+        return "chromedriver"
+    if "chrom" in name:
+        return "chrome"
+    if "python" in name:
+        return "python"
+    return "other"
+
+
+def get_site_results(journal_path):
+    # Outcome and duration of each site, as recorded by crawl-pool.py
+    conn = sqlite3.connect(journal_path)
+    rows = conn.execute("SELECT status, last_error, duration FROM sites").fetchall()
+    conn.close()
+    durations = sorted(duration for status, _, duration in rows if status == "done")
+    failures = {}
+    for status, error, _ in rows:
+        if status != "done":
+            failures[error or status] = failures.get(error or status, 0) + 1
+    return durations, failures
+
+
+def get_phase_times(outdir):
+    # Time of each phase and call over all visits, from the summaries of the traces of priv-accept.py --trace
+    aggregate_traces = load_crawler_script("aggregate-traces")
+    totals = {}
+    durations = {}
+    n_traces = 0
+    for path in aggregate_traces.iter_trace_files(outdir):
+        try:
+            trace = aggregate_traces.read_trace(path)
+        except (OSError, ValueError):
+            continue
+        n_traces += 1
+        for key, entry in trace.get("summary", {}).items():
+            total = totals.setdefault(key, { "count": 0, "time": 0 })
+            total["count"] += entry["count"]
+            total["time"] += entry["time"]
+            durations.setdefault(key, []).append(entry["time"])
+    for key, total in totals.items():
+        total["mean"] = total["time"] / n_traces
+        total["p50"] = aggregate_traces.get_percentile(durations[key], 0.5)
+        total["p95"] = aggregate_traces.get_percentile(durations[key], 0.95)
+    return n_traces, totals
+
+
+def compare(results, baseline_path, tolerance):
+    # Sites/min relative to a baseline: a drop larger than the tolerance is a regression
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    if baseline.get("params") != results["params"]:
+        print("Warning, the baseline was run with different parameters", file=sys.stderr)
+    print("\nCompared to {}:".format(baseline.get("commit") or baseline_path))
+    ratio = results["sites_per_minute"] / baseline["sites_per_minute"] if baseline["sites_per_minute"] > 0 else 1
+    memory_ratio = results["peak_rss"] / baseline["peak_rss"] if baseline["peak_rss"] > 0 else 1
+    regression = ratio < 1 - tolerance
+    print("  sites/min {:6.2f}x  peak memory {:6.2f}x  {}".format(ratio, memory_ratio, "REGRESSION" if regression else ""))
+    for key, total in sorted(results["phases"].items()):
+        baseline_total = baseline["phases"].get(key)
+        if key.startswith("phase:") and baseline_total is not None and baseline_total["mean"] > 0:
+            print("  {:<28} {:6.2f}x".format(key, total["mean"] / baseline_total["mean"]))
+    return regression
+
+
+def main(args, worker_args):
+    profile = FarmProfile(args.subresources, args.third_party_ratio, args.topics_callers, args.banner_ratio, args.frame_ratio,
+                          args.frame_depth, args.elements, args.script_size, args.internal_links, args.latency, args.jitter)
+    farm = SiteFarm(args.sites, profile, args.seed)
+    server = start_farm(farm, args.port, tls=not args.no_tls)
+    port = server.server_address[1]
+
+    outdir = os.path.abspath(args.outdir if args.outdir is not None else tempfile.mkdtemp(prefix="bench-crawl-"))
+    os.makedirs(outdir, exist_ok=True)
+    tranco_file = os.path.join(outdir, "sites.csv")
+    journal = os.path.join(outdir, "journal.sqlite")
+    if os.path.exists(journal):
+        os.remove(journal)
+    write_site_lists(farm.sites, tranco_file=tranco_file)
+    command = [ sys.executable, "crawl-pool.py", tranco_file, "--limit", str(args.sites), "--workers", str(args.workers),
+                "--worker_command", args.worker_command, "--outdir", os.path.join(outdir, "output"),
+                "--journal", journal, "--log_dir", os.path.join(outdir, "logs"), "--site_timeout", str(args.site_timeout),
+                "--retries", "0", "--trace" ]
+    command += [ "--chrome_extra_option={}".format(option) for option in farm.get_chrome_options(port) ] + worker_args
+    print("Crawling {} websites served on port {} with {} worker(s), outputs in {}".format(args.sites, port, args.workers, outdir))
+
+    start_time = time.time()
+    process = subprocess.Popen(command, cwd=CRAWLER_DIR)
+    sampler = MemorySampler(process.pid, args.memory_interval)
+    process.wait()
+    sampler.stop()
+    elapsed = time.time() - start_time
+    server.shutdown()
+
+    durations, failures = get_site_results(journal)
+    n_traces, phases = get_phase_times(os.path.join(outdir, "output"))
+    results = { "format": RESULTS_FORMAT, "commit": get_commit(), "date": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(), "platform": platform.platform(),
+                "params": { **profile._asdict(), "sites": args.sites, "seed": args.seed, "workers": args.workers,
+                            "tls": not args.no_tls, "worker_args": worker_args },
+                "seconds": elapsed, "completed": len(durations), "failures": failures,
+                "sites_per_minute": len(durations) / (elapsed / 60),
+                "site_seconds": { "p50": durations[len(durations) // 2] if len(durations) > 0 else 0,
+                                  "p95": durations[min(int(0.95 * len(durations)), len(durations) - 1)] if len(durations) > 0 else 0 },
+                "peak_rss": sampler.peak, "peak_rss_by_process": sampler.peaks,
+                "farm": dict(farm.stats), "traces": n_traces, "phases": phases }
+
+    print("\n{} of {} websites in {:.1f} s: {:.2f} sites/min, p50 {:.1f} s, p95 {:.1f} s per site".format(
+          len(durations), args.sites, elapsed, results["sites_per_minute"], results["site_seconds"]["p50"], results["site_seconds"]["p95"]))
+    if len(failures) > 0:
+        print("Failures: {}".format(", ".join("{}={}".format(error, count) for error, count in sorted(failures.items()))))
+    print("Peak memory {:.0f} MB ({}), {} requests and {:.1f} MB served".format(
+          sampler.peak / 1e6, ", ".join("{} {:.0f} MB".format(kind, rss / 1e6) for kind, rss in sorted(sampler.peaks.items())),
+          farm.stats["requests"], farm.stats["bytes"] / 1e6))
+    print("\nPhases ({} traces):".format(n_traces))
+    print("  {:<28} {:>10} {:>9} {:>9} {:>9}".format("phase", "count", "mean [s]", "p50 [s]", "p95 [s]"))
+    for key, total in sorted(phases.items(), key=lambda item: item[1]["time"], reverse=True):
+        if key.startswith("phase:"):
+            print("  {:<28} {:>10d} {:>9.2f} {:>9.2f} {:>9.2f}".format(key.split(":", 1)[1], total["count"], total["mean"],
+                                                                    total["p50"], total["p95"]))
+
+    if args.results is not None:
+        with open(args.results, "w") as file:
+            json.dump(results, file, indent=4)
+    if args.compare is not None and compare(results, args.compare, args.tolerance):
+        exit(1)
+
+
+if __name__ == '__main__':
+    args, worker_args = parser.parse_known_args()
+    main(args, worker_args)
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analyze-topics-api"))
+import crawl_output
+from crawl_output import load_output, select, ANALYSIS_SCHEMA, DOMAINS_SCHEMA
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crawler"))
+from output_writer import get_output_writer
+
+parser = argparse.ArgumentParser(description="Compare full and selective loading of synthetic Priv-Accept outputs")
+parser.add_argument('--requests', type=int, default=3000)
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def make_headers(rng, n):
+    return { "x-header-{}".format(i): "{:032x}".format(rng.getrandbits(128)) for i in range(n) }
+
+
+def make_visit(rng, n_requests, site):
+    # Network events with the shape of the DevTools ones, and the parts the analysis tools ignore: initiator stacks,
+    # timings, security details, extra info and cookies
+    visit = { "requests": [], "responses": [], "responses-extra": [], "cookies": None, "topics_api_usages": [] }
+    for i in range(n_requests):
+        url = "https://cdn{}.tracker{}.com/script/{}.js?r={}".format(rng.randrange(5), rng.randrange(60), i, rng.randrange(10 ** 6))
+        request_id = "{}.{}".format(rng.randrange(10 ** 5), i)
+        visit["requests"].append({
+            "requestId": request_id, "loaderId": request_id, "documentURL": "https://www.{}/".format(site),
+            "request": { "url": url, "method": "GET", "headers": make_headers(rng, 6), "initialPriority": "High",
+                         "referrerPolicy": "strict-origin-when-cross-origin" },
+            "timestamp": rng.random() * 1000, "wallTime": 1.7e9 + rng.random(), "type": "Script", "frameId": request_id,
+            "initiator": { "type": "script", "stack": { "callFrames": [
+                { "functionName": "f{}".format(j), "url": url, "lineNumber": j, "columnNumber": j * 7 } for j in range(8) ] } }
+        })
+        visit["responses"].append({
+            "requestId": request_id, "loaderId": request_id, "timestamp": rng.random() * 1000, "type": "Script",
+            "frameId": request_id,
+            "response": { "url": url, "status": 200, "statusText": "OK", "headers": make_headers(rng, 10),
+                          "mimeType": "text/javascript", "remoteIPAddress": "10.0.0.{}".format(rng.randrange(256)),
+                          "timing": { "t{}".format(j): rng.random() for j in range(18) },
+                          "securityDetails": { "protocol": "TLS 1.3", "subjectName": "*.tracker.com",
+                                               "sanList": [ "san{}.tracker.com".format(j) for j in range(10) ] } }
+        })
+        visit["responses-extra"].append({
+            "requestId": request_id, "statusCode": 200, "headers": make_headers(rng, 10), "blockedCookies": [],
+            "headersText": "HTTP/1.1 200 OK\r\n" + "".join("x-header-{}: {}\r\n".format(j, "v" * 40) for j in range(10))
+        })
+    visit["cookies"] = { "cookies": [ { "name": "c{}".format(i), "value": "v" * 64, "domain": ".tracker{}.com".format(i),
+                                        "path": "/", "expires": 1.8e9, "size": 66 } for i in range(200) ] }
+    visit["topics_api_usages"] = [ { "context_origin_url": "https://cdn0.tracker{}.com".format(i), "caller_source": "javascript",
+                                     "usage_time": 13350000000000000 + i } for i in range(5) ]
+    return visit
+
+
+def make_output(rng, n_requests, path, output_format):
+    site = "site.com"
+    writer = get_output_writer(path, output_format, "none", False)
+    writer.write_phase("first", make_visit(rng, n_requests, site))
+    writer.write_phase("click", { "urls": [] })
+    writer.write_phase("second", make_visit(rng, n_requests, site))
+    banner_data = { "clicked_element": 3, "candidate_elements": [
+        { "id": i, "tag": "button", "text": "Accept all " * 5, "signature": [ "div", "span" ] * 20 } for i in range(300) ] }
+    log_entries = [ [ "2024-01-01 00:00:00", "Log line {}".format(i) ] for i in range(500) ]
+    writer.save(banner_data, log_entries, { "settle-times": {} }, final=True)
+
+
+def measure(path, schema, repeat):
+    # Best time and peak memory of loading path
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        load_output(path, schema)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    tracemalloc.start()
+    load_output(path, schema)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best_time, peak
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    backends = [ ("json", None) ] + ([ ("orjson", crawl_output.orjson) ] if crawl_output.orjson is not None else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for output_format in [ "json", "jsonl" ]:
+            path = os.path.join(tmp_dir, "output." + output_format)
+            make_output(rng, args.requests, path, output_format)
+            full = load_output(path)
+            for schema in [ ANALYSIS_SCHEMA, DOMAINS_SCHEMA ]:
+                selected, expected = load_output(path, schema), select(full, schema)
+                if any(selected.get(key) != expected.get(key) for key in schema):
+                    print("Selective loading of {} differs from the full output".format(output_format), file=sys.stderr)
+                    exit(1)
+
+            print("{} output, {:.1f} MB".format(output_format, os.path.getsize(path) / 1e6))
+            for backend_name, backend in backends:
+                crawl_output.orjson = backend
+                for schema_name, schema in [ ("full", None), ("analysis", ANALYSIS_SCHEMA), ("domains", DOMAINS_SCHEMA) ]:
+                    elapsed, peak = measure(path, schema, args.repeat)
+                    print("  {:<7} {:<9} {:7.3f} s  peak {:7.1f} MB".format(backend_name, schema_name, elapsed, peak / 1e6))
+            crawl_output.orjson = backends[-1][1]
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
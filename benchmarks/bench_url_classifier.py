@@ -0,0 +1,104 @@
+import argparse
+import os
+import random
+import sys
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analyze-topics-api"))
+from get_domain import getGood2LD, getFullDomain
+from consent_managers import ConsentManagerIndex
+from url_classifier import UrlClassifier
+
+OPEN_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "open-data")
+ANALYZE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analyze-topics-api")
+
+parser = argparse.ArgumentParser(description="Compare the per-URL classification of analyze-topics-api.py "
+                                             "before and after the shared URL classifier")
+parser.add_argument('--sites', type=int, default=200)
+parser.add_argument('--requests', type=int, default=300)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def read_domains_file(file_path):
+    with open(file_path) as file:
+        return { line.split(",")[0].strip() for line in file.readlines() if not line.startswith("#") }
+
+
+def make_sites(n_sites, n_requests, third_parties, seed):
+    # Each site contacts itself and a random subset of third parties, several times, and receives a response for
+    # most of its requests: the same URLs show up in both lists
+    rng = random.Random(seed)
+    sites = []
+    for i in range(n_sites):
+        first_party = "www.site{}.com".format(i)
+        hosts = [ first_party ] + rng.sample(third_parties, min(len(third_parties), 40))
+        urls = [ "https://{}/{}?r={}".format(rng.choice(hosts), rng.randrange(50), rng.randrange(1000)) for _ in range(n_requests) ]
+        responses = [ url for url in urls if rng.random() < 0.9 ]
+        sites.append(urls + responses)
+    return sites
+
+
+def legacy_classify(urls, attested_domains, allowed_domains, consent_managers):
+    # The classification performed by get_topics_api_data before the shared classifier: three URL parses per URL
+    result = (set(), set(), set())
+    for url in urls:
+        domain = getGood2LD(url)
+        if domain in attested_domains:
+            result[0].add(domain)
+        if domain in allowed_domains:
+            result[1].add(domain)
+        cmp_domain = consent_managers.lookup(getFullDomain(url))
+        if cmp_domain is not None:
+            result[2].add(cmp_domain)
+        parse_result = urlparse(url)
+        "{}://{}/".format(parse_result.scheme, parse_result.netloc)
+    return result
+
+
+def classifier_classify(urls, classifier):
+    result = (set(), set(), set())
+    for url in urls:
+        url_info = classifier.classify(url)
+        if url_info.attested:
+            result[0].add(url_info.domain)
+        if url_info.allowed:
+            result[1].add(url_info.domain)
+        if url_info.consent_manager is not None:
+            result[2].add(url_info.consent_manager)
+        url_info.origin
+    return result
+
+
+def main(args):
+    attested_domains = read_domains_file(os.path.join(OPEN_DATA_DIR, "attested_domains.csv"))
+    allowed_domains = read_domains_file(os.path.join(OPEN_DATA_DIR, "allowed_domains.txt"))
+    cmp_domains = { getGood2LD(domain) for domain in read_domains_file(os.path.join(ANALYZE_DIR, "consent-managers.txt")) }
+    consent_managers = ConsentManagerIndex(cmp_domains)
+
+    third_parties = [ "cdn.{}".format(domain) for domain in sorted(attested_domains | cmp_domains) ] + \
+                    [ "tracker{}.example.net".format(i) for i in range(200) ]
+    sites = make_sites(args.sites, args.requests, third_parties, args.seed)
+    n_urls = sum(len(urls) for urls in sites)
+
+    start_time = time.perf_counter()
+    legacy_results = [ legacy_classify(urls, attested_domains, allowed_domains, consent_managers) for urls in sites ]
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    classifier = UrlClassifier(attested_domains, allowed_domains, consent_managers)
+    classifier_results = [ classifier_classify(urls, classifier) for urls in sites ]
+    classifier_time = time.perf_counter() - start_time
+
+    if legacy_results != classifier_results:
+        print("Results differ between legacy path and classifier", file=sys.stderr)
+        exit(1)
+
+    print("{} sites, {} URLs".format(args.sites, n_urls))
+    print("legacy:     {:.3f} s ({:.1f} us/URL)".format(legacy_time, legacy_time / n_urls * 1e6))
+    print("classifier: {:.3f} s ({:.1f} us/URL)".format(classifier_time, classifier_time / n_urls * 1e6))
+    print("speedup:    {:.1f}x".format(legacy_time / classifier_time))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
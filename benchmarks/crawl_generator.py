@@ -0,0 +1,195 @@
+import argparse
+import os
+import random
+import sys
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crawler"))
+from output_writer import get_output_writer, get_output_extension
+
+OPEN_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "open-data")
+ANALYZE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analyze-topics-api")
+
+# Seconds between 1601-01-01 (Chrome's time epoch) and 1970-01-01
+CHROME_EPOCH_OFFSET = 11644473600
+CAMPAIGN_TIME = 1711411200
+SUBDOMAINS = [ "www", "cdn", "static", "ads", "pixel", "sync", "api", "tag", "s", "securepubads" ]
+RESOURCE_TYPES = [ ("Script", "text/javascript", ".js", 0.35), ("Image", "image/gif", ".gif", 0.3),
+                   ("XHR", "application/json", "", 0.15), ("Stylesheet", "text/css", ".css", 0.1),
+                   ("Document", "text/html", "", 0.1) ]
+CALLER_SOURCES = [ ("javascript", 0.7), ("fetch", 0.2), ("iframe", 0.1) ]
+
+# Size of the synthetic crawl outputs: means of the per-visit counts, drawn from exponential distributions so that
+# a few sites are much heavier than the others, as in real crawls
+CrawlProfile = namedtuple("CrawlProfile", ["requests", "third_party_ratio", "topics_usages", "headers", "header_size",
+                                           "cookies", "clicked_ratio"])
+DEFAULT_PROFILE = CrawlProfile(requests=120, third_party_ratio=0.6, topics_usages=2, headers=12, header_size=40,
+                               cookies=40, clicked_ratio=0.4)
+
+ReferenceDomains = namedtuple("ReferenceDomains", ["sites", "third_parties", "weights", "callers"])
+
+parser = argparse.ArgumentParser(description="Write synthetic Priv-Accept outputs, in the same shape of the crawler's")
+parser.add_argument('outdir', type=str)
+parser.add_argument('--sites', type=int, default=100)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--requests', type=int, default=DEFAULT_PROFILE.requests)
+parser.add_argument('--third_party_ratio', type=float, default=DEFAULT_PROFILE.third_party_ratio)
+parser.add_argument('--topics_usages', type=float, default=DEFAULT_PROFILE.topics_usages)
+parser.add_argument('--headers', type=int, default=DEFAULT_PROFILE.headers)
+parser.add_argument('--header_size', type=int, default=DEFAULT_PROFILE.header_size)
+parser.add_argument('--cookies', type=int, default=DEFAULT_PROFILE.cookies)
+parser.add_argument('--clicked_ratio', type=float, default=DEFAULT_PROFILE.clicked_ratio)
+parser.add_argument('--output_format', type=str, default='json', choices=['json', 'jsonl'])
+parser.add_argument('--compress', type=str, default='none', choices=['none', 'gzip', 'zstd'])
+
+
+def read_domains_file(file_path):
+    with open(file_path) as file:
+        return [ line.split(",")[0].strip() for line in file if line.strip() != "" and not line.startswith("#") and not line.startswith("domain,") ]
+
+
+def load_reference_domains(seed):
+    # Third parties are the domains contacted in the open-data crawl, with a Zipf popularity: the Allowed, Attested
+    # and consent manager domains are the most popular ones, the others are ranked at random
+    rng = random.Random(seed)
+    allowed = read_domains_file(os.path.join(OPEN_DATA_DIR, "allowed_domains.txt"))
+    attested = read_domains_file(os.path.join(OPEN_DATA_DIR, "attested_domains.csv"))
+    consent_managers = [ domain for domain in read_domains_file(os.path.join(ANALYZE_DIR, "consent-managers.txt"))
+                         if "*" not in domain ]
+    popular = sorted(set(allowed) | set(attested) | set(consent_managers))
+    rng.shuffle(popular)
+    others = sorted(set(read_domains_file(os.path.join(OPEN_DATA_DIR, "contacted_domains.txt"))) - set(popular))
+    rng.shuffle(others)
+    third_parties = popular + others
+    weights = [ 1 / (rank + 1) for rank in range(len(third_parties)) ]
+    return ReferenceDomains(others, third_parties, weights, sorted(set(allowed) | set(attested)))
+
+
+def get_count(rng, mean):
+    return int(rng.expovariate(1 / mean)) if mean > 0 else 0
+
+
+def make_headers(rng, profile, extra={}):
+    headers = { "x-header-{}".format(i): "{:x}".format(rng.getrandbits(4 * profile.header_size)).rjust(profile.header_size, "0")
+                for i in range(profile.headers) }
+    headers.update(extra)
+    return headers
+
+
+def make_url(rng, domain, resource_type):
+    _, _, extension, _ = resource_type
+    host = domain if domain.count(".") > 1 or domain.startswith("www.") else "{}.{}".format(rng.choice(SUBDOMAINS), domain)
+    return "https://{}/{:x}/{}{}?v={}".format(host, rng.getrandbits(24), rng.randrange(1000), extension, rng.randrange(10 ** 6))
+
+
+def make_visit(rng, profile, references, site, time_offset):
+    # Data of a phase as returned by get_data() with --full_net_log and --detect_topics, as in the campaigns: the
+    # collected network events, the cookies and the Topics API usages
+    visit = { "requests": [], "responses": [], "responses-extra": [] }
+    third_parties = rng.choices(references.third_parties, references.weights, k=40)
+    # Topics API callers present in the page, each with the requests that the analysis links to its usage
+    callers = rng.sample(references.callers, min(get_count(rng, profile.topics_usages), len(references.callers)))
+    usages = []
+    events = []
+    for domain in callers:
+        caller_source = rng.choices([ source for source, _ in CALLER_SOURCES ], [ weight for _, weight in CALLER_SOURCES ])[0]
+        resource_type = RESOURCE_TYPES[0] if caller_source == "javascript" else RESOURCE_TYPES[2 if caller_source == "fetch" else 4]
+        url = make_url(rng, domain, resource_type)
+        usages.append({ "context_origin_url": "https://{}/".format(url.split("/")[2]), "caller_source": caller_source,
+                        "usage_time": int((CAMPAIGN_TIME + time_offset + rng.random() * 10 + CHROME_EPOCH_OFFSET) * 1e6) })
+        events.append((url, resource_type, caller_source))
+    for _ in range(max(get_count(rng, profile.requests), 1)):
+        resource_type = rng.choices(RESOURCE_TYPES, [ weight for _, _, _, weight in RESOURCE_TYPES ])[0]
+        domain = rng.choice(third_parties) if rng.random() < profile.third_party_ratio else "www." + site
+        events.append((make_url(rng, domain, resource_type), resource_type, None))
+    rng.shuffle(events)
+    events.insert(0, ("https://www.{}/".format(site), RESOURCE_TYPES[4], None))
+
+    for i, (url, resource_type, caller_source) in enumerate(events):
+        type_name, mime_type, _, _ = resource_type
+        request_id = "{}.{}".format(rng.randrange(10 ** 5), i)
+        request_headers = { "Sec-Browsing-Topics": "();p=P0000000000000000000000000000000" } if caller_source in ("fetch", "iframe") else {}
+        response_headers = { "content-type": mime_type }
+        if caller_source in ("fetch", "iframe"):
+            response_headers["observe-browsing-topics"] = "?1"
+        timestamp = time_offset + i * 0.01
+        visit["requests"].append({
+            "requestId": request_id, "loaderId": request_id, "documentURL": events[0][0],
+            "request": { "url": url, "method": "GET", "headers": make_headers(rng, profile, request_headers),
+                         "mixedContentType": "none", "initialPriority": "High", "referrerPolicy": "strict-origin-when-cross-origin" },
+            "timestamp": timestamp, "wallTime": CAMPAIGN_TIME + timestamp, "initiator": { "type": "parser", "url": events[0][0] },
+            "redirectHasExtraInfo": False, "type": type_name, "frameId": "F0", "hasUserGesture": False
+        })
+        visit["responses"].append({
+            "requestId": request_id, "loaderId": request_id, "timestamp": timestamp + 0.005, "type": type_name,
+            "response": { "url": url, "status": 200, "statusText": "", "headers": make_headers(rng, profile, response_headers),
+                          "mimeType": mime_type, "connectionReused": True, "connectionId": rng.randrange(1000),
+                          "remoteIPAddress": "10.0.{}.{}".format(rng.randrange(256), rng.randrange(256)), "remotePort": 443,
+                          "fromDiskCache": False, "fromServiceWorker": False, "fromPrefetchCache": False,
+                          "encodedDataLength": rng.randrange(100, 5000), "protocol": "h2", "securityState": "secure" },
+            "hasExtraInfo": True, "frameId": "F0"
+        })
+        visit["responses-extra"].append({
+            "requestId": request_id, "blockedCookies": [], "headers": make_headers(rng, profile, response_headers),
+            "resourceIPAddressSpace": "Public", "statusCode": 200, "cookiePartitionKeyOpaque": False
+        })
+
+    visit["cookies"] = { "cookies": [ { "name": "c{}".format(i), "value": "{:x}".format(rng.getrandbits(128)),
+                                        "domain": "." + rng.choice(third_parties), "path": "/", "expires": CAMPAIGN_TIME + 3e7,
+                                        "size": 34, "httpOnly": False, "secure": True, "session": False, "sameSite": "None",
+                                        "priority": "Medium", "sameParty": False, "sourceScheme": "Secure", "sourcePort": 443 }
+                                      for i in range(get_count(rng, profile.cookies)) ] }
+    visit["topics_api_usages"] = usages
+    return visit
+
+
+def make_banner_data(rng, clicked):
+    if not clicked:
+        return { "clicked_element": None, "candidate_elements": [] }
+    candidates = [ { "id": i, "tag_name": rng.choice([ "button", "a", "span" ]), "text": rng.choice([ "Accept all", "I agree", "OK" ]),
+                     "size": { "height": 40, "width": 120 }, "in_banner": i == 0,
+                     "signature": [ { "tag": "div", "class": "cookie-banner-{}".format(j) } for j in range(rng.randrange(5, 15)) ] }
+                   for i in range(rng.randrange(1, 6)) ]
+    return { "clicked_element": 0, "candidate_elements": candidates }
+
+
+def write_site_output(rng, profile, references, site, path, output_format="json", compress="none"):
+    # One output of priv-accept.py, phase by phase, through the crawler's own writer
+    writer = get_output_writer(path, output_format, compress, False)
+    clicked = rng.random() < profile.clicked_ratio
+    stats = { "network-events": {}, "settle-times": {} }
+    phases = [ ("first", profile) ]
+    if clicked:
+        phases += [ ("click", profile._replace(requests=profile.requests / 10, topics_usages=0)), ("second", profile) ]
+    for i, (phase, phase_profile) in enumerate(phases):
+        data = make_visit(rng, phase_profile, references, site, i * 30)
+        stats["network-events"][phase] = 3 * len(data["requests"])
+        stats["settle-times"][phase] = rng.uniform(1, 5)
+        writer.write_phase(phase, data)
+    log_entries = [ [ "2024-03-26 00:00:{:02d}".format(i), "Log line {}".format(i) ] for i in range(rng.randrange(10, 40)) ]
+    writer.save(make_banner_data(rng, clicked), log_entries, stats, final=True)
+
+
+def generate_crawl(outdir, n_sites, profile=DEFAULT_PROFILE, seed=0, output_format="json", compress="none"):
+    # Outputs of a crawl of n_sites websites, named as by crawl-pool.py. The same seed gives the same crawl
+    rng = random.Random(seed)
+    references = load_reference_domains(seed)
+    os.makedirs(outdir, exist_ok=True)
+    sites = rng.sample(references.sites, n_sites)
+    paths = []
+    for site in sites:
+        path = os.path.join(outdir, "output_{}{}".format(site, get_output_extension(output_format, compress)))
+        write_site_output(rng, profile, references, site, path, output_format, compress)
+        paths.append(path)
+    return paths
+
+
+def main(args):
+    profile = CrawlProfile(args.requests, args.third_party_ratio, args.topics_usages, args.headers, args.header_size,
+                           args.cookies, args.clicked_ratio)
+    paths = generate_crawl(args.outdir, args.sites, profile, args.seed, args.output_format, args.compress)
+    print("Written {} outputs, {:.1f} MB".format(len(paths), sum(os.path.getsize(path) for path in paths) / 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,394 @@
+import argparse
+import functools
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple, Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote
+
+from crawl_generator import ANALYZE_DIR, load_reference_domains, read_domains_file, get_count
+
+CRAWLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crawler")
+CONSENT_COOKIE = "farm_consent"
+TLS_HANDSHAKE = b"\x16"
+CONNECTION_TIMEOUT = 30
+PAGE_CACHE_SIZE = 4096
+# Topics API callers of the farm: their sites must be passed to Chrome as enrollment overrides
+MAX_CALLERS = 50
+SUBDOMAINS = [ "www", "cdn", "static", "ads", "pixel", "sync", "api", "tag", "s" ]
+RESOURCE_KINDS = [ ("js", 0.35), ("gif", 0.35), ("css", 0.1), ("json", 0.1), ("html", 0.1) ]
+CONTENT_TYPES = { "js": "text/javascript", "gif": "image/gif", "css": "text/css", "json": "application/json",
+                  "html": "text/html; charset=utf-8" }
+GIF = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+WORDS = [ "lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod", "tempor",
+          "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua", "enim", "ad", "minim", "veniam", "quis" ]
+
+# Size and speed of the generated websites: means of the per-page counts, drawn from exponential distributions as in
+# crawl_generator.py, and the delay of every response, in milliseconds
+FarmProfile = namedtuple("FarmProfile", ["subresources", "third_party_ratio", "topics_callers", "banner_ratio", "frame_ratio",
+                                         "frame_depth", "elements", "script_size", "internal_links", "latency", "jitter"])
+DEFAULT_PROFILE = FarmProfile(subresources=60, third_party_ratio=0.7, topics_callers=2, banner_ratio=0.8, frame_ratio=0.4,
+                              frame_depth=2, elements=300, script_size=20000, internal_links=10, latency=50, jitter=50)
+
+# Per-website choices, the same for all its pages
+SiteTraits = namedtuple("SiteTraits", ["banner", "consent_manager", "accept_text", "third_parties", "gated", "callers"])
+
+parser = argparse.ArgumentParser(description="Serve synthetic websites locally, to run priv-accept.py end to end without network")
+parser.add_argument('--port', type=int, default=8443)
+parser.add_argument('--sites', type=int, default=100)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--cert', type=str, default=None)
+parser.add_argument('--key', type=str, default=None)
+parser.add_argument('--no_tls', action='store_true')
+parser.add_argument('--subresources', type=int, default=DEFAULT_PROFILE.subresources)
+parser.add_argument('--third_party_ratio', type=float, default=DEFAULT_PROFILE.third_party_ratio)
+parser.add_argument('--topics_callers', type=float, default=DEFAULT_PROFILE.topics_callers)
+parser.add_argument('--banner_ratio', type=float, default=DEFAULT_PROFILE.banner_ratio)
+parser.add_argument('--frame_ratio', type=float, default=DEFAULT_PROFILE.frame_ratio)
+parser.add_argument('--frame_depth', type=int, default=DEFAULT_PROFILE.frame_depth)
+parser.add_argument('--elements', type=int, default=DEFAULT_PROFILE.elements)
+parser.add_argument('--script_size', type=int, default=DEFAULT_PROFILE.script_size)
+parser.add_argument('--internal_links', type=int, default=DEFAULT_PROFILE.internal_links)
+parser.add_argument('--latency', type=float, default=DEFAULT_PROFILE.latency)
+parser.add_argument('--jitter', type=float, default=DEFAULT_PROFILE.jitter)
+parser.add_argument('--url_file', type=str, default=None)
+parser.add_argument('--tranco_file', type=str, default=None)
+
+
+def get_host(rng, domain):
+    return domain if domain.count(".") > 1 else "{}.{}".format(rng.choice(SUBDOMAINS), domain)
+
+
+def read_accept_words():
+    with open(os.path.join(CRAWLER_DIR, "accept_words.txt")) as file:
+        return [ line.strip() for line in file if line.strip() != "" and not line.startswith("#") ]
+
+
+def make_text(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def make_filler_script(size):
+    # Script body of the third parties, only parsed and run by the browser
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        i = len(lines)
+        lines.append("function f{0}(a) {{ var b = a * {0} + 1; return typeof a === 'string' ? a.length + b : b; }}\n".format(i))
+    return "".join(lines).encode()
+
+
+class SiteFarm:
+    # Websites drawn from the domains of the open-data crawl, with their third parties, consent banners and Topics API
+    # callers. Every page and resource is generated from the seed and its URL: the same seed always serves the same
+    # websites, whatever the order of the requests
+
+    def __init__(self, n_sites, profile=DEFAULT_PROFILE, seed=0):
+        self.profile = profile
+        self.seed = seed
+        rng = random.Random(seed)
+        self.references = load_reference_domains(seed)
+        self.sites = rng.sample(self.references.sites, n_sites)
+        self.site_set = set(self.sites)
+        self.callers = set(rng.sample(self.references.callers, min(MAX_CALLERS, len(self.references.callers))))
+        # Only the callers of the farm call the Topics API, the other Allowed or Attested domains are left out
+        all_callers = set(self.references.callers)
+        self.third_parties, self.weights = zip(*[ (domain, weight) for domain, weight in zip(self.references.third_parties, self.references.weights)
+                                                  if domain not in all_callers or domain in self.callers ])
+        self.consent_managers = [ domain for domain in read_domains_file(os.path.join(ANALYZE_DIR, "consent-managers.txt"))
+                                  if "*" not in domain ]
+        self.accept_words = read_accept_words()
+        self.filler_script = make_filler_script(profile.script_size)
+        self.tls = False
+        # Pages are the same at every request: generate them once, so that the farm is not the bottleneck of the crawl
+        self.make_page = functools.lru_cache(maxsize=PAGE_CACHE_SIZE)(self.make_page)
+        self.traits = {}
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def get_rng(self, *keys):
+        return random.Random(":".join([ str(self.seed) ] + [ str(key) for key in keys ]))
+
+    def get_site(self, host):
+        site = host[len("www."):] if host.startswith("www.") else host
+        return site if site in self.site_set else None
+
+    def get_traits(self, site):
+        with self.lock:
+            if site in self.traits:
+                return self.traits[site]
+        rng = self.get_rng("site", site)
+        banner = None
+        if rng.random() < self.profile.banner_ratio:
+            banner = "frame" if rng.random() < self.profile.frame_ratio else "main"
+        third_parties = sorted(set(get_host(rng, domain) for domain in rng.choices(self.third_parties, self.weights, k=max(self.profile.subresources // 3, 1))))
+        gated = rng.sample(third_parties, len(third_parties) // 3)
+        callers = rng.sample(sorted(self.callers), min(get_count(rng, self.profile.topics_callers), len(self.callers)))
+        traits = SiteTraits(banner, get_host(rng, rng.choice(self.consent_managers)), rng.choice(self.accept_words).capitalize(),
+                            [ host for host in third_parties if host not in gated ], gated, [ get_host(rng, domain) for domain in callers ])
+        with self.lock:
+            self.traits[site] = traits
+        return traits
+
+    def get_delay(self):
+        return (self.profile.latency + random.random() * self.profile.jitter) / 1000
+
+    def add_stats(self, kind, size):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["requests:" + kind] += 1
+            self.stats["bytes"] += size
+
+    def get_chrome_options(self, port):
+        # Every hostname resolves to the farm, whatever the port, and the self-signed certificate is accepted. The
+        # Topics API callers are enrolled through the command line, as they are not in the attestations of Chrome
+        return [ "host-resolver-rules=MAP *:80 127.0.0.1:{0},MAP *:443 127.0.0.1:{0},EXCLUDE localhost".format(port),
+                 "ignore-certificate-errors",
+                 "privacy-sandbox-enrollment-overrides=" + ",".join("https://" + domain for domain in sorted(self.callers)) ]
+
+    def get_resource_urls(self, rng, site, scheme, third_parties, n):
+        urls = []
+        for _ in range(n):
+            kind = rng.choices([ kind for kind, _ in RESOURCE_KINDS ], [ weight for _, weight in RESOURCE_KINDS ])[0]
+            host = rng.choice(third_parties) if len(third_parties) > 0 and rng.random() < self.profile.third_party_ratio else "www." + site
+            urls.append((kind, "{}://{}/r/{:x}.{}".format(scheme, host, rng.getrandbits(32), kind)))
+        return urls
+
+    def make_page(self, site, path, scheme, consented):
+        # A document of a website: its text, internal links and subresources, the banner until consent is given, and
+        # the third parties gated by the consent
+        rng = self.get_rng("page", site, path)
+        traits = self.get_traits(site)
+        resources = self.get_resource_urls(rng, site, scheme, traits.third_parties, max(get_count(rng, self.profile.subresources), 1))
+        gated_scripts = [ "{}://{}/r/{:x}.js".format(scheme, host, rng.getrandbits(32)) for host in traits.gated ]
+
+        head = [ '<link rel="stylesheet" href="{}">'.format(url) for kind, url in resources if kind == "css" ]
+        head += [ '<script src="{}"></script>'.format(url) for kind, url in resources if kind == "js" ]
+        head += [ '<script src="{}://{}/topics/{:x}.js"></script>'.format(scheme, host, rng.getrandbits(32)) for host in traits.callers ]
+        if consented:
+            head += [ '<script src="{}"></script>'.format(url) for url in gated_scripts ]
+
+        links = [ '<a href="/page/{0}">{1}</a>'.format(rng.randrange(1000), make_text(rng, 2)) for _ in range(self.profile.internal_links) ]
+        images = [ '<img src="{}" width="1" height="1" alt="">'.format(url) for kind, url in resources if kind == "gif" ]
+        frames = [ '<iframe src="{}" width="300" height="250"></iframe>'.format(url) for kind, url in resources if kind == "html" ]
+        body = []
+        for i in range(max(get_count(rng, self.profile.elements), 1)):
+            body.append('<div class="block-{}"><p>{}</p></div>'.format(i % 7, make_text(rng, rng.randrange(10, 30))))
+            if len(images) > 0 and rng.random() < 0.1:
+                body.append(images.pop())
+        body += images + frames
+
+        fetches = [ url for kind, url in resources if kind == "json" ]
+        script = "var fetches = {};\nfetches.forEach(function (url) {{ fetch(url, {{ credentials: 'include' }}).catch(function () {{}}); }});\n".format(fetches)
+        banner = ""
+        if not consented and traits.banner is not None:
+            script += ("function acceptConsent() {{\n"
+                       "  document.cookie = '{}=1; path=/; max-age=31536000';\n"
+                       "  document.getElementById('cookie-banner').style.display = 'none';\n"
+                       "  {}.forEach(function (url) {{ var s = document.createElement('script'); s.src = url; document.head.appendChild(s); }});\n"
+                       "}}\n"
+                       "window.addEventListener('message', function (e) {{ if (e.data === 'consent-accepted') acceptConsent(); }});\n").format(
+                       CONSENT_COOKIE, gated_scripts)
+            if traits.banner == "main":
+                banner = self.make_banner(traits.accept_text, "acceptConsent()")
+            else:
+                banner = ('<div id="cookie-banner" style="position: fixed; bottom: 0; left: 0; right: 0; z-index: 1000">'
+                          '<iframe src="{}://{}/cmp/frame.html?site={}&depth={}" width="100%" height="200"></iframe></div>').format(
+                          scheme, traits.consent_manager, quote(site), self.profile.frame_depth)
+
+        return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{}</title>\n{}\n</head><body>\n'
+                '<header><nav>{}</nav></header>\n<main>\n{}\n</main>\n{}\n<script>\n{}</script>\n</body></html>\n').format(
+                site, "\n".join(head), " ".join(links), "\n".join(body), banner, script).encode()
+
+    def make_banner(self, accept_text, action):
+        return ('<div id="cookie-banner" class="cookie-consent-banner" role="dialog" '
+                'style="position: fixed; bottom: 0; left: 0; right: 0; padding: 20px; background: #fff; z-index: 1000">'
+                '<p>We and our partners use cookies to personalise content and ads.</p>'
+                '<button onclick="this.parentNode.style.display = \'none\'">Settings</button> '
+                '<button onclick="{}">{}</button></div>').format(action, accept_text)
+
+    def make_consent_manager_frame(self, scheme, host, query):
+        # Frames of a consent manager, nested down to the one with the banner, which notifies the top document
+        params = parse_qs(query)
+        site = params.get("site", [ "" ])[0]
+        depth = int(params.get("depth", [ "1" ])[0])
+        traits = self.get_traits(site) if site in self.site_set else None
+        if traits is None:
+            return None
+        if depth > 1:
+            content = '<iframe src="{}://{}/cmp/frame.html?site={}&depth={}" width="100%" height="180"></iframe>'.format(
+                      scheme, host, quote(site), depth - 1)
+        else:
+            content = self.make_banner(traits.accept_text, "window.top.postMessage('consent-accepted', '*')")
+        return '<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head><body>{}</body></html>\n'.format(content).encode()
+
+    def make_topics_resource(self, scheme, host, path):
+        # Resources of the Topics API callers: a script that fetches with the Topics header and adds a frame of the
+        # caller, which calls document.browsingTopics() in its own origin
+        name, kind = path[len("/topics/"):].rsplit(".", 1)
+        if kind == "js":
+            return ("(function () {{\n"
+                    "  fetch('{0}://{1}/topics/{2}.json', {{ browsingTopics: true }}).catch(function () {{}});\n"
+                    "  var frame = document.createElement('iframe');\n"
+                    "  frame.src = '{0}://{1}/topics/{2}.html';\n"
+                    "  frame.style.display = 'none';\n"
+                    "  frame.setAttribute('browsingtopics', '');\n"
+                    "  document.documentElement.appendChild(frame);\n"
+                    "}})();\n").format(scheme, host, name).encode()
+        if kind == "html":
+            return b"<!DOCTYPE html>\n<html><body><script>if (document.browsingTopics) document.browsingTopics().catch(function () {});</script></body></html>\n"
+        return b'{"topics": []}'
+
+    def make_resource(self, scheme, host, kind):
+        if kind == "js":
+            return self.filler_script
+        if kind == "gif":
+            return GIF
+        if kind == "css":
+            return b".block-0 { margin: 1em; } .block-1 { padding: 2px; } nav a { margin-right: 1em; }\n"
+        if kind == "json":
+            return b'{"ok": true}'
+        return '<!DOCTYPE html>\n<html><body><img src="{}://{}/r/{:x}.gif" alt=""></body></html>\n'.format(
+               scheme, host, random.getrandbits(32)).encode()
+
+    def handle(self, host, path, headers, tls):
+        # Status, headers and body of a request. Documents of plain HTTP are redirected to HTTPS, as in most websites
+        scheme = "https" if tls else "http"
+        url = urlsplit(path)
+        response_headers = {}
+        if url.path.startswith("/topics/") and url.path.rsplit(".", 1)[-1] in CONTENT_TYPES:
+            kind, body = url.path.rsplit(".", 1)[-1], self.make_topics_resource(scheme, host, url.path)
+            if headers.get("Sec-Browsing-Topics") is not None:
+                response_headers["Observe-Browsing-Topics"] = "?1"
+            response_headers["Cache-Control"] = "no-store"
+        elif url.path.startswith("/r/") and url.path.rsplit(".", 1)[-1] in CONTENT_TYPES:
+            kind = url.path.rsplit(".", 1)[-1]
+            body = self.make_resource(scheme, host, kind)
+            response_headers["Cache-Control"] = "max-age=3600"
+            if self.get_site(host) is None and kind in ("js", "gif") and "Cookie" not in headers:
+                response_headers["Set-Cookie"] = "uid={:x}; Max-Age=31536000; Path=/; Secure; SameSite=None".format(random.getrandbits(64))
+        elif url.path == "/cmp/frame.html":
+            kind, body = "html", self.make_consent_manager_frame(scheme, host, url.query)
+        elif self.get_site(host) is not None and (url.path == "/" or url.path.startswith("/page/")):
+            if not tls and self.tls:
+                self.add_stats("redirect", 0)
+                return 301, { "Location": "https://{}{}".format(host, path), "Cache-Control": "no-cache" }, b""
+            consented = "{}=1".format(CONSENT_COOKIE) in headers.get("Cookie", "")
+            kind, body = "html", self.make_page(self.get_site(host), url.path, scheme, consented)
+            response_headers["Cache-Control"] = "no-cache"
+        else:
+            body = None
+        if body is None:
+            self.add_stats("not-found", 0)
+            return 404, { "Content-Type": "text/plain" }, b"Not found\n"
+
+        self.add_stats(kind, len(body))
+        response_headers["Content-Type"] = CONTENT_TYPES[kind]
+        return 200, response_headers, body
+
+
+class FarmRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        host = self.headers.get("Host", "").split(":")[0].lower()
+        status, headers, body = self.server.farm.handle(host, self.path, self.headers, self.server.is_tls(self.connection))
+        time.sleep(self.server.farm.get_delay())
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FarmServer(ThreadingHTTPServer):
+    # HTTP and HTTPS on the same port, as Chrome maps every hostname to a single port: a connection is wrapped in TLS
+    # when its first byte is the one of a handshake
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, farm, port, ssl_context=None):
+        self.farm = farm
+        self.ssl_context = ssl_context
+        farm.tls = ssl_context is not None
+        super().__init__(("127.0.0.1", port), FarmRequestHandler)
+
+    def is_tls(self, connection):
+        return isinstance(connection, ssl.SSLSocket)
+
+    def finish_request(self, request, client_address):
+        request.settimeout(CONNECTION_TIMEOUT)
+        if self.ssl_context is not None:
+            try:
+                if request.recv(1, socket.MSG_PEEK) == TLS_HANDSHAKE:
+                    request = self.ssl_context.wrap_socket(request, server_side=True)
+            except (OSError, ssl.SSLError):
+                return
+        try:
+            self.RequestHandlerClass(request, client_address, self)
+        finally:
+            if isinstance(request, ssl.SSLSocket):
+                self.shutdown_request(request)
+
+
+def make_certificate(directory):
+    # Self-signed certificate, as Chrome is run with ignore-certificate-errors
+    cert, key = os.path.join(directory, "farm-cert.pem"), os.path.join(directory, "farm-key.pem")
+    subprocess.run([ "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30", "-subj", "/CN=site-farm",
+                     "-keyout", key, "-out", cert ], check=True, capture_output=True)
+    return cert, key
+
+
+def start_farm(farm, port=0, cert=None, key=None, tls=True):
+    # Serve the farm from a background thread. Port 0 picks a free port, read from server.server_address
+    ssl_context = None
+    if tls:
+        if cert is None:
+            cert, key = make_certificate(tempfile.mkdtemp(prefix="site-farm-"))
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(cert, key)
+    server = FarmServer(farm, port, ssl_context)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_site_lists(sites, url_file=None, tranco_file=None):
+    # The websites, one per line for priv-accept.py --url_file, and ranked for crawl-pool.py
+    if url_file is not None:
+        with open(url_file, "w") as file:
+            file.writelines(site + "\n" for site in sites)
+    if tranco_file is not None:
+        with open(tranco_file, "w") as file:
+            file.writelines("{},{}\n".format(rank, site) for rank, site in enumerate(sites, 1))
+
+
+def main(args):
+    profile = FarmProfile(args.subresources, args.third_party_ratio, args.topics_callers, args.banner_ratio, args.frame_ratio,
+                          args.frame_depth, args.elements, args.script_size, args.internal_links, args.latency, args.jitter)
+    farm = SiteFarm(args.sites, profile, args.seed)
+    write_site_lists(farm.sites, args.url_file, args.tranco_file)
+    server = start_farm(farm, args.port, args.cert, args.key, not args.no_tls)
+    port = server.server_address[1]
+    print("Serving {} websites on port {}. Options of priv-accept.py:".format(len(farm.sites), port), file=sys.stderr)
+    for option in farm.get_chrome_options(port):
+        print("--chrome_extra_option={}".format(option))
+    try:
+        while True:
+            time.sleep(60)
+            print("{} requests, {:.1f} MB served".format(farm.stats["requests"], farm.stats["bytes"] / 1e6), file=sys.stderr)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
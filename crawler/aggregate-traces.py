@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+TRACE_EXTENSIONS = (".trace.json", ".trace.json.gz")
+
+parser = argparse.ArgumentParser(description="Aggregate the traces written by priv-accept.py --trace over a campaign")
+parser.add_argument('trace_dir', type=str)
+parser.add_argument('--top', type=int, default=20)
+parser.add_argument('--outfile', type=str, default=None)
+
+
+def main(args):
+    totals = {}
+    durations = {}
+    n_traces = 0
+    for path in iter_trace_files(args.trace_dir):
+        try:
+            trace = read_trace(path)
+        except (OSError, ValueError) as e:
+            log("Skipping {}: {}".format(path, e))
+            continue
+        n_traces += 1
+        for key, entry in trace.get("summary", {}).items():
+            total = totals.setdefault(key, { "count": 0, "time": 0, "bytes-sent": 0, "bytes-received": 0, "traces": 0 })
+            for field in [ "count", "time", "bytes-sent", "bytes-received" ]:
+                total[field] += entry[field]
+            total["traces"] += 1
+            durations.setdefault(key, []).append(entry["time"])
+        # Phases still open when the trace was last saved, i.e., where killed visits were stuck
+        for event in trace["traceEvents"]:
+            if event["ph"] == "B" and event["cat"] == "phase":
+                totals.setdefault("unfinished:" + event["name"], { "count": 0, "time": 0, "bytes-sent": 0, "bytes-received": 0, "traces": 0 })["count"] += 1
+
+    if n_traces == 0:
+        log("No trace found in {}".format(args.trace_dir))
+        exit(1)
+
+    for key, total in totals.items():
+        total["p50"] = get_percentile(durations.get(key, []), 0.5)
+        total["p95"] = get_percentile(durations.get(key, []), 0.95)
+    phase_time = sum(total["time"] for key, total in totals.items() if key.startswith("phase:"))
+
+    print("{} trace(s), {:.1f} h of visits".format(n_traces, phase_time / 3600))
+    print_table("Phases", totals, "phase:", phase_time, len(totals))
+    print_table("Calls", totals, None, phase_time, args.top)
+    unfinished = { key: total for key, total in totals.items() if key.startswith("unfinished:") }
+    if len(unfinished) > 0:
+        print("\nUnfinished phases (visits killed or failed):")
+        for key, total in sorted(unfinished.items(), key=lambda item: item[1]["count"], reverse=True):
+            print("  {:<24} {:8d}".format(key.split(":", 1)[1], total["count"]))
+
+    if args.outfile is not None:
+        with open(args.outfile, "w") as file:
+            json.dump({ "traces": n_traces, "totals": totals }, file, indent=4)
+
+
+def print_table(title, totals, prefix, phase_time, top):
+    # Spans with the highest total time: the phases, or the calls and inner spans
+    rows = [ (key, total) for key, total in totals.items() if not key.startswith("unfinished:") and
+             (key.startswith(prefix) if prefix is not None else not key.startswith("phase:")) ]
+    rows.sort(key=lambda row: row[1]["time"], reverse=True)
+    print("\n{}:".format(title))
+    print("  {:<36} {:>10} {:>10} {:>7} {:>9} {:>9} {:>10} {:>10}".format("span", "count", "time [s]", "share", "p50 [s]",
+                                                                          "p95 [s]", "sent [MB]", "recv [MB]"))
+    for key, total in rows[:top]:
+        print("  {:<36} {:>10d} {:>10.1f} {:>6.1f}% {:>9.3f} {:>9.3f} {:>10.1f} {:>10.1f}".format(
+              key, total["count"], total["time"], 100 * total["time"] / phase_time if phase_time > 0 else 0,
+              total["p50"], total["p95"], total["bytes-sent"] / 1e6, total["bytes-received"] / 1e6))
+
+
+def get_percentile(values, percentile):
+    # Percentile of the per-visit totals
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(percentile * len(values)), len(values) - 1)]
+
+
+def iter_trace_files(trace_dir):
+    for root, _, names in os.walk(trace_dir):
+        for name in sorted(names):
+            if name.endswith(TRACE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def read_trace(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as file:
+        return json.load(file)
+
+
+def log(str):
+    print(str, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
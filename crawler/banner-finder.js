@@ -0,0 +1,70 @@
+// Search the accept button of a privacy banner in the current frame, in a single evaluation: the visible elements
+// whose text is one of the (normalised) accept words, ranked from the most likely one, each with its signature,
+// i.e., the tag and attributes of the element and of all its ancestors, from the root
+function findBannerCandidates(acceptWords, selector, maxCandidates) {
+    const BANNER_REGEX = /cookie|consent|gdpr|privacy|cmp|banner|didomi|onetrust|quantcast|iubenda/i;
+    const TAG_RANKS = { "button": 0, "a": 1, "span": 2, "div": 3, "p": 4, "form": 5 };
+
+    const words = new Set(acceptWords);
+    const maxLength = acceptWords.reduce((max, word) => Math.max(max, word.length), 0);
+
+    // Same normalisation of the accept words: whitespace collapsed, lower case, decorations stripped
+    function normalise(text) {
+        return text.replace(/\s+/g, " ").toLowerCase().replace(/^[ ✓›!]+|[ ✓›!]+$/g, "");
+    }
+
+    function isVisible(element) {
+        if (element.getClientRects().length === 0)
+            return false;
+        const style = getComputedStyle(element);
+        return style.visibility === "visible" && style.opacity !== "0";
+    }
+
+    function isInBanner(element) {
+        for (let current = element; current !== null; current = current.parentElement) {
+            const description = (current.id || "") + " " + (current.getAttribute("class") || "") + " " +
+                                (current.getAttribute("role") || "") + " " + (current.getAttribute("aria-label") || "");
+            if (BANNER_REGEX.test(description) || current.getAttribute("aria-modal") === "true")
+                return true;
+        }
+        return false;
+    }
+
+    function getSignature(element) {
+        const signature = [];
+        for (let current = element; current !== null; current = current.parentElement) {
+            const props = { "tag": current.tagName.toLowerCase() };
+            for (const attribute of current.attributes)
+                props[attribute.name] = attribute.value;
+            signature.unshift(props);
+        }
+        return signature;
+    }
+
+    const matches = [];
+    for (const element of document.querySelectorAll(selector)) {
+        // The text of an element is never shorter than its visible text: skip the long ones without rendering them
+        if (element.textContent.length > 4 * maxLength + 100)
+            continue;
+        const text = element.innerText || "";
+        if (words.has(normalise(text)) && isVisible(element))
+            matches.push({ element: element, text: text, order: matches.length });
+    }
+
+    // Innermost elements first (a container of the button has the same text), then the ones in a banner-like
+    // container, then buttons and links, then in document order
+    for (const match of matches) {
+        match.outer = matches.some(other => other !== match && match.element.contains(other.element)) ? 1 : 0;
+        match.banner = isInBanner(match.element) ? 0 : 1;
+        match.tag = match.element.tagName.toLowerCase();
+    }
+    matches.sort((a, b) => (a.outer - b.outer) || (a.banner - b.banner) ||
+                           ((TAG_RANKS[a.tag] ?? 6) - (TAG_RANKS[b.tag] ?? 6)) || (a.order - b.order));
+
+    return matches.slice(0, maxCandidates).map(match => {
+        const rect = match.element.getBoundingClientRect();
+        return { element: match.element, tag_name: match.tag, text: match.text,
+                 size: { height: rect.height, width: rect.width }, in_banner: match.banner === 0,
+                 signature: getSignature(match.element) };
+    });
+}
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import json
+import os
+import queue
+import shlex
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+WORKER_RESULT_PREFIX = "WORKER-RESULT"
+
+parser = argparse.ArgumentParser(description="Run a pool of priv-accept.py workers over the Tranco list. "
+                                             "Unknown arguments are passed to every worker.")
+parser.add_argument('tranco_file', type=str)
+parser.add_argument('--limit', type=int, default=50000)
+parser.add_argument('--workers', type=int, default=4)
+parser.add_argument('--worker_command', type=str, default="python3 priv-accept.py")
+parser.add_argument('--outdir', type=str, default='output')
+parser.add_argument('--journal', type=str, default='crawl-journal.sqlite')
+parser.add_argument('--site_timeout', type=int, default=1200)
+parser.add_argument('--retries', type=int, default=2)
+parser.add_argument('--backoff', type=int, default=60)
+parser.add_argument('--report_interval', type=int, default=60)
+parser.add_argument('--log_dir', type=str, default=None)
+
+
+def main(args, worker_args):
+    journal = Journal(args.journal)
+    sites = read_tranco_file(args.tranco_file, args.limit)
+    journal.add_sites(sites)
+
+    scheduler = Scheduler(args.retries + 1, args.backoff)
+    for domain, rank, attempts in journal.get_pending(args.retries + 1):
+        scheduler.add(domain, rank, attempts)
+    log("{} site(s) to crawl, {} already completed or failed".format(scheduler.pending(), len(sites) - scheduler.pending()))
+
+    if args.log_dir is not None and not os.path.exists(args.log_dir):
+        os.makedirs(args.log_dir)
+
+    command = shlex.split(args.worker_command) + ["--url_file", "-", "--outdir", args.outdir] + worker_args
+    report = Report()
+    workers = [ threading.Thread(target=run_worker, args=(i, command, scheduler, journal, report, args), daemon=True)
+                for i in range(args.workers) ]
+    for worker in workers:
+        worker.start()
+
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(args.report_interval / len(workers))
+        report.print(scheduler)
+
+    report.print(scheduler)
+    journal.close()
+    log("All Done")
+
+
+def read_tranco_file(file_path, limit):
+    sites = []
+    with open(file_path) as file:
+        for line in file:
+            if len(sites) >= limit:
+                break
+            if line.strip() == "":
+                continue
+            rank, domain = line.strip().split(",")[:2]
+            sites.append((domain, int(rank)))
+    return sites
+
+
+class Journal:
+    # Crash-safe record of the crawl: every state change is committed before the next site is scheduled
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sites (\
+                               domain TEXT PRIMARY KEY, rank INTEGER, status TEXT, attempts INTEGER,\
+                               last_error TEXT, duration REAL, updated REAL)")
+        self.conn.commit()
+
+    def add_sites(self, sites):
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO sites (domain, rank, status, attempts) VALUES (?, ?, 'pending', 0)", sites)
+            self.conn.commit()
+
+    def get_pending(self, max_attempts):
+        with self.lock:
+            res = self.conn.execute("SELECT domain, rank, attempts FROM sites\
+                                     WHERE status != 'done' AND attempts < ? ORDER BY rank", [max_attempts])
+            return res.fetchall()
+
+    def record(self, domain, status, attempts, error, duration):
+        with self.lock:
+            self.conn.execute("UPDATE sites SET status = ?, attempts = ?, last_error = ?, duration = ?, updated = ? WHERE domain = ?",
+                              [status, attempts, error, duration, time.time(), domain])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Scheduler:
+    # Queue of sites ordered by the time they can be (re)tried
+
+    def __init__(self, max_attempts, backoff):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.heap = []
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def add(self, domain, rank, attempts, not_before=0):
+        with self.cond:
+            heapq.heappush(self.heap, (not_before, rank, domain, attempts))
+            self.cond.notify()
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap)
+
+    def get(self):
+        # Returns None when the crawl is over, i.e. there is nothing queued and nothing that could be retried
+        with self.cond:
+            while True:
+                if len(self.heap) == 0 and self.in_flight == 0:
+                    self.cond.notify_all()
+                    return None
+                if len(self.heap) > 0:
+                    wait = self.heap[0][0] - time.time()
+                    if wait <= 0:
+                        self.in_flight += 1
+                        _, rank, domain, attempts = heapq.heappop(self.heap)
+                        return domain, rank, attempts
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+
+    def can_retry(self, attempts):
+        return attempts < self.max_attempts
+
+    def done(self, domain, rank, attempts, retry):
+        with self.cond:
+            self.in_flight -= 1
+            if retry:
+                not_before = time.time() + self.backoff * 2 ** (attempts - 1)
+                heapq.heappush(self.heap, (not_before, rank, domain, attempts))
+            self.cond.notify_all()
+
+
+class Report:
+    # Live throughput and failure breakdown of the crawl
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.failures = Counter()
+
+    def add(self, status, retry):
+        with self.lock:
+            if status == "ok":
+                self.completed += 1
+                return
+            self.failures[status] += 1
+            if retry:
+                self.retried += 1
+            else:
+                self.failed += 1
+
+    def print(self, scheduler):
+        with self.lock:
+            elapsed = (time.time() - self.start_time) / 60
+            throughput = (self.completed + self.failed) / elapsed if elapsed > 0 else 0
+            log("Completed: {}, failed: {}, retried: {}, queued: {}, throughput: {:.2f} sites/min".format(
+                self.completed, self.failed, self.retried, scheduler.pending(), throughput))
+            if len(self.failures) > 0:
+                log("Failures: {}".format(", ".join("{}={}".format(k, v) for k, v in self.failures.most_common())))
+
+
+class Worker:
+    # A priv-accept.py process in worker mode, fed one site at a time through stdin
+
+    def __init__(self, index, command, log_dir):
+        self.index = index
+        self.lines = queue.Queue()
+        self.log_file = open("{}/worker-{}.log".format(log_dir, index), "a") if log_dir is not None else None
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        text=True, bufsize=1, start_new_session=True)
+        threading.Thread(target=self.read_output, daemon=True).start()
+
+    def read_output(self):
+        for line in self.process.stdout:
+            if self.log_file is not None:
+                self.log_file.write(line)
+                self.log_file.flush()
+            if line.startswith(WORKER_RESULT_PREFIX):
+                self.lines.put(json.loads(line[len(WORKER_RESULT_PREFIX):]))
+        # End of output: the worker is gone
+        self.lines.put(None)
+        if self.log_file is not None:
+            self.log_file.close()
+
+    def visit(self, site, budget):
+        # Returns the status of the visit: "ok", the error reported by the worker, "timeout" or "crash"
+        try:
+            self.process.stdin.write(site + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            return "crash"
+
+        deadline = time.time() + budget
+        while True:
+            try:
+                result = self.lines.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                return "timeout"
+            if result is None:
+                return "crash"
+            if result["site"] == site:
+                return result["status"]
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        # Kill the whole process group, so that Chrome, chromedriver and Xvfb do not survive the worker
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=60)
+        except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+
+def run_worker(index, command, scheduler, journal, report, args):
+    worker = None
+    while True:
+        job = scheduler.get()
+        if job is None:
+            break
+        domain, rank, attempts = job
+        attempts += 1
+
+        if worker is None or not worker.is_alive():
+            worker = Worker(index, command, args.log_dir)
+
+        start_time = time.time()
+        status = worker.visit(domain, args.site_timeout)
+        duration = time.time() - start_time
+        if status in ("timeout", "crash"):
+            worker.kill()
+            worker = None
+
+        failed = status != "ok"
+        retry = failed and scheduler.can_retry(attempts)
+        journal.record(domain, "done" if not failed else ("pending" if retry else "failed"),
+                       attempts, status if failed else None, duration)
+        scheduler.done(domain, rank, attempts, retry)
+        report.add(status, retry)
+        if failed:
+            log("Worker {}: {} failed with status {} (attempt {})".format(index, domain, status, attempts))
+
+    if worker is not None:
+        worker.close()
+
+
+def log(str):
+    print(datetime.now().strftime("[%Y-%m-%d %H:%M:%S]"), str, flush=True)
+
+
+if __name__ == '__main__':
+    args, worker_args = parser.parse_known_args()
+    main(args, worker_args)
@@ -0,0 +1,111 @@
+import gzip
+import json
+import os
+
+OUTPUT_EXTENSIONS = { "json": ".json", "jsonl": ".jsonl" }
+COMPRESSION_EXTENSIONS = { "none": "", "gzip": ".gz", "zstd": ".zst" }
+# Outputs are written under a temporary name, and renamed only once complete
+PARTIAL_EXTENSION = ".part"
+
+# Keys of the phase data holding one entry per network event, written one per line in JSON Lines format
+EVENT_KINDS = [ "requests", "responses", "responses-extra", "urls", "topics_api_usages", "scripts" ]
+
+
+def get_output_extension(output_format, compress):
+    return OUTPUT_EXTENSIONS[output_format] + COMPRESSION_EXTENSIONS[compress]
+
+
+def get_output_writer(path, output_format, compress, pretty_print):
+    if output_format == "jsonl":
+        return JSONLinesOutputWriter(path, compress)
+    return JSONOutputWriter(path, compress, pretty_print)
+
+
+def remove_output(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def open_output(path, compress):
+    if compress == "gzip":
+        return gzip.open(path, "wt")
+    if compress == "zstd":
+        import zstandard
+        return zstandard.open(path, "wt")
+    return open(path, "w")
+
+
+class JSONOutputWriter:
+    # The whole output in a single JSON document, written every time it is saved
+
+    def __init__(self, path, compress, pretty_print):
+        self.path = path
+        self.partial_path = path + PARTIAL_EXTENSION
+        self.compress = compress
+        self.pretty_print = pretty_print
+        self.data = {"first": None, "click": None, "second": None, "banner_data": None,
+                     "log": None, "stats": None, "internal": None}
+
+    def write_phase(self, phase, phase_data):
+        self.data[phase] = phase_data
+
+    def save(self, banner_data, log_entries, stats, final):
+        self.data["banner_data"] = banner_data
+        self.data["log"] = log_entries
+        self.data["stats"] = stats
+        with open_output(self.partial_path, self.compress) as file:
+            json.dump(self.data, file, indent=4 if self.pretty_print else None)
+        # A checkpoint is put in place as well, so that it is kept if the rest of the visit fails
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        # Remove what a failed visit was writing, keeping the last checkpoint if any
+        remove_output(self.partial_path)
+
+
+class JSONLinesOutputWriter:
+    # One JSON object per line, tagged with its phase. Each phase is written as soon as it is over, with one
+    # line per network event, so that neither the crawler nor the readers need to hold the whole output
+
+    def __init__(self, path, compress):
+        self.path = path
+        self.partial_path = path + PARTIAL_EXTENSION
+        self.file = open_output(self.partial_path, compress)
+        self.checkpoint = False
+
+    def write_phase(self, phase, phase_data):
+        for kind, value in phase_data.items():
+            if kind in EVENT_KINDS:
+                self.write_record({"phase": phase, "kind": kind, "value": []})
+                for event in value:
+                    self.write_record({"phase": phase, "kind": kind, "event": event})
+            else:
+                self.write_record({"phase": phase, "kind": kind, "value": value})
+        self.file.flush()
+
+    def save(self, banner_data, log_entries, stats, final):
+        # A checkpoint writes the records of the whole visit, written again at the end: readers keep the last ones
+        self.write_record({"phase": None, "kind": "banner_data", "value": banner_data})
+        self.write_record({"phase": None, "kind": "log", "value": log_entries})
+        self.write_record({"phase": None, "kind": "stats", "value": stats})
+        if not final:
+            self.file.flush()
+            self.checkpoint = True
+            return
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        # Remove the output of a failed visit, unless it holds a checkpoint: then it is kept up to the failure, and
+        # its last line may be cut short
+        self.file.close()
+        if self.checkpoint:
+            os.replace(self.partial_path, self.path)
+        else:
+            remove_output(self.partial_path)
+
+    def write_record(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write("\n")
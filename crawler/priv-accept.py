@@ -4,7 +4,7 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchFrameException, TimeoutException
+from selenium.common.exceptions import NoSuchFrameException
 import argparse
 from urllib.parse import urlparse
 from datetime import datetime
@@ -15,8 +15,14 @@ import os
 import sys
 import json
 import time
+import re
+import base64
 import sqlite3
-import shutil
+from output_writer import get_output_writer, get_output_extension
+from topics_db import TopicsDatabase
+from topics_capture import TopicsCapture
+from script_store import ScriptStore
+from tracing import Tracer, Profiler
 
 # Parse Vars
 parser = argparse.ArgumentParser()
@@ -24,6 +30,7 @@ parser.add_argument('--url', type=str, default='https://www.theguardian.com/')
 parser.add_argument('--outfile', type=str, default='output.json')
 parser.add_argument('--pretty_print', action='store_true')
 parser.add_argument('--accept_words', type=str, default="accept_words.txt")
+parser.add_argument('--consent_managers_file', type=str, default=None)
 parser.add_argument('--chrome_binary', type=str, default=None)
 parser.add_argument('--chrome_driver', type=str, default="./chromedriver")
 parser.add_argument('--screenshot_dir', type=str, default=None)
@@ -44,26 +51,75 @@ parser.add_argument('--force_second_visit', action='store_true')
 parser.add_argument('--force_click_data', action='store_true')
 parser.add_argument('--visit_internals', action='store_true')
 parser.add_argument('--num_internal', type=int, default=5)
+parser.add_argument('--internal_concurrency', type=int, default=4)
 parser.add_argument('--detect_topics', action='store_true')
+parser.add_argument('--topics_source', choices=['db', 'cdp'], default='db')
 parser.add_argument('--xvfb', action='store_true')
+parser.add_argument('--url_file', type=str, default=None)
+parser.add_argument('--outdir', type=str, default='.')
+parser.add_argument('--settle', action='store_true')
+parser.add_argument('--quiet_window', type=float, default=1.0)
+parser.add_argument('--output_format', choices=['json', 'jsonl'], default='json')
+parser.add_argument('--compress', choices=['none', 'gzip', 'zstd'], default='none')
+parser.add_argument('--script_store', type=str, default=None)
+parser.add_argument('--trace', action='store_true')
+parser.add_argument('--profile', choices=['cprofile', 'sampling'], default=None)
 
 globals().update(vars(parser.parse_args()))
 
 log_entries = []
 GLOBAL_SELECTOR = "a, button, div, span, form, p"
 RUM_SPEED_INDEX_FILE="rum-speedindex.js"
+BANNER_FINDER_FILE="banner-finder.js"
+MAX_BANNER_CANDIDATES=5
+BANNER_WORLD_NAME="priv-accept"
+WORKER_RESULT_PREFIX="WORKER-RESULT"
+LOG_POLL_INTERVAL=0.25
+SETTLE_MAX_INFLIGHT=2
 USER_AGENT_DEFAULT="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36"
 stats = {}
+visited_origins = set()
+inflight_requests = set()
+collector = None
+collected_events = 0
+METHOD_REGEX = re.compile(r'"method":\s*"([^"]+)"')
+REQUEST_ID_REGEX = re.compile(r'"requestId":\s*"([^"]+)"')
+# Links of the page, resolved, as returned by get_attribute("href")
+INTERNAL_LINKS_SCRIPT = 'return Array.from(document.querySelectorAll("[href]"), e => typeof e.href === "string" ? e.href : e.getAttribute("href"));'
+COLLECTED_EVENTS = { "Network.requestWillBeSent": "requests",
+                     "Network.responseReceived": "responses",
+                     "Network.responseReceivedExtraInfo": "responses-extra" }
+topics_cursor = 0
+user_data_dir = None
+topics_reader = None
+tracer = Tracer(trace)
+profiler = Profiler(profile) if profile is not None else None
+scripts = tracer.trace_methods(ScriptStore(script_store), ["add"], "scripts") if script_store is not None else None
+pending_scripts = {}
+page_collectors = {}
+accept_words_list = None
+banner_finder = None
+consent_manager_domains = None
 
 
 def main():
+    tracer.start_phase("driver-start")
+    start_driver()
+
+    if url_file is None:
+        visit_site(url, outfile)
+    else:
+        run_worker()
+
+    stop_driver()
+    log("All Done")
+
+
+def start_driver():
     global driver
-    global url
+    global display
     global USER_AGENT_DEFAULT
-
-    # Fix Url
-    if not url.startswith("http://") and not url.startswith("https://"):
-        url = "http://" + url
+    global topics_reader
 
     # Enable browser logging and start driver
     log("Starting Driver")
@@ -71,8 +127,6 @@ def main():
     # d['loggingPrefs'] = { 'performance':'ALL' }
     d['goog:loggingPrefs'] = {'performance': 'ALL'}
     options = Options()
-    stats["lang"] = "default"
-    stats["headless"] = False
 
     if chrome_binary:
         options.binary_location = chrome_binary
@@ -85,14 +139,12 @@ def main():
         options.add_argument("enable-privacy-sandbox-ads-apis")
         
     if lang is not None:
-        stats["lang"] = lang
         options.add_experimental_option('prefs', {'intl.accept_languages': lang})
         
     if headless:
         options.headless = True
         options.add_argument("window-size=1920,1080")
         options.add_argument("user-agent={}".format(USER_AGENT_DEFAULT))
-        stats["headless"] = True
         
     if not headless and user_agent is not None:
         options.add_argument("user-agent={}".format(USER_AGENT_DEFAULT))
@@ -109,18 +161,23 @@ def main():
         display = Display(visible=0, size=(1920, 1080))
         display.start()
 
+    reset_collector()
     service = Service(executable_path=chrome_driver, desired_capabilities=d)
-    driver = webdriver.Chrome(service=service, options=options)
+    driver = tracer.trace_driver(webdriver.Chrome(service=service, options=options))
     driver.set_page_load_timeout(connection_timeout)
-    time.sleep(timeout)
+    wait_settle("driver-start")
 
-    if detect_topics:
+    if detect_topics and topics_source == "cdp":
+        # Record the Topics API calls as they happen, before any site is visited
+        topics_reader = tracer.trace_methods(TopicsCapture(driver.capabilities["goog:chromeOptions"]["debuggerAddress"]), ["get_usages"], "topics")
+    elif detect_topics:
         global user_data_dir
         driver.get("chrome://version")
         user_data_dir = "/".join(driver.find_element(By.ID, "profile_path").text.split("/")[:-1])
         log("Changed user dir to {}".format(user_data_dir)) 
         options.add_argument("user-data-dir={}".format(user_data_dir))
-        get_data(driver)
+        topics_reader = tracer.trace_methods(TopicsDatabase("{}/Default/BrowsingTopicsSiteData".format(user_data_dir)), ["get_usages"], "topics")
+        get_data(driver, "driver-start")
 
     # Set network conditions
     if network_conditions:
@@ -130,16 +187,158 @@ def main():
                                                                     "uploadThroughput": upload,
                                                                     "offline": False})
 
+
+def stop_driver():
+    global topics_reader
+
+    # Quit, closing the Topics reader even if the driver is dead
+    try:
+        if xvfb:
+            display.stop()
+
+        driver.quit()
+    finally:
+        if topics_reader is not None:
+            topics_reader.close()
+            topics_reader = None
+
+
+def run_worker():
+    global screenshot_dir
+
+    screenshot_root = screenshot_dir
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    url_source = sys.stdin if url_file == "-" else open(url_file, "r")
+    first_site = True
+    for line in url_source:
+        site = line.strip()
+        if site == "" or site.startswith("#"):
+            continue
+
+        # Every site gets its own log and statistics, as in single-site mode
+        log_entries.clear()
+        stats.clear()
+        if screenshot_root is not None:
+            screenshot_dir = "{}/{}".format(screenshot_root, get_site_name(site))
+
+        status = "ok"
+        start_time = time.time()
+        site_outfile = "{}/output_{}{}".format(outdir, get_site_name(site), get_output_extension(output_format, compress))
+        try:
+            if not first_site:
+                tracer.start_phase("reset-browser")
+                reset_browser()
+            first_site = False
+            visit_site(site, site_outfile)
+            log("Site {} done in {:.1f} s".format(site, time.time() - start_time))
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            log("Exception at line {} while visiting {}: {}".format(exc_tb.tb_lineno, site, e))
+            traceback.print_exception(exc_type, exc_obj, exc_tb)
+            status = "error:{}".format(exc_type.__name__)
+            finish_trace(site_outfile)
+            restart_driver_if_dead()
+
+        # Machine-readable result, consumed by crawl-pool.py
+        print(WORKER_RESULT_PREFIX, json.dumps({"site": site, "status": status, "duration": time.time() - start_time}), flush=True)
+
+    if url_source is not sys.stdin:
+        url_source.close()
+
+
+def get_site_name(site):
+    # Name used for output files: the domain of the site, without scheme or path
+    if "://" in site:
+        site = urlparse(site).netloc
+    return site.strip("/").replace("/", "_")
+
+
+def reset_browser():
+    global topics_cursor
+
+    log("Resetting browser state")
+
+    # Close windows and tabs opened by the previous site
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.get("about:blank")
+
+    # Cookies, cache, sockets and DNS
+    driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    clear_status()
+
+    # Local storage, IndexedDB, service workers, etc. of every origin contacted by the previous site
+    for origin in visited_origins:
+        try:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {"origin": origin, "storageTypes": "all"})
+        except Exception as e:
+            log("Exception in clearing storage of {}: {}".format(origin, e))
+    visited_origins.clear()
+    pending_scripts.clear()
+    # Collectors of the internal pages of a visit that failed before closing them
+    page_collectors.clear()
+
+    # The BrowsingTopicsSiteData DB cannot be cleared through CDP: move the cursor past the usages of
+    # the previous site so that they are not reported again, from the high-water mark of the reader
+    if detect_topics:
+        try:
+            topics_cursor = max(topics_cursor, topics_reader.get_last_usage_time())
+        except (FileNotFoundError, sqlite3.DatabaseError):
+            pass
+
+    # Discard the network events of the reset itself
+    read_log(driver)
+    reset_collector()
+
+
+def restart_driver_if_dead():
+    try:
+        driver.current_url
+    except Exception:
+        log("Driver not responding, restarting it")
+        try:
+            stop_driver()
+        except Exception as e:
+            log("Exception in stopping driver: {}".format(e))
+        tracer.start_phase("driver-start")
+        start_driver()
+
+
+def visit_site(url, outfile):
+    # Fix Url
+    if not url.startswith("http://") and not url.startswith("https://"):
+        url = "http://" + url
+
+    stats["lang"] = lang if lang is not None else "default"
+    stats["headless"] = headless
+    output = tracer.trace_methods(get_output_writer(outfile, output_format, compress, pretty_print), ["write_phase", "save"], "output")
+    start_trace(url, outfile)
+    try:
+        visit_pages(url, outfile, output)
+    except BaseException:
+        # A failed visit leaves no output, or only the data saved before visiting the internal pages
+        output.abort()
+        raise
+
+
+def visit_pages(url, outfile, output):
     #  Go to the page, first visit
     stats["pre-visit"] = False
     if pre_visit:
+        tracer.start_phase("pre-visit")
         stats["pre-visit"] = True
         log("Making Pre-First Visit")
         driver.get(url)
-        time.sleep(timeout)
+        wait_settle("pre-visit", after=topics_cursor)
         log("Getting data of pre-visit")
-        get_data(driver)
+        get_data(driver, "pre-visit", after=topics_cursor)
         
+    tracer.start_phase("first-visit")
     log("Making First Visit to: {}".format(url))
     stats["target"] = url
     stats["start-time"] = time.time()
@@ -157,54 +356,45 @@ def main():
     stats["first-visit-selenium-time"] = end_time-start_time
     log("Landed to: {}".format(driver.current_url))
     stats["first-visit-landing-page"] = driver.current_url
-    time.sleep(timeout)
+    wait_settle("first", after=topics_cursor)
     stats["first-visit-timings"] = driver.execute_script("var performance = window.performance || {}; var timings = performance.timing || {}; return timings;")
     log("Getting data of first visit")
-    before_data, last_usage_time = get_data(driver)
+    data, usages_cursor = get_data(driver, "first", after=topics_cursor)
+    output.write_phase("first", data)
     make_screenshot("{}/all-first.png".format(screenshot_dir))
 
     # Click Banner
+    tracer.start_phase("banner-search")
     log("Searching Banner")
     banner_data = click_banner(driver)
 
     if not "clicked_element" in banner_data:
-        iframe_contents = driver.find_elements(By.CSS_SELECTOR, "iframe")
-        for content in iframe_contents:
-            log("Switching to frame: {}".format(content.id) )
-            try:
-                driver.switch_to.frame(content)
-                log("Searching Banner")
-                banner_data = click_banner(driver)
-                driver.switch_to.default_content()
-                if "clicked_element" in banner_data:
-                    break
-            except NoSuchFrameException:
-                driver.switch_to.default_content()
-                log("Error in switching to frame")
-                
+        banner_data = click_banner_in_frames(driver)
+
     stats["has-scrolled"] = False
     banner_found = "clicked_element" in banner_data
     if not banner_found and try_scroll:
         log("Trying with scroll")
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight)")
         log("Searching Banner")
-        banner_data = click_banner(driver)
+        banner_data = click_banner(driver, "scrolled")
         stats["has-scrolled"] = True
         banner_found = "clicked_element" in banner_data
     stats["has-found-banner"] = banner_found
     
-    click_data = None
     if banner_found or force_click_data:
-        time.sleep(timeout)
+        tracer.start_phase("click")
+        wait_settle("click", after=usages_cursor)
         log("Getting data of post-click")
-        click_data, last_usage_time = get_data(driver, after=last_usage_time)
+        data, usages_cursor = get_data(driver, "click", after=usages_cursor)
+        output.write_phase("click", data)
         make_screenshot("{}/all-click.png".format(screenshot_dir))
         log("URL after click: {}".format(driver.current_url))
         stats["after-click-landing-page"] = driver.current_url
 
-    after_data = None
     if banner_found or force_second_visit:
         #  Go to the page, second visit
+        tracer.start_phase("second-visit")
         log("Making the Second Visit")
         stats["has-cleared-cache"] = False
         if clear_cache:
@@ -212,7 +402,7 @@ def main():
             stats["has-cleared-cache"] = True
         # Clean last page
         driver.get("about:blank")
-        get_data(driver)
+        get_data(driver, "blank", after=usages_cursor)
 
         start_time=time.time()
         driver.get(url)
@@ -223,60 +413,130 @@ def main():
             
         log("Second Visit Selenium time [s]: {}".format(end_time-start_time))
         stats["second-visit-selenium-time"] = end_time-start_time
-        time.sleep(timeout)
+        wait_settle("second", after=usages_cursor)
         stats["second-visit-timings"] = driver.execute_script("var performance = window.performance || {}; var timings = performance.timing || {}; return timings;")
         log("Getting data of second visit")
-        after_data, last_usage_time = get_data(driver, after=last_usage_time)
+        data, usages_cursor = get_data(driver, "second", after=usages_cursor)
+        output.write_phase("second", data)
         make_screenshot("{}/all-second.png".format(screenshot_dir))
     else:
         log("Banner not found, skipping second visit")
 
-    # Save data
-    data = {"first": before_data, "click": click_data, "second": after_data, "banner_data": banner_data,
-            "log": log_entries, "stats": stats, "internal": None}
-    with open(outfile, "w") as file:
-        json.dump(data, file, indent=4 if pretty_print else None)
+    data = None
 
-    internal_data = None
     if visit_internals:
+        # Save data before visiting internal pages
+        tracer.start_phase("internal")
+        output.save(banner_data, log_entries, stats, final=False)
+
         log("Visiting Internal Pages")
         internal_urls = set()
-        eles = driver.find_elements(By.XPATH, "//*[@href]")
-        for elem in eles:
-            url = elem.get_attribute('href').split("#")[0]
-            #if url.startswith(driver.current_url) and url!=driver.current_url:
+        landing_url = driver.current_url
+        landing_domain = landing_url.split("/")[2] if len (landing_url.split("/")) >=3 else None
+        for href in driver.execute_script(INTERNAL_LINKS_SCRIPT):
+            if href is None:
+                continue
+            url = href.split("#")[0]
             domain_url = url.split("/")[2] if len (url.split("/")) >=3 else None
-            landing_domain = driver.current_url.split("/")[2] if len (driver.current_url.split("/")) >=3 else None
-            if domain_url == landing_domain and url!=driver.current_url:
+            if domain_url == landing_domain and url!=landing_url:
                 internal_urls.add(url)
         if len(internal_urls) >= num_internal:
             internal_urls_to_visit = random.sample(sorted(internal_urls), num_internal)
         else:
             log("Warning, only {} internal URLs to visit".format(len(internal_urls)) )
-            internal_urls_to_visit = internal_urls
-            
-        for internal_url in internal_urls_to_visit:
-            log("Visiting internal URL: {}".format(internal_url ))
-            try:
-                driver.get(internal_url)
-                time.sleep(timeout)
-            except TimeoutException:
-                log("Warning, could not load URL {} before timeout.".format(internal_url))
+            internal_urls_to_visit = sorted(internal_urls)
+
+        # Drain the events of the previous phases, then store the events of each internal page in its own phase
+        read_log(driver)
+        reset_collector()
+        pages = visit_internal_pages(internal_urls_to_visit, usages_cursor)
         log("Getting data of internal page visits")
-        internal_data, _ = get_data(driver, after=last_usage_time)
+        data, _ = get_data(driver, "internal", after=usages_cursor)
+        for i, page in enumerate(pages):
+            page_data = page["data"]
+            if "target_id" in page and "topics_api_usages" in data and topics_source == "cdp":
+                # Calls captured through CDP are attributed to the tab they were made in
+                page_data["topics_api_usages"] = [ usage for usage in data["topics_api_usages"] if usage["target_id"] == page["target_id"] ]
+                data["topics_api_usages"] = [ usage for usage in data["topics_api_usages"] if usage["target_id"] != page["target_id"] ]
+            stats["network-events"]["internal-{}".format(i)] = sum(len(page_data[kind]) for kind in COLLECTED_EVENTS.values() if kind in page_data)
+            output.write_phase("internal-{}".format(i), page_data)
+        output.write_phase("internal", data)
 
     # Save
-    data = {"first": before_data, "click": click_data, "second": after_data, "banner_data": banner_data,
-            "log": log_entries, "stats": stats, "internal":internal_data}
-    with open(outfile, "w") as file:
-        json.dump(data, file, indent=4 if pretty_print else None)
-
-    # Quit
-    if xvfb:
-        display.stop()
-
-    driver.quit()
-    log("All Done")
+    tracer.start_phase("save")
+    output.save(banner_data, log_entries, stats, final=True)
+    finish_trace(outfile)
+
+
+def start_trace(url, outfile):
+    # The trace (and profile) of a visit are written next to its output, e.g. output.trace.json for output.json
+    if trace:
+        tracer.path = get_output_base(outfile) + ".trace.json"
+        tracer.metadata = {"url": url, "output": os.path.basename(outfile)}
+    if profiler is not None:
+        profiler.start()
+
+
+def finish_trace(outfile):
+    # Save the trace of a visit, then start afresh for the next one. Spans recorded from now on, e.g., the reset of
+    # the browser in worker mode, go to the trace of the next visit
+    tracer.end_phase()
+    tracer.path = None
+    tracer.reset()
+    if profiler is not None:
+        path = profiler.stop(get_output_base(outfile))
+        if path is not None:
+            log("Profile saved in {}".format(path))
+
+
+def get_output_base(outfile):
+    extension = get_output_extension(output_format, compress)
+    return outfile[:-len(extension)] if outfile.endswith(extension) else outfile
+
+
+def visit_internal_pages(urls, after):
+    # Visit the internal pages concurrently, up to --internal_concurrency tabs at a time, waiting for each batch to
+    # settle. The network events of each tab are collected separately, through the id of its target
+    main_handle = driver.current_window_handle
+    pages = []
+    for start in range(0, len(urls), internal_concurrency):
+        batch = []
+        for url in urls[start:start + internal_concurrency]:
+            log("Visiting internal URL: {}".format(url))
+            page = {"url": url, "data": new_collector()}
+            try:
+                driver.switch_to.new_window('tab')
+                page["handle"] = driver.current_window_handle
+                page["target_id"] = driver.execute_cdp_cmd('Target.getTargetInfo', {})["targetInfo"]["targetId"]
+                page_collectors[page["target_id"]] = page["data"]
+                # Unlike driver.get, it does not wait for the page to load
+                result = driver.execute_cdp_cmd('Page.navigate', {"url": url})
+                if "errorText" in result:
+                    log("Warning, could not load URL {}: {}".format(url, result["errorText"]))
+            except Exception as e:
+                log("Exception in opening URL {}: {}".format(url, e))
+            batch.append(page)
+        driver.switch_to.window(main_handle)
+        wait_settle("internal-{}".format(start // internal_concurrency), after)
+        read_log(driver)
+
+        for page in batch:
+            page["data"]["url"] = page["url"]
+            if "target_id" in page:
+                try:
+                    page["data"]["landing_url"] = driver.execute_cdp_cmd('Target.getTargetInfo', {"targetId": page["target_id"]})["targetInfo"]["url"]
+                except Exception as e:
+                    log("Exception in getting landing URL of {}: {}".format(page["url"], e))
+                del page_collectors[page["target_id"]]
+            if "handle" in page:
+                try:
+                    driver.switch_to.window(page["handle"])
+                    driver.close()
+                except Exception as e:
+                    log("Exception in closing tab of {}: {}".format(page["url"], e))
+        driver.switch_to.window(main_handle)
+        pages += batch
+    return pages
 
 
 def clear_status():
@@ -290,40 +550,140 @@ def clear_status():
         log("Warning: cannot clean DNS and socket cache in headless mode.")
 
 
-def get_data(driver, after = 0):
+def get_data(driver, phase, after = 0):
 
     #data = {"urls": [],"cookies": driver.get_cookies()}  # Worse than next line
-    if full_net_log:
-        data = { "requests": [], "responses": [], "responses-extra": [],
-                "cookies": driver.execute_cdp_cmd('Network.getAllCookies', {})}
-    else:
-        data = { "urls": [],
-                "cookies": driver.execute_cdp_cmd('Network.getAllCookies', {})}
-
-    log = driver.get_log('performance')
+    cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})
 
-    for entry in log:
-        message = json.loads(entry["message"])
-        if full_net_log:
-            if message["message"]["method"] == "Network.responseReceived":
-                data["responses"].append(message["message"]["params"])
-            elif message["message"]["method"] == "Network.responseReceivedExtraInfo":
-                data["responses-extra"].append(message["message"]["params"])
-            elif message["message"]["method"] == "Network.requestWillBeSent":
-                data["requests"].append(message["message"]["params"])
-        else:
-            if message["message"]["method"] == "Network.responseReceived":
-                url = message["message"]["params"]["response"]["url"]
-                data["urls"].append(url)
+    read_log(driver)
+    data = collector
+    data["cookies"] = cookies
+    stats.setdefault("network-events", {})[phase] = collected_events
+    reset_collector()
 
-    last_usage_time = None
+    # Cursor of the next phase: the time of the last usage read, which never goes backwards, even if no usage is new
+    cursor = after
     if detect_topics:
         try:
             data["topics_api_usages"], last_usage_time = get_topics_api_usages(after)
+            cursor = max(cursor, last_usage_time)
         except FileNotFoundError:
             data["topics_api_usages"] = []
+        except sqlite3.DatabaseError as e:
+            # E.g. a page of the DB being written by Chrome: no new usage, they are read by the next phase
+            log("Exception in reading Topics API usages: {}".format(e))
+            data["topics_api_usages"] = []
         
-    return data, last_usage_time
+    return data, cursor
+
+
+def new_collector():
+    if full_net_log:
+        new = { "requests": [], "responses": [], "responses-extra": [] }
+    else:
+        new = { "urls": [] }
+    if scripts is not None:
+        new["scripts"] = []
+    return new
+
+
+def reset_collector():
+    global collector
+    global collected_events
+
+    collector = new_collector()
+    collected_events = 0
+    inflight_requests.clear()
+
+
+def read_log(driver):
+    # Drain the performance log, parsing and storing only the events that end up in the output.
+    # Returns the number of network events read
+    global collected_events
+
+    network_events = 0
+    for entry in driver.get_log('performance'):
+        raw = entry["message"]
+        match = METHOD_REGEX.search(raw, 0, 128)
+        method = match.group(1) if match is not None else json.loads(raw)["message"]["method"]
+        if not method.startswith("Network."):
+            continue
+        network_events += 1
+
+        if method in ("Network.loadingFinished", "Network.loadingFailed"):
+            match = REQUEST_ID_REGEX.search(raw)
+            if match is not None:
+                inflight_requests.discard(match.group(1))
+                script = pending_scripts.pop(match.group(1), None)
+                if script is not None and method == "Network.loadingFinished":
+                    store_script(match.group(1), *script)
+            continue
+        if method not in COLLECTED_EVENTS:
+            continue
+
+        message = json.loads(raw)
+        params = message["message"]["params"]
+        # Events of the tabs of the internal pages go to their own collector
+        target = page_collectors.get(message.get("webview"), collector)
+        if method == "Network.requestWillBeSent":
+            inflight_requests.add(params["requestId"])
+            visited_origins.add(get_origin(params["request"]["url"]))
+        if scripts is not None and method == "Network.responseReceived" and params["type"] == "Script":
+            pending_scripts[params["requestId"]] = (params["response"]["url"], target)
+        if full_net_log:
+            target[COLLECTED_EVENTS[method]].append(params)
+        elif method == "Network.responseReceived":
+            target["urls"].append(params["response"]["url"])
+        if target is collector and (full_net_log or method == "Network.responseReceived"):
+            collected_events += 1
+
+    return network_events
+
+
+def store_script(request_id, url, target):
+    # Save the body of a script in the store, recording its hash in the collector of its page
+    try:
+        response = driver.execute_cdp_cmd('Network.getResponseBody', {"requestId": request_id})
+    except Exception:
+        # E.g. scripts loaded by out-of-process iframes, or bodies already evicted by Chrome
+        stats["missing-script-bodies"] = stats.get("missing-script-bodies", 0) + 1
+        return
+    body = base64.b64decode(response["body"]) if response["base64Encoded"] else response["body"].encode()
+    target["scripts"].append({"url": url, "sha256": scripts.add(body), "size": len(body)})
+
+
+def wait_settle(phase, after = 0):
+    # Wait for extra traffic after the onLoad event. With --settle, stop waiting as soon as the network is idle
+    # and no new Topics API usage is recorded for --quiet_window seconds, with --timeout as upper bound. The
+    # usages are read after the cursor of the phase, as get_data will, so that the reader stays incremental
+    start_time = time.time()
+    if not settle:
+        # Keep draining the log while waiting, so that events do not pile up in chromedriver
+        while time.time() - start_time < timeout:
+            with tracer.span("sleep", "wait"):
+                time.sleep(min(LOG_POLL_INTERVAL, max(timeout - (time.time() - start_time), 0)))
+            read_log(driver)
+    else:
+        last_activity = start_time
+        last_usages = count_topics_api_usages(after, 0)
+        while time.time() - start_time < timeout:
+            with tracer.span("sleep", "wait"):
+                time.sleep(LOG_POLL_INTERVAL)
+            if read_log(driver) > 0 or len(inflight_requests) > SETTLE_MAX_INFLIGHT:
+                last_activity = time.time()
+                continue
+            if time.time() - last_activity < quiet_window:
+                continue
+            usages = count_topics_api_usages(after, last_usages)
+            if usages != last_usages:
+                last_usages = usages
+                last_activity = time.time()
+                continue
+            break
+
+    waited = time.time() - start_time
+    stats.setdefault("settle-times", {})[phase] = waited
+    log("Waited {:.2f} s for {} to settle".format(waited, phase))
 
 
 def make_screenshot(path):
@@ -336,105 +696,229 @@ def make_screenshot(path):
             log("Exception in making screenshot: {}".format(e))
 
 
-def get_signature(element):
+def get_accept_words():
+    # Read and normalise the accept words only once, as the text of the elements in banner-finder.js
+    global accept_words_list
 
-    def props_to_dict(e):
-        props = {"tag": e.tag_name }
-        for attr in e.get_property('attributes'):
-            props[attr['name']] = attr['value']
-        return props
-        
-    signature = []
-    current = element
-    while True:
-        signature.insert(0, props_to_dict(current))
-        
-        if current.tag_name == "html":
-            break
-        current = current.find_element(By.XPATH, '..')
-        if current == None:
-            break
-        
-    return signature   
-    
+    if accept_words_list is None:
+        words = set()
+        for w in open(accept_words, "r").read().splitlines():
+            if not w.startswith("#") and not w == "":
+                words.add(" ".join(w.split()).lower().strip(" ✓›!"))
+        accept_words_list = sorted(words)
+    return accept_words_list
 
-def click_banner(driver):
 
-    accept_words_list = set()
-    for w in open(accept_words, "r").read().splitlines():
-        if not w.startswith("#") and not w == "":
-            accept_words_list.add(w)
+def get_banner_finder():
+    global banner_finder
 
-    banner_data = {"matched_containers": [], "candidate_elements": []}
-    contents = driver.find_elements(By.CSS_SELECTOR, GLOBAL_SELECTOR)
+    if banner_finder is None:
+        banner_finder = open(BANNER_FINDER_FILE, "r").read()
+    return banner_finder
 
-    candidate = None
 
+def find_banner_candidates(driver, frame):
+    # Ranked candidates of the current frame, found by a single script evaluation
+    start_time = time.time()
+    try:
+        with tracer.span("banner-finder", "banner", frame=frame):
+            candidates = driver.execute_script(get_banner_finder() + "; return findBannerCandidates(arguments[0], arguments[1], arguments[2]);",
+                                               get_accept_words(), GLOBAL_SELECTOR, MAX_BANNER_CANDIDATES)
+    except Exception as e:
+        log("Exception in searching banner: {}".format(e))
+        candidates = []
+    stats.setdefault("banner-search-times", []).append({"frame": frame, "time": time.time() - start_time,
+                                                        "candidates": len(candidates)})
+    return candidates
+
+
+def get_candidate_data(candidate, candidate_id):
+    return {"id": candidate_id,
+            "tag_name": candidate["tag_name"],
+            "text": candidate["text"],
+            "size": candidate["size"],
+            "in_banner": candidate["in_banner"],
+            "signature": candidate["signature"],
+            }
 
-    for c in contents:
-        try:
-            if c.text.lower().strip(" ✓›!\n") in accept_words_list:
-                candidate = c
-                banner_data["candidate_elements"].append({"id": c.id,
-                                                          "tag_name": c.tag_name,
-                                                          "text": c.text,
-                                                          "size": c.size,
-                                                          "signature": get_signature(c),
-                                                          })
-                break
-        except:
-            log("Exception in processing element: {}".format (c.id) )
-            
-    # Click the candidate
-    if candidate is not None:
-        try: # in some pages element is not clickable
 
+def click_banner(driver, frame="main"):
 
+    banner_data = {"matched_containers": [], "candidate_elements": []}
+    candidates = find_banner_candidates(driver, frame)
+    for candidate in candidates:
+        banner_data["candidate_elements"].append(get_candidate_data(candidate, candidate["element"].id))
+
+    # Click the best candidate, or the next ones if not clickable
+    for candidate in candidates:
+        element = candidate["element"]
+        try: # in some pages element is not clickable
             if screenshot_dir is not None:
                 if not os.path.exists(screenshot_dir):
                     os.makedirs(screenshot_dir)
                 try:
-                    candidate.screenshot("{}/clicked_element.png".format(screenshot_dir))
+                    element.screenshot("{}/clicked_element.png".format(screenshot_dir))
                 except Exception as e:
                     log("Exception in making screenshot: {}".format(e))
-            log("Clicking text: {}".format (candidate.text.lower().strip(" ✓›!\n")) )
-            candidate.click()
-            banner_data["clicked_element"] = candidate.id
-            log("Clicked: {}".format (candidate.id) )
-            
+            log("Clicking text: {}".format (candidate["text"].lower().strip(" ✓›!\n")) )
+            element.click()
+            banner_data["clicked_element"] = element.id
+            log("Clicked: {}".format (element.id) )
+            break
         except:
             log("Exception in candidate click")
-    else:
+
+    if len(candidates) == 0:
         log("Warning, no matching candidate")
 
     return banner_data
 
+def get_consent_manager_domains():
+    global consent_manager_domains
+
+    if consent_manager_domains is None:
+        consent_manager_domains = []
+        if consent_managers_file is not None:
+            for line in open(consent_managers_file, "r").read().splitlines():
+                if not line.startswith("#") and not line.strip() == "":
+                    consent_manager_domains.append(line.split(",")[0].strip())
+    return consent_manager_domains
+
+
+def is_consent_manager(url):
+    host = urlparse(url).hostname or ""
+    return any(match_domains(host, domain) for domain in get_consent_manager_domains())
+
+
+def get_frames(driver):
+    # All the frames below the top document in the frame tree of the page, nested ones included: consent manager
+    # frames first, then the others from the outermost. Frames in other processes are not in the tree
+    frames = []
+    pending = [ (child, 1) for child in driver.execute_cdp_cmd('Page.getFrameTree', {})["frameTree"].get("childFrames", []) ]
+    while len(pending) > 0:
+        node, depth = pending.pop(0)
+        frames.append({"id": node["frame"]["id"], "url": node["frame"]["url"], "depth": depth,
+                       "consent_manager": is_consent_manager(node["frame"]["url"])})
+        pending += [ (child, depth + 1) for child in node.get("childFrames", []) ]
+    frames.sort(key=lambda frame: not frame["consent_manager"])
+    return frames
+
+
+def find_frame_banner_candidates(driver, frame, label):
+    # Ranked candidates of a frame, searched in an isolated world of the frame, where they are kept to be clicked.
+    # Returns the execution context of the world too, None if the frame cannot be searched
+    start_time = time.time()
+    try:
+        with tracer.span("banner-finder", "banner", frame=label, url=frame["url"]):
+            context_id = driver.execute_cdp_cmd('Page.createIsolatedWorld', {"frameId": frame["id"], "worldName": BANNER_WORLD_NAME})["executionContextId"]
+            expression = "{}; globalThis.bannerCandidates = findBannerCandidates({}, {}, {}); bannerCandidates.map(({{element, ...candidate}}) => candidate);".format(
+                get_banner_finder(), json.dumps(get_accept_words()), json.dumps(GLOBAL_SELECTOR), MAX_BANNER_CANDIDATES)
+            result = driver.execute_cdp_cmd('Runtime.evaluate', {"expression": expression, "contextId": context_id, "returnByValue": True})
+        candidates = result["result"]["value"] if "exceptionDetails" not in result else []
+    except Exception as e:
+        log("Exception in searching banner in frame {}: {}".format(frame["url"], e))
+        context_id, candidates = None, []
+    stats.setdefault("banner-search-times", []).append({"frame": label, "url": frame["url"], "depth": frame["depth"],
+                                                        "consent_manager": frame["consent_manager"],
+                                                        "time": time.time() - start_time, "candidates": len(candidates)})
+    return context_id, candidates
+
+
+def click_frame_candidate(driver, context_id, index):
+    # Trusted click in the center of a candidate found in a frame. Coordinates of the frames in the tree are relative
+    # to the top document
+    element = driver.execute_cdp_cmd('Runtime.evaluate', {"expression": "bannerCandidates[{}].element".format(index), "contextId": context_id})["result"]
+    driver.execute_cdp_cmd('DOM.scrollIntoViewIfNeeded', {"objectId": element["objectId"]})
+    quad = driver.execute_cdp_cmd('DOM.getContentQuads', {"objectId": element["objectId"]})["quads"][0]
+    x, y = sum(quad[0::2]) / 4, sum(quad[1::2]) / 4
+    for event_type in [ "mouseMoved", "mousePressed", "mouseReleased" ]:
+        driver.execute_cdp_cmd('Input.dispatchMouseEvent', {"type": event_type, "x": x, "y": y, "button": "left", "clickCount": 1})
+
+
+def click_banner_in_frames(driver):
+    # Search the banner in the frames of the page, consent manager frames first, stopping at the first confident
+    # candidate, i.e., in a consent manager frame or in a banner-like container. Otherwise, the first candidate found
+    # is clicked. Frames in other processes are searched last, by switching to them
+    banner_data = {"matched_containers": [], "candidate_elements": []}
+    try:
+        frames = get_frames(driver)
+    except Exception as e:
+        log("Exception in getting frame tree: {}".format(e))
+        frames = []
+
+    found = None
+    searched_urls = set()
+    for i, frame in enumerate(frames):
+        log("Searching Banner in frame: {}".format(frame["url"]))
+        context_id, candidates = find_frame_banner_candidates(driver, frame, "frame-{}".format(i))
+        if context_id is None:
+            continue
+        searched_urls.add(frame["url"])
+        if len(candidates) > 0 and (found is None or frame["consent_manager"] or candidates[0]["in_banner"]):
+            found = (frame, context_id, candidates)
+            if frame["consent_manager"] or candidates[0]["in_banner"]:
+                break
+
+    # Frames not in the tree, i.e., in other processes, consent managers first
+    remote_frames = []
+    if found is None or not (found[0]["consent_manager"] or found[2][0]["in_banner"]):
+        remote_frames = [ (element, src) for element, src in
+                          driver.execute_script('return Array.from(document.querySelectorAll("iframe")).map(f => [f, f.src]);')
+                          if src not in searched_urls ]
+        remote_frames.sort(key=lambda remote_frame: not is_consent_manager(remote_frame[1]))
+    for i, (element, src) in enumerate(remote_frames):
+        if found is not None and not is_consent_manager(src):
+            break
+        log("Switching to frame: {}".format(src))
+        try:
+            driver.switch_to.frame(element)
+            log("Searching Banner")
+            banner_data = click_banner(driver, "remote-frame-{}".format(i))
+            driver.switch_to.default_content()
+            if "clicked_element" in banner_data:
+                return banner_data
+        except NoSuchFrameException:
+            driver.switch_to.default_content()
+            log("Error in switching to frame")
+
+    if found is None:
+        return banner_data
+
+    frame, context_id, candidates = found
+    banner_data = {"matched_containers": [], "candidate_elements": [], "frame": frame["url"]}
+    for i, candidate in enumerate(candidates):
+        banner_data["candidate_elements"].append(get_candidate_data(candidate, "{}:{}".format(frame["id"], i)))
+    for i, candidate in enumerate(candidates):
+        try:
+            log("Clicking text: {}".format (candidate["text"].lower().strip(" ✓›!\n")) )
+            click_frame_candidate(driver, context_id, i)
+            banner_data["clicked_element"] = "{}:{}".format(frame["id"], i)
+            log("Clicked: {}".format (banner_data["clicked_element"]) )
+            break
+        except Exception as e:
+            log("Exception in candidate click: {}".format(e))
+    return banner_data
+
+
 def get_topics_api_usages(after = 0):
-    # Copy real DB (locked by current Chrome window) to temporary location
-    real_db_path = "{}/Default/BrowsingTopicsSiteData".format(user_data_dir)
-    tmp_db_path = "BrowsingTopicsSiteData"
-    shutil.copy(real_db_path, tmp_db_path)
-
-    # Fetch browsing topics data from temporary database
-    sql = "SELECT context_origin_url, caller_source, usage_time\
-           FROM browsing_topics_api_usages_complete, browsing_topics_api_hashed_to_unhashed_domain\
-           WHERE browsing_topics_api_usages_complete.hashed_context_domain = browsing_topics_api_hashed_to_unhashed_domain.hashed_context_domain\
-           AND usage_time > ?"
-    conn = sqlite3.connect(tmp_db_path, uri=True)
-    cur = conn.cursor()
-    res = cur.execute(sql, [after])
-    usages = []
-    last_usage_time = 0
-    for context_origin_url, caller_source, usage_time in res.fetchall():
-        if usage_time > last_usage_time:
-            last_usage_time = usage_time
-        usages.append({ "context_origin_url": context_origin_url, "caller_source": caller_source, "usage_time": usage_time })
-    conn.close()
-
-    # Delete temporary database
-    os.remove(tmp_db_path)
-
-    return usages, last_usage_time
+    # Usages recorded after the given time, read from the BrowsingTopicsSiteData DB or captured through CDP
+    return topics_reader.get_usages(after)
+
+def count_topics_api_usages(after, default):
+    # Number of usages recorded after the given time, or default if they cannot be read now
+    if not detect_topics or topics_reader is None:
+        return default
+    try:
+        return len(get_topics_api_usages(after)[0])
+    except FileNotFoundError:
+        return 0
+    except sqlite3.DatabaseError:
+        return default
+
+def get_origin(url):
+    parse_result = urlparse(url)
+    return "{}://{}".format(parse_result.scheme, parse_result.netloc)
+
 
 def match_domains(domain, match):
     labels_domains = domain.strip(".").split(".")
@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+
+BROWSING_TOPICS_REGEX = re.compile(rb"browsingtopics", re.IGNORECASE)
+
+
+class ScriptStore:
+    # Content-addressed store of the script bodies captured during the crawls. The same CMP and advertising scripts
+    # are found on thousands of sites, so each body is stored only once, gzipped, in
+    # <path>/<first two hex digits of its SHA-256>/<SHA-256>.gz. Many crawlers can share the same store
+
+    def __init__(self, path):
+        self.path = path
+        self.matches = {}
+
+    def get_blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest + ".gz")
+
+    def add(self, body):
+        # Store a body, if not already stored, and return its SHA-256
+        digest = hashlib.sha256(body).hexdigest()
+        blob_path = self.get_blob_path(digest)
+        if os.path.exists(blob_path):
+            return digest
+
+        blob_dir = os.path.dirname(blob_path)
+        os.makedirs(blob_dir, exist_ok=True)
+        # Write to a temporary file first, so that other crawlers never read a partial body
+        fd, tmp_path = tempfile.mkstemp(dir=blob_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(gzip.compress(body, compresslevel=6))
+        os.replace(tmp_path, blob_path)
+        return digest
+
+    def read(self, digest):
+        with open(self.get_blob_path(digest), "rb") as file:
+            return gzip.decompress(file.read())
+
+    def has_browsing_topics(self, digest):
+        # Whether a stored body mentions the Topics API, checked once per body. Missing bodies do not
+        if digest not in self.matches:
+            try:
+                self.matches[digest] = BROWSING_TOPICS_REGEX.search(self.read(digest)) is not None
+            except FileNotFoundError:
+                self.matches[digest] = False
+        return self.matches[digest]
+
+    def get_checker(self, scripts):
+        # Tells whether a script URL, among the scripts captured during a visit, calls the Topics API
+        digests = {}
+        for script in scripts:
+            digests.setdefault(script["url"], set()).add(script["sha256"])
+        return lambda url: any(self.has_browsing_topics(digest) for digest in digests.get(url, []))
@@ -0,0 +1,196 @@
+import json
+import re
+import threading
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+BINDING_NAME = "__privAcceptTopicsCall"
+STACK_FRAME_REGEX = re.compile(r"^\s*at (?:(.*?) \()?(.+?):(\d+):(\d+)\)?$")
+# Seconds between 1601-01-01 (Chrome's time epoch) and 1970-01-01
+CHROME_EPOCH_OFFSET = 11644473600
+AUTO_ATTACH_PARAMS = { "autoAttach": True, "waitForDebuggerOnStart": True, "flatten": True,
+                       "filter": [ { "type": "page" }, { "type": "iframe" } ] }
+
+# Wrapper of document.browsingTopics(), reporting each call with the URL of its frame and its stack before
+# running the original function
+WRAPPER_SCRIPT = """(() => {
+    const report = globalThis.%s;
+    const browsingTopics = typeof Document !== "undefined" ? Document.prototype.browsingTopics : undefined;
+    if (typeof report !== "function" || typeof browsingTopics !== "function")
+        return;
+    Document.prototype.browsingTopics = function () {
+        try {
+            report(JSON.stringify({ origin: location.origin, url: location.href, stack: new Error().stack,
+                                    time: performance.timeOrigin + performance.now() }));
+        } catch (e) {}
+        return browsingTopics.apply(this, arguments);
+    };
+})();""" % BINDING_NAME
+
+
+class TopicsCapture:
+    # Records the Topics API calls as they happen through the DevTools protocol of the browser, instead of reading
+    # them from the BrowsingTopicsSiteData DB. JavaScript calls are reported by a wrapper of document.browsingTopics()
+    # injected in every page and iframe, fetch and iframe calls are the requests with a Sec-Browsing-Topics header.
+    # Each call has the same fields of a usage read from the DB, plus its caller URL, stack, frame URL and the id of
+    # the tab it was made in
+
+    def __init__(self, debugger_address):
+        import websocket
+
+        version = json.loads(urlopen("http://{}/json/version".format(debugger_address)).read())
+        self.ws = websocket.create_connection(version["webSocketDebuggerUrl"], suppress_origin=True)
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.calls = []
+        self.low_water = 0
+        self.requests = {}
+        # Top-level page target of each session, to tell the tab each call was made in
+        self.pages = {}
+        self.thread = threading.Thread(target=self.read_events, daemon=True)
+        self.thread.start()
+        self.send("Target.setAutoAttach", AUTO_ATTACH_PARAMS)
+
+    def get_usages(self, after = 0):
+        # Calls recorded after the given time, and the time of the last one (0 if none). Calls before the cursor are
+        # not kept
+        with self.lock:
+            if after > self.low_water:
+                self.calls = [ call for call in self.calls if call["usage_time"] > after ]
+                self.low_water = after
+            usages = [ call for call in self.calls if call["usage_time"] > after ]
+        return usages, max([ usage["usage_time"] for usage in usages ], default=0)
+
+    def get_last_usage_time(self):
+        # Time of the last call recorded (0 if none)
+        with self.lock:
+            return max([ call["usage_time"] for call in self.calls ], default=0)
+
+    def send(self, method, params={}, session_id=None):
+        # Commands are not awaited: the commands of a session are run in order anyway
+        with self.send_lock:
+            self.next_id += 1
+            message = { "id": self.next_id, "method": method, "params": params }
+            if session_id is not None:
+                message["sessionId"] = session_id
+            self.ws.send(json.dumps(message))
+
+    def read_events(self):
+        import websocket
+
+        while True:
+            try:
+                message = json.loads(self.ws.recv())
+            except (websocket.WebSocketException, OSError, ValueError):
+                return
+            method = message.get("method")
+            if method is None:
+                continue
+            try:
+                self.handle_event(method, message["params"], message.get("sessionId"))
+            except Exception:
+                # A malformed event must not stop the capture
+                continue
+
+    def handle_event(self, method, params, session_id):
+        if method == "Target.attachedToTarget":
+            target_info = params["targetInfo"]
+            if target_info["type"] == "page":
+                self.pages[params["sessionId"]] = target_info["targetId"]
+            elif session_id in self.pages:
+                self.pages[params["sessionId"]] = self.pages[session_id]
+            self.attach(params["sessionId"], target_info["type"], params["waitingForDebugger"])
+        elif method == "Target.detachedFromTarget":
+            self.pages.pop(params["sessionId"], None)
+            for key in [ key for key in self.requests if key[0] == params["sessionId"] ]:
+                del self.requests[key]
+        elif method == "Runtime.bindingCalled" and params["name"] == BINDING_NAME:
+            self.add_javascript_call(session_id, json.loads(params["payload"]))
+        elif method == "Network.requestWillBeSent":
+            self.add_request(session_id, params["requestId"], request=params)
+        elif method == "Network.requestWillBeSentExtraInfo":
+            self.add_request(session_id, params["requestId"], headers=params["headers"])
+        elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+            self.requests.pop((session_id, params["requestId"]), None)
+
+    def attach(self, session_id, target_type, waiting):
+        # Instrument a new page or iframe before it runs, and attach to its own out-of-process iframes
+        if target_type not in ("page", "iframe"):
+            if waiting:
+                self.send("Runtime.runIfWaitingForDebugger", {}, session_id)
+            return
+        self.send("Runtime.addBinding", { "name": BINDING_NAME }, session_id)
+        self.send("Page.addScriptToEvaluateOnNewDocument", { "source": WRAPPER_SCRIPT }, session_id)
+        self.send("Network.enable", {}, session_id)
+        self.send("Target.setAutoAttach", AUTO_ATTACH_PARAMS, session_id)
+        if waiting:
+            self.send("Runtime.runIfWaitingForDebugger", {}, session_id)
+
+    def add_javascript_call(self, session_id, payload):
+        # The first frame of the stack is the wrapper itself
+        stack = parse_stack(payload["stack"])[1:]
+        self.add_call(session_id, payload["origin"] + "/", "javascript", get_chrome_time(payload["time"] / 1000), stack,
+                      payload["url"])
+
+    def add_request(self, session_id, request_id, request=None, headers=None):
+        # The request and its headers come in two events, in any order
+        key = (session_id, request_id)
+        pending = self.requests.setdefault(key, {})
+        if request is not None:
+            pending["request"] = request
+        if headers is not None:
+            pending["headers"] = headers
+        if "request" not in pending or "headers" not in pending:
+            return
+        del self.requests[key]
+
+        if not any(name.lower() == "sec-browsing-topics" for name in pending["headers"]):
+            return
+        request = pending["request"]
+        initiator = request.get("initiator", {})
+        stack = [ { "url": frame["url"], "function": frame["functionName"], "line": frame["lineNumber"] + 1,
+                    "column": frame["columnNumber"] + 1 }
+                  for frame in initiator.get("stack", {}).get("callFrames", []) ]
+        if len(stack) == 0 and initiator.get("url") is not None:
+            stack = [ { "url": initiator["url"], "function": "", "line": initiator.get("lineNumber", 0) + 1,
+                        "column": initiator.get("columnNumber", 0) + 1 } ]
+        caller_source = "iframe" if request.get("type") == "Document" else "fetch"
+        self.add_call(session_id, get_origin(request["request"]["url"]), caller_source, get_chrome_time(request["wallTime"]), stack,
+                      request.get("documentURL"))
+
+    def add_call(self, session_id, context_origin_url, caller_source, usage_time, stack, frame_url):
+        caller_url = next((frame["url"] for frame in stack if frame["url"].startswith("http")), None)
+        with self.lock:
+            self.calls.append({ "context_origin_url": context_origin_url, "caller_source": caller_source,
+                                "usage_time": usage_time, "caller_url": caller_url, "stack": stack,
+                                "frame_url": frame_url, "target_id": self.pages.get(session_id) })
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+        self.thread.join(timeout=5)
+
+
+def parse_stack(stack):
+    # Frames of a V8 stack trace, from the innermost
+    frames = []
+    for line in stack.split("\n")[1:]:
+        match = STACK_FRAME_REGEX.match(line)
+        if match is not None:
+            function, url, line_number, column = match.groups()
+            frames.append({ "url": url, "function": function or "", "line": int(line_number), "column": int(column) })
+    return frames
+
+
+def get_chrome_time(seconds):
+    # Microseconds since 1601-01-01, as the usage_time of the BrowsingTopicsSiteData DB
+    return int((seconds + CHROME_EPOCH_OFFSET) * 1000000)
+
+
+def get_origin(url):
+    # Same format of the context_origin_url of the BrowsingTopicsSiteData DB
+    parse_result = urlparse(url)
+    return "{}://{}/".format(parse_result.scheme, parse_result.netloc)
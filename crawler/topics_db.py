@@ -0,0 +1,99 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+USAGES_QUERY = "SELECT context_origin_url, caller_source, usage_time\
+                FROM browsing_topics_api_usages_complete, browsing_topics_api_hashed_to_unhashed_domain\
+                WHERE browsing_topics_api_usages_complete.hashed_context_domain = browsing_topics_api_hashed_to_unhashed_domain.hashed_context_domain\
+                AND usage_time > ?"
+
+
+class TopicsDatabase:
+    # Incremental reader of the BrowsingTopicsSiteData DB of a running Chrome. The DB is opened read-only and
+    # immutable, so that Chrome's lock is ignored and nothing is copied. Since an immutable connection never sees
+    # later changes, it is reopened only when the DB files change. Only the usages newer than the last one read
+    # (the high-water mark) are queried, and those already read are kept in memory
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.version = None
+        self.tmp_dir = None
+        self.usages = []
+        self.low_water = 0
+        self.high_water = 0
+
+    def get_usages(self, after = 0):
+        # Usages recorded after the given time, and the time of the last one (0 if none)
+        reread = after < self.low_water
+        if reread:
+            self.usages = []
+            self.high_water = after
+        elif after > self.low_water:
+            # Usages before the cursor are not needed anymore
+            self.usages = [ usage for usage in self.usages if usage["usage_time"] > after ]
+            self.high_water = max(self.high_water, after)
+        self.low_water = after
+
+        if self.refresh() or reread:
+            try:
+                rows = self.conn.execute(USAGES_QUERY, [self.high_water]).fetchall()
+            except sqlite3.DatabaseError:
+                # E.g. a page being written by Chrome, or tables not created yet: the connection is reopened, and the
+                # usages read again, at the next call
+                self.close()
+                raise
+            for context_origin_url, caller_source, usage_time in rows:
+                self.usages.append({ "context_origin_url": context_origin_url, "caller_source": caller_source, "usage_time": usage_time })
+                self.high_water = max(self.high_water, usage_time)
+
+        return list(self.usages), max([ usage["usage_time"] for usage in self.usages ], default=0)
+
+    def get_last_usage_time(self):
+        # Time of the last usage recorded, querying only the usages newer than the high-water mark
+        self.get_usages(self.high_water)
+        return self.high_water
+
+    def refresh(self):
+        # Reopen the connection if the DB changed since it was opened. Raises FileNotFoundError if the DB does not
+        # exist yet
+        version = self.get_version()
+        if version == self.version:
+            return False
+        self.close()
+        if version[1] is None:
+            self.conn = sqlite3.connect("file:{}?mode=ro&immutable=1".format(self.path), uri=True)
+        else:
+            # An immutable connection ignores the write-ahead log: copy the DB and its log instead
+            self.conn = sqlite3.connect(self.copy_snapshot())
+        self.version = version
+        return True
+
+    def get_version(self):
+        stat = os.stat(self.path)
+        try:
+            wal_stat = os.stat(self.path + "-wal")
+        except FileNotFoundError:
+            wal_stat = None
+        db_version = (stat.st_mtime_ns, stat.st_size)
+        if wal_stat is None or wal_stat.st_size == 0:
+            return db_version, None
+        return db_version, (wal_stat.st_mtime_ns, wal_stat.st_size)
+
+    def copy_snapshot(self):
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix="topics-db-")
+        tmp_path = os.path.join(self.tmp_dir, os.path.basename(self.path))
+        shutil.copy(self.path, tmp_path)
+        shutil.copy(self.path + "-wal", tmp_path + "-wal")
+        return tmp_path
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.version = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
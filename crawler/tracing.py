@@ -0,0 +1,213 @@
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+SAMPLING_INTERVAL = 0.005
+# Spans of WebDriver commands are named after the command, the ones of CDP commands after the CDP method
+CDP_COMMAND = "executeCdpCommand"
+
+
+class Tracer:
+    # Spans of the phases of a visit and of every WebDriver and CDP call, with their call counts and the bytes
+    # exchanged with chromedriver, saved in Chrome trace-event format: the file can be opened in chrome://tracing
+    # or https://ui.perfetto.dev. A disabled tracer records nothing
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.path = None
+        self.metadata = {}
+        self.phase = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events = []
+            self.summary = {}
+            self.origin = time.perf_counter()
+            self.origin_time = time.time()
+
+    def start_phase(self, name, **args):
+        # Phases of a visit follow each other: starting a phase ends the previous one. The trace is saved at the start
+        # of every phase, so that a visit killed by a timeout still leaves a trace, ending with the phase it was in
+        if not self.enabled:
+            return
+        self.close_phase()
+        self.phase = self.span(name, "phase", **args)
+        self.phase.__enter__()
+        self.save()
+
+    def end_phase(self):
+        if self.phase is not None:
+            self.close_phase()
+            self.save()
+
+    def close_phase(self):
+        if self.phase is not None:
+            self.phase.__exit__(None, None, None)
+            self.phase = None
+
+    @contextmanager
+    def span(self, name, category="phase", **args):
+        if not self.enabled:
+            yield None
+            return
+        stack = self.get_stack()
+        span = { "name": name, "cat": category, "args": args, "bytes-sent": 0, "bytes-received": 0 }
+        stack.append(span)
+        start = span["start"] = time.perf_counter()
+        try:
+            yield span
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            self.add_event(span, start, duration)
+
+    def get_open_events(self):
+        # Spans not ended yet, as begin events
+        now = time.perf_counter()
+        return [ { "name": span["name"], "cat": span["cat"], "ph": "B", "pid": self.pid, "tid": threading.get_ident(),
+                   "ts": round((span["start"] - self.origin) * 1e6, 1), "args": { **span["args"], "open": round(now - span["start"], 3) } }
+                 for span in self.get_stack() ]
+
+    def get_stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def add_bytes(self, sent, received):
+        # Bytes of a request to chromedriver, charged to the innermost span of the thread
+        stack = self.get_stack()
+        if len(stack) > 0:
+            stack[-1]["bytes-sent"] += sent
+            stack[-1]["bytes-received"] += received
+
+    def add_event(self, span, start, duration):
+        args = span["args"]
+        if span["bytes-sent"] > 0 or span["bytes-received"] > 0:
+            args = { **args, "bytes-sent": span["bytes-sent"], "bytes-received": span["bytes-received"] }
+        event = { "name": span["name"], "cat": span["cat"], "ph": "X", "pid": self.pid, "tid": threading.get_ident(),
+                  "ts": round((start - self.origin) * 1e6, 1), "dur": round(duration * 1e6, 1), "args": args }
+        key = "{}:{}".format(span["cat"], span["name"])
+        with self.lock:
+            self.events.append(event)
+            entry = self.summary.setdefault(key, { "count": 0, "time": 0, "bytes-sent": 0, "bytes-received": 0 })
+            entry["count"] += 1
+            entry["time"] += duration
+            entry["bytes-sent"] += span["bytes-sent"]
+            entry["bytes-received"] += span["bytes-received"]
+
+    def trace_methods(self, obj, names, category):
+        # Record every call of some methods of an object
+        if not self.enabled:
+            return obj
+        for name in names:
+            method = getattr(obj, name)
+            setattr(obj, name, self.wrap(method, name, category))
+        return obj
+
+    def wrap(self, function, name, category):
+        def traced(*args, **kwargs):
+            with self.span(name, category):
+                return function(*args, **kwargs)
+        return traced
+
+    def trace_driver(self, driver):
+        # Every WebDriver command goes through driver.execute, CDP commands included, and every request to
+        # chromedriver through the connection pool of its executor, whose bytes are counted
+        if not self.enabled:
+            return driver
+        execute = driver.execute
+
+        def traced_execute(driver_command, params=None):
+            if driver_command == CDP_COMMAND and params is not None:
+                name, category = params.get("cmd"), "cdp"
+            else:
+                name, category = driver_command, "webdriver"
+            with self.span(name, category):
+                return execute(driver_command, params)
+        driver.execute = traced_execute
+
+        connection = getattr(driver.command_executor, "_conn", None)
+        if connection is not None:
+            request = connection.request
+
+            def traced_request(method, url, body=None, **kwargs):
+                response = request(method, url, body=body, **kwargs)
+                self.add_bytes(len(body) if body is not None else 0, len(response.data or b""))
+                return response
+            connection.request = traced_request
+        return driver
+
+    def save(self):
+        # Trace file in JSON object format, with the totals of each span name, if a path is set
+        if self.path is None:
+            return
+        with self.lock:
+            trace = { "traceEvents": [ { "name": "process_name", "ph": "M", "pid": self.pid, "args": { "name": "priv-accept" } } ] +
+                                     self.events + self.get_open_events(),
+                      "displayTimeUnit": "ms",
+                      "otherData": { **self.metadata, "start-time": self.origin_time },
+                      "summary": self.summary }
+        with (gzip.open(self.path, "wt") if self.path.endswith(".gz") else open(self.path, "w")) as file:
+            json.dump(trace, file)
+
+
+class Profiler:
+    # Profile of the crawler process: either deterministic, with cProfile, saved in pstats format, or sampled, by
+    # reading the stack of the main thread every few milliseconds, saved as collapsed stacks (one line per stack
+    # with its number of samples) that flame graph tools read
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.profile = None
+        self.samples = {}
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.kind == "cprofile":
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.kind == "sampling":
+            self.samples = {}
+            self.running = True
+            self.thread = threading.Thread(target=self.sample, args=(threading.main_thread().ident,), daemon=True)
+            self.thread.start()
+
+    def sample(self, thread_id):
+        while self.running:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append("{}:{}".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(SAMPLING_INTERVAL)
+
+    def stop(self, path_base):
+        # Save the profile next to path_base, and return its path. None if the profiler was not started
+        if self.kind == "cprofile" and self.profile is not None:
+            self.profile.disable()
+            path = path_base + ".prof"
+            self.profile.dump_stats(path)
+            self.profile = None
+            return path
+        if self.kind == "sampling" and self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+            path = path_base + ".samples.txt"
+            with open(path, "w") as file:
+                for stack, count in sorted(self.samples.items(), key=lambda item: item[1], reverse=True):
+                    file.write("{} {}\n".format(stack, count))
+            return path
+        return None
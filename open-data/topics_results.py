@@ -0,0 +1,311 @@
+import json
+import os
+import sys
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analyze-topics-api"))
+from get_domain import getGood2LD
+
+# Columns identifying a website in a campaign
+SITE_KEY = [ "date", "location", "domain" ]
+
+DOMAIN_GROUPS = {
+    "EU": [ ".eu", ".at", ".be", ".bg", ".cy", ".cz", ".de", ".dk", ".es", ".fi", ".fr", ".ee", ".hr", ".hu", ".gr", ".ie", ".it", ".lt", ".lv", ".lu", ".mt", ".nl", ".pl", ".pt", ".ro", ".sk", ".si", ".se", ".uk", ".co.uk" ],
+    ".com": [ ".com" ],
+    ".ru": [ ".ru" ],
+    ".jp": [ ".co.jp", ".jp" ]
+}
+
+DOMAIN_TO_CMP = {'cookielaw.org': "OneTrust",
+                 'onetrust.com': "OneTrust",
+                 'cookiepro.com': "OneTrust",
+                 'usercentrics.eu': "Usercentrics",
+                 'cookiebot.com': "Cookiebot",
+                 'privacy-center.org': "Didomi",
+                 'privacy-mgmt.com': "Sourcepoint",
+                 'iubenda.com': "Iubenda",
+                 'hs-banner.com': "HubSpot",
+                 'hs-scripts.com': "HubSpot",
+                 'axept.io': "Axeptio",
+                 'cdn-cookieyes.com': "CookieYes",
+                 'cookie-script.com' : "CookieScript",
+                 'oath.com': 'Yahoo',
+                 'trustarc.com': 'TrustArc',
+                 'consensu.org': 'IAB Europe',
+                 'priv.center': 'Truendo',
+                 'r42tag.com':'Relay42',
+                 'clarip.com': 'Clarip',
+                 'evidon.com': 'Crownpeak',
+                 'appconsent.io': 'SFBX',
+                 'fastcmp.com': 'Fastcmp',
+                 'seersco.com': 'Seers',
+                 'cookieyes.com': 'CookieYes',
+                 'dmgmediaprivacy.co.uk': 'DMG media',
+                 'cookieinformation.com': 'Cookie Information',
+                 'legalmonster.com': 'Openli',
+                 'goadopt.io': 'AdOpt',
+                 'opencmp.net': 'OpenCMP',
+                 'magix.com': 'Magix',
+                 'sddan.com': 'Sirdata',
+                 'hu-manity.co': 'Hu-manity',
+                 'truendo.com': 'Truendo',
+                 'cookieform.pl': 'CookieForm',
+                 'pubtech.ai': 'Pubtech',
+                 'uniconsent.com': 'UniConsent',
+                 'civiccomputing.com': 'Civic',
+                 'google.com': 'Funding Choices',
+                 'cookieinfoscript.com': 'CookieScript',
+                 'convead.io': 'Convead',
+                 'optanon.blob.core.windows.net': 'Microsoft',
+                 'tarteaucitron.io': 'Tarte Au Citron',
+                 'idmnet.pl': 'IDM Net',
+                 'setupcmp.com': 'SetupAd',
+                 'efilli.com': 'Efilli',
+                 'privacymanager.io': 'LiveRamp',
+                 'clickiocmp.com': 'Clickio',
+                 'axelspringer.com': 'Axel Springer',
+                 'ccm19.de': 'CCM19',
+                 'cookiefirst.com': 'CookieFirst',
+                 'consentframework.com': 'Sirdata',
+                 'cookiehub.net': 'CookieHub',
+                 'md-nx.com': 'Stroeer',
+                 'privacytools.com.br': 'PrivacyTools',
+                 'hulkapps.com': 'HulkApps',
+                 'termly.io': 'Termly',
+                 'secureprivacy.ai': 'SecurePrivacy',
+                 'osano.com': 'Osano',
+                 'truste.com': 'TrustArc',
+                 'ketchcdn.com': 'Ketch',
+                 'cookiespool.com': 'CookieSpool',
+                }
+
+
+def cached(method):
+    # Compute an aggregate once per set of arguments
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self.cache:
+            self.cache[key] = method(self, *args, **kwargs)
+        return self.cache[key]
+    return wrapper
+
+
+def map_unique(series, function):
+    # Apply function once per distinct value
+    values = series.unique()
+    return series.map(dict(zip(values, map(function, values))))
+
+
+def get_public_suffix(url):
+    # Public suffix of the site of a URL with a leading dot, e.g. ".co.uk" for https://www.bbc.co.uk/
+    domain = getGood2LD(url)
+    if domain is None or "." not in domain:
+        return None
+    return "." + domain.split(".", 1)[1]
+
+
+def get_domain_group(suffix):
+    for group, group_suffixes in DOMAIN_GROUPS.items():
+        if suffix in group_suffixes:
+            return group
+    return "Other"
+
+
+class TopicsResults:
+    # Results of one or more campaigns as long tables, one row per site visit, Topics API usage, Attested or Allowed
+    # domain and consent manager, with the aggregates used by the notebook computed with grouped operations.
+    # Stage "first" considers all the sites (DSba), stage "second" only the ones where the banner was clicked (DSaa)
+
+    def __init__(self, visits, topics_api_usages, domains, consent_managers):
+        self.visits = visits
+        self.topics_api_usages = topics_api_usages
+        self.domains = domains
+        self.consent_managers = consent_managers
+        self.cache = {}
+
+    @classmethod
+    def from_dataset(cls, dataset_dir, filters=None):
+        # Load the campaigns dataset written by postprocess.py, only from the partitions matching the filters
+        from campaign_dataset import read_table
+
+        def read(table, columns):
+            return categorize(read_table(dataset_dir, table, columns=columns + [ "date", "location" ], filters=filters).to_pandas())
+
+        return cls(
+            read("visits", [ "domain", "stage", "banner_clicked", "has_gtm", "topics_api_usages" ]),
+            read("topics_api_usages", [ "domain", "stage", "context_domain", "caller_source", "allowed", "attested" ]),
+            read("domains", [ "domain", "stage", "third_party", "attested", "allowed" ]),
+            read("consent_managers", [ "domain", "stage", "consent_manager" ])
+        )
+
+    @classmethod
+    def from_csv(cls, path, date="", location=""):
+        # Load a CSV file with the analyses of a campaign, e.g. analyze-topics-api-output.csv, decoding each JSON cell once
+        df = pd.read_csv(path)
+        visits, usages, domains, consent_managers = [], [], [], []
+        for stage in [ "first", "second" ]:
+            df_stage = df[~df[f"{stage}_topics_api_usages"].isna()]
+            site = df_stage["domain"].to_numpy()
+            cells = { field: [ json.loads(cell) for cell in df_stage[f"{stage}_{field}"] ]
+                      for field in [ "topics_api_usages", "attested_domains", "allowed_domains", "consent_managers" ] }
+
+            visits.append(pd.DataFrame({ "domain": site, "stage": stage, "banner_clicked": df_stage["banner_clicked"].to_numpy(dtype=bool),
+                                         "has_gtm": df_stage[f"{stage}_has_gtm"].to_numpy(dtype=bool),
+                                         "topics_api_usages": [ len(cell) for cell in cells["topics_api_usages"] ] }))
+
+            usages_site, usages_list = explode_lists(site, cells["topics_api_usages"])
+            usages.append(pd.DataFrame({ "domain": usages_site, "stage": stage,
+                                         "context_origin_url": [ usage["context_origin_url"] for usage in usages_list ],
+                                         "caller_source": [ usage["caller_source"] for usage in usages_list ],
+                                         "allowed": [ usage.get("allowed", False) for usage in usages_list ],
+                                         "attested": [ usage.get("attested", False) for usage in usages_list ] }))
+
+            stage_domains = []
+            for field, column in [ ("attested_domains", "attested"), ("allowed_domains", "allowed") ]:
+                domains_site, third_parties = explode_lists(site, cells[field])
+                stage_domains.append(pd.DataFrame({ "domain": domains_site, "third_party": third_parties, column: True }))
+            stage_domains = pd.concat(stage_domains).groupby([ "domain", "third_party" ], as_index=False)[[ "attested", "allowed" ]] \
+                                                    .any()
+            stage_domains["stage"] = stage
+            domains.append(stage_domains)
+
+            cmps_site, cmps = explode_lists(site, cells["consent_managers"])
+            consent_managers.append(pd.DataFrame({ "domain": cmps_site, "stage": stage, "consent_manager": cmps }))
+
+        usages = pd.concat(usages, ignore_index=True)
+        usages["context_domain"] = map_unique(usages["context_origin_url"], getGood2LD)
+        usages = usages.drop(columns="context_origin_url")
+
+        tables = []
+        for table in [ visits, [ usages ], domains, consent_managers ]:
+            table = pd.concat(table, ignore_index=True)
+            table["date"] = date
+            table["location"] = location
+            tables.append(categorize(table))
+        return cls(*tables)
+
+    def get_sites(self, stage):
+        # Visits of the sites in the dataset of the stage
+        visits = self.visits[self.visits["stage"] == stage]
+        if stage == "second":
+            visits = visits[visits["banner_clicked"]]
+        return visits
+
+    def select(self, table, stage):
+        # Rows of a table for the sites in the dataset of the stage
+        rows = table[table["stage"] == stage]
+        if stage == "second":
+            rows = rows.merge(self.get_sites(stage)[SITE_KEY], on=SITE_KEY)
+        return rows
+
+    @cached
+    def count_sites_with_usages(self, stage):
+        # Number of sites in the dataset of the stage, and number of them where the Topics API was called
+        sites = self.get_sites(stage)
+        return len(sites), int((sites["topics_api_usages"] > 0).sum())
+
+    @cached
+    def get_domain_sets(self, stage):
+        # Distinct callers, Attested and Allowed domains found in the dataset of the stage
+        domains = self.select(self.domains, stage)
+        return {
+            "callers": set(self.select(self.topics_api_usages, stage)["context_domain"].dropna().unique()),
+            "attested": set(domains.loc[domains["attested"], "third_party"].unique()),
+            "allowed": set(domains.loc[domains["allowed"], "third_party"].unique())
+        }
+
+    @cached
+    def count_callers(self, stage):
+        # Number of sites where each calling party called the Topics API, most common first
+        usages = self.select(self.topics_api_usages, stage)
+        return count_by(usages.drop_duplicates(SITE_KEY + [ "context_domain" ]), "context_domain") \
+                   .rename_axis("third_party").rename("count_usages")
+
+    @cached
+    def count_third_parties(self, stage):
+        # For each Allowed third party: number of sites where it is present and where it called the Topics API,
+        # and percentage of the sites where it is present in which it called the API
+        domains = self.select(self.domains, stage)
+        count_allowed = count_by(domains[domains["allowed"]].drop_duplicates(SITE_KEY + [ "third_party" ]), "third_party") \
+                        .rename("count_allowed")
+        counts = count_allowed.to_frame().join(self.count_callers(stage), how="left").fillna(0)
+        counts["percentage"] = counts["count_usages"] * 100 / counts["count_allowed"]
+        return counts
+
+    @cached
+    def get_site_groups(self):
+        # Public suffix and domain group of each site
+        sites = self.visits[SITE_KEY].drop_duplicates()
+        sites["tld"] = map_unique(sites["domain"], get_public_suffix)
+        sites["domain_group"] = map_unique(sites["tld"], get_domain_group)
+        return sites
+
+    @cached
+    def count_third_parties_by_domain_group(self, stage):
+        # Same as count_third_parties, for the sites of each domain group
+        site_groups = self.get_site_groups()
+        domains = self.select(self.domains, stage)
+        allowed = domains[domains["allowed"]].merge(site_groups, on=SITE_KEY).drop_duplicates(SITE_KEY + [ "third_party" ])
+        count_allowed = count_by(allowed, [ "domain_group", "third_party" ]).rename("count_allowed")
+        usages = self.select(self.topics_api_usages, stage).merge(site_groups, on=SITE_KEY) \
+                     .drop_duplicates(SITE_KEY + [ "context_domain" ])
+        count_usages = count_by(usages, [ "domain_group", "context_domain" ]) \
+                       .rename_axis([ "domain_group", "third_party" ]).rename("count_usages")
+        counts = count_allowed.to_frame().join(count_usages, how="left").fillna(0).reset_index()
+        counts["percentage"] = counts["count_usages"] * 100 / counts["count_allowed"]
+        return counts
+
+    @cached
+    def get_cmp_probabilities(self, stage, min_sites=50):
+        # For each CMP found in at least min_sites sites: P(CMP=x) over all the sites in the dataset of the stage, and
+        # P(CMP=x | questionable call) over the sites where the Topics API was called. Sorted by the latter
+        sites = self.get_sites(stage)
+        sites_with_calls = sites[sites["topics_api_usages"] > 0]
+        cmps = self.select(self.consent_managers, stage)
+        cmps = cmps.assign(cmp=cmps["consent_manager"].astype(str).map(DOMAIN_TO_CMP)).dropna(subset="cmp") \
+                   .drop_duplicates(SITE_KEY + [ "cmp" ])
+        count = count_by(cmps, "cmp").rename("count")
+        count_with_calls = count_by(cmps.merge(sites_with_calls[SITE_KEY], on=SITE_KEY), "cmp").rename("count_with_calls")
+
+        probabilities = count.to_frame().join(count_with_calls, how="left").fillna(0)
+        probabilities = probabilities[probabilities["count"] >= min_sites]
+        probabilities["p_cmp"] = probabilities["count"] / len(sites)
+        probabilities["p_cmp_given_call"] = probabilities["count_with_calls"] / len(sites_with_calls)
+        return probabilities.sort_values("p_cmp_given_call", ascending=False)
+
+    @cached
+    def count_first_party_unauthorised_calls(self, stage):
+        # Number of sites where the site itself called the Topics API without being Allowed, and how many of them
+        # include Google Tag Manager
+        sites = self.get_sites(stage)
+        usages = self.select(self.topics_api_usages, stage)
+        usages = usages[usages["context_domain"].astype(str) == map_unique(usages["domain"].astype(str), getGood2LD)]
+        domains = self.select(self.domains, stage)
+        allowed = domains.loc[domains["allowed"], SITE_KEY + [ "third_party" ]].rename(columns={ "third_party": "context_domain" })
+        usages = usages.merge(allowed, on=SITE_KEY + [ "context_domain" ], how="left", indicator=True)
+        unauthorised = usages.loc[usages["_merge"] == "left_only", SITE_KEY].drop_duplicates()
+        unauthorised = unauthorised.merge(sites[SITE_KEY + [ "has_gtm" ]], on=SITE_KEY)
+        return len(unauthorised), int(unauthorised["has_gtm"].sum())
+
+
+def count_by(table, columns):
+    # Number of rows for each value of columns found in the table, most common first
+    return table.groupby(columns, observed=True).size().sort_values(ascending=False, kind="stable")
+
+
+def explode_lists(keys, lists):
+    # Pair each item of each list with the key of its list, without copying the other columns
+    lengths = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+    return np.repeat(keys, lengths), [ item for items in lists for item in items ]
+
+
+def categorize(table):
+    # Repeated strings as categoricals, to cut the memory of multi-campaign tables
+    for column in table.columns:
+        if table[column].dtype == object and column not in [ "banner_clicked", "has_gtm", "allowed", "attested" ]:
+            table[column] = table[column].astype("category")
+    return table
@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import sys
+from attestations_index import API_VALUES, build_index, open_attestations, diff_indexes, get_list_version, \
+                               INDEX_EXTENSION
+
+parser = argparse.ArgumentParser(description="Index the privacy-sandbox-attestations.dat lists of Chrome, to look up and compare them without parsing them again.")
+subparsers = parser.add_subparsers(dest='command', required=True)
+
+build_parser = subparsers.add_parser('build', help="Build the index of a list, named after its version")
+build_parser.add_argument('attestations_file', type=str)
+build_parser.add_argument('--index_dir', type=str, default=None)
+build_parser.add_argument('--version', type=str, default=None)
+
+lookup_parser = subparsers.add_parser('lookup', help="Print the APIs attested by the given domains")
+lookup_parser.add_argument('attestations_file', type=str)
+lookup_parser.add_argument('domains', type=str, nargs='+')
+lookup_parser.add_argument('--index_dir', type=str, default=None)
+
+dump_parser = subparsers.add_parser('dump', help="Print the domains attested for an API, one per line, as allowed_domains.txt")
+dump_parser.add_argument('attestations_file', type=str)
+dump_parser.add_argument('--api', type=str, default='TOPICS', choices=list(API_VALUES))
+dump_parser.add_argument('--index_dir', type=str, default=None)
+
+diff_parser = subparsers.add_parser('diff', help="Print the domains added, removed or changed between two versions of the list")
+diff_parser.add_argument('old_file', type=str)
+diff_parser.add_argument('new_file', type=str)
+diff_parser.add_argument('--index_dir', type=str, default=None)
+
+def main(args):
+    if args.command == "build":
+        index_dir = args.index_dir if args.index_dir is not None else os.path.dirname(os.path.abspath(args.attestations_file))
+        version = args.version if args.version is not None else get_list_version(args.attestations_file)
+        print(build_index(args.attestations_file, os.path.join(index_dir, version + INDEX_EXTENSION), version))
+    elif args.command == "lookup":
+        index = open_attestations(args.attestations_file, args.index_dir)
+        for domain in args.domains:
+            print("{},{}".format(domain, " ".join(index.get_apis(domain))))
+    elif args.command == "dump":
+        index = open_attestations(args.attestations_file, args.index_dir)
+        for domain in sorted(index.get_domains(args.api)):
+            print(domain)
+    else:
+        old = open_attestations(args.old_file, args.index_dir)
+        new = open_attestations(args.new_file, args.index_dir)
+        added, removed, changed = diff_indexes(old, new)
+        print("Version {} ({} domains) -> {} ({} domains): {} added, {} removed, {} changed".format(
+              old.version, len(old), new.version, len(new), len(added), len(removed), len(changed)), file=sys.stderr)
+        for domain in added:
+            print(json.dumps({"change": "added", "domain": domain, "apis": new.get_apis(domain)}))
+        for domain in removed:
+            print(json.dumps({"change": "removed", "domain": domain, "apis": old.get_apis(domain)}))
+        for domain, old_apis, new_apis in changed:
+            print(json.dumps({"change": "changed", "domain": domain, "old_apis": old_apis, "apis": new_apis}))
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from get_domain import getFullDomain
+
+# Values of PrivacySandboxAttestationsGatedAPIProto, see privacy_sandbox_attestations.proto
+API_NAMES = { 1: "TOPICS", 2: "PROTECTED_AUDIENCE", 3: "PRIVATE_AGGREGATION", 4: "ATTRIBUTION_REPORTING", 5: "SHARED_STORAGE" }
+API_VALUES = { name: value for value, name in API_NAMES.items() }
+
+INDEX_MAGIC = b"PSATTIDX"
+INDEX_FORMAT = 1
+INDEX_EXTENSION = ".idx"
+# Magic, format, all_apis mask, number of sites, number of slots, length of the version string
+HEADER = struct.Struct("<8sIIIII")
+# Offset of the domain in the string pool, its length (0 for an empty slot) and the mask of its attested APIs
+SLOT = struct.Struct("<IHH")
+VERSION_REGEX = re.compile(r"^\d+(\.\d+)*$")
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_fields(data):
+    # Fields of a protobuf message as (number, wire type, value), the value of length-delimited fields as bytes
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == WIRE_LENGTH:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_FIXED64:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type {} of field {}".format(wire_type, number))
+        yield number, wire_type, value
+
+
+def read_enums(wire_type, value):
+    # Repeated enums are packed in proto3, but parsers must also accept them unpacked
+    if wire_type == WIRE_VARINT:
+        return [ value ]
+    enums = []
+    pos = 0
+    while pos < len(value):
+        enum, pos = read_varint(value, pos)
+        enums.append(enum)
+    return enums
+
+
+def get_mask(apis):
+    mask = 0
+    for api in apis:
+        mask |= 1 << api
+    return mask
+
+
+def get_api_names(mask):
+    return [ name for value, name in API_NAMES.items() if mask & (1 << value) ]
+
+
+def read_attestations(data):
+    # Attested APIs of each site of a serialized PrivacySandboxAttestationsProto, as a mask of API values, and the
+    # mask of "all APIs". Read with a minimal decoder of the protobuf wire format, so that neither protoc nor the
+    # protobuf module are needed
+    all_apis = []
+    all_api_sites = []
+    sites = {}
+    for number, wire_type, value in read_fields(data):
+        if number == 1:
+            all_apis += read_enums(wire_type, value)
+        elif number == 2:
+            all_api_sites.append(value.decode())
+        elif number == 3:
+            # Map entry: key 1 is the site, value 2 is a PrivacySandboxAttestedAPIsProto
+            site, apis = "", []
+            for entry_number, entry_wire_type, entry_value in read_fields(value):
+                if entry_number == 1:
+                    site = entry_value.decode()
+                elif entry_number == 2:
+                    apis += [ api for api_number, api_wire_type, api_value in read_fields(entry_value) if api_number == 1
+                              for api in read_enums(api_wire_type, api_value) ]
+            sites[site] = get_mask(apis)
+    all_mask = get_mask(all_apis) if len(all_apis) > 0 else get_mask(API_NAMES)
+    for site in all_api_sites:
+        sites[site] = all_mask
+    return sites, all_mask
+
+
+def get_list_version(path):
+    # Chrome keeps each version of the list in PrivacySandboxAttestationsPreloaded/<version>/, next to a manifest.
+    # Lists copied elsewhere are identified by their content
+    manifest_path = os.path.join(os.path.dirname(path), "manifest.json")
+    try:
+        with open(manifest_path) as file:
+            return str(json.load(file)["version"])
+    except (OSError, ValueError, KeyError):
+        pass
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    if VERSION_REGEX.match(folder):
+        return folder
+    with open(path, "rb") as file:
+        return "sha256-" + hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def get_slot(key, num_slots):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") & (num_slots - 1)
+
+
+def build_index(attestations_path, index_path, version=None):
+    # Write the index of a list: a header, an open-addressing hash table of the domains, at most half full, and the
+    # pool of the domain names. Domains are the ones of the attested sites, as in allowed_domains.txt
+    with open(attestations_path, "rb") as file:
+        sites, all_mask = read_attestations(file.read())
+    if version is None:
+        version = get_list_version(attestations_path)
+
+    domains = {}
+    for site, mask in sites.items():
+        domain = getFullDomain(site).encode()
+        domains[domain] = domains.get(domain, 0) | mask
+    num_slots = 1
+    while num_slots < 2 * len(domains):
+        num_slots *= 2
+
+    slots = [ None ] * num_slots
+    pool = bytearray()
+    for domain in sorted(domains):
+        slot = get_slot(domain, num_slots)
+        while slots[slot] is not None:
+            slot = (slot + 1) & (num_slots - 1)
+        slots[slot] = (len(pool), len(domain), domains[domain])
+        pool += domain
+
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(index_dir, exist_ok=True)
+    # Write to a temporary file first, so that readers never map a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        encoded_version = version.encode()
+        file.write(HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, all_mask, len(domains), num_slots, len(encoded_version)))
+        file.write(encoded_version)
+        file.write(b"".join(SLOT.pack(*slot) if slot is not None else SLOT.pack(0, 0, 0) for slot in slots))
+        file.write(pool)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def is_index(path):
+    with open(path, "rb") as file:
+        return file.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+
+
+def open_attestations(path, index_dir=None):
+    # Index of a list, either an index file or a privacy-sandbox-attestations.dat. The index of a list is kept in
+    # <index_dir>/<version>.idx (by default, next to the list) and built only the first time
+    if is_index(path):
+        return AttestationsIndex(path)
+    if index_dir is None:
+        index_dir = os.path.dirname(os.path.abspath(path))
+    version = get_list_version(path)
+    index_path = os.path.join(index_dir, version + INDEX_EXTENSION)
+    if not os.path.exists(index_path):
+        build_index(path, index_path, version)
+    return AttestationsIndex(index_path)
+
+
+class AttestationsIndex:
+    # Read-only view of an index built by build_index. The file is memory-mapped, so that opening it costs nothing,
+    # lookups only touch a slot and a domain name, and the processes using the same index share its pages
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_format, self.all_mask, self.num_sites, self.num_slots, version_length = HEADER.unpack_from(self.mm, 0)
+        if magic != INDEX_MAGIC or index_format != INDEX_FORMAT:
+            raise ValueError("{} is not an attestations index of format {}".format(path, INDEX_FORMAT))
+        self.version = self.mm[HEADER.size:HEADER.size + version_length].decode()
+        self.slots_offset = HEADER.size + version_length
+        self.pool_offset = self.slots_offset + self.num_slots * SLOT.size
+
+    def get_mask(self, domain):
+        # Mask of the APIs attested by a domain, 0 if not in the list
+        key = domain.encode()
+        slot = get_slot(key, self.num_slots)
+        while True:
+            offset, length, mask = SLOT.unpack_from(self.mm, self.slots_offset + slot * SLOT.size)
+            if length == 0:
+                return 0
+            if length == len(key) and self.mm[self.pool_offset + offset:self.pool_offset + offset + length] == key:
+                return mask
+            slot = (slot + 1) & (self.num_slots - 1)
+
+    def get_apis(self, domain):
+        return get_api_names(self.get_mask(domain))
+
+    def is_attested(self, domain, api="TOPICS"):
+        return self.get_mask(domain) & (1 << API_VALUES[api]) != 0
+
+    def get_domains(self, api="TOPICS"):
+        return AttestedDomains(self, api)
+
+    def __len__(self):
+        return self.num_sites
+
+    def __iter__(self):
+        # Domains and masks, in no particular order
+        for slot in range(self.num_slots):
+            offset, length, mask = SLOT.unpack_from(self.mm, self.slots_offset + slot * SLOT.size)
+            if length > 0:
+                yield self.mm[self.pool_offset + offset:self.pool_offset + offset + length].decode(), mask
+
+    def close(self):
+        self.mm.close()
+
+
+class AttestedDomains:
+    # The domains attested for an API, usable in place of the set read from allowed_domains.txt
+
+    def __init__(self, index, api):
+        self.index = index
+        self.api = api
+
+    def __contains__(self, domain):
+        return domain is not None and self.index.is_attested(domain, self.api)
+
+    def __iter__(self):
+        mask = 1 << API_VALUES[self.api]
+        return ( domain for domain, domain_mask in self.index if domain_mask & mask )
+
+
+def diff_indexes(old, new):
+    # Domains added to and removed from the list between two versions, and the ones whose attested APIs changed,
+    # as (domain, old APIs, new APIs)
+    added, changed = [], []
+    for domain, mask in new:
+        old_mask = old.get_mask(domain)
+        if old_mask == 0:
+            added.append(domain)
+        elif old_mask != mask:
+            changed.append((domain, get_api_names(old_mask), get_api_names(mask)))
+    removed = [ domain for domain, mask in old if new.get_mask(domain) == 0 ]
+    return sorted(added), sorted(removed), sorted(changed)
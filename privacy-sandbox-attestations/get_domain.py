@@ -1,41 +1,20 @@
-from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
-bad_domains=set("co.uk co.jp co.hu co.il com.au co.ve .co.in com.ec com.pk co.th co.nz com.br com.sg com.sa \
-com.do co.za com.hk com.mx com.ly com.ua com.eg com.pe com.tr co.kr com.ng com.pe com.pk co.th \
-com.au com.ph com.my com.tw com.ec com.kw co.in co.id com.com com.vn com.bd com.ar \
-com.co com.vn org.uk net.gr web.app".split())
+# Host extraction only, the same as in analyze-topics-api/get_domain.py, which is the only module computing
+# registrable domains with the Public Suffix List. The attestations are keyed by full domain, so the list is not
+# needed here
 
-def getGood2LD(url):
-    fqdn = getFullDomain(url)
-    if len(fqdn) == 0:
-        return None
-    if fqdn[-1] == ".":
-        fqdn = fqdn[:-1]    
-    names = fqdn.split(".")
-    if ".".join(names[-2:]) in bad_domains:
-        return get3LD(fqdn)
-    tln_array = names[-2:]
-    tln = ""
-    for s in tln_array:
-        tln = tln + "." + s
-    return tln[1:]
-
-def get3LD(url):
-    fqdn = getFullDomain(url)
-    if len(fqdn) == 0:
-        return None
-    if fqdn[-1] == ".":
-        fqdn = fqdn[:-1]
-    names = fqdn.split(".")
-    tln_array = names[-3:]
-    tln = ""
-    for s in tln_array:
-        tln = tln + "." + s
-    return tln[1:]
 
 def getFullDomain(url) -> str:
-    parse_result = urlparse(url)
-    domain = parse_result.netloc if len(parse_result.scheme) > 0 else parse_result.path
-    domain_levels = domain.strip(".").split(".")
-    level = len(domain_levels)
-    return '.'.join(domain_levels[-level:])
\ No newline at end of file
+    parse_result = urlsplit(url)
+    netloc = parse_result.netloc if len(parse_result.scheme) > 0 else parse_result.path
+    return getHostOfNetloc(netloc)
+
+def getHostOfNetloc(netloc) -> str:
+    # Remove credentials and port, if any
+    host = netloc.rpartition("@")[2]
+    if host.startswith("["):
+        host = host[:host.find("]") + 1]
+    elif ":" in host:
+        host = host.partition(":")[0]
+    return host.strip(".").lower()